@@ -0,0 +1,57 @@
+"""
+Compare the authorizer's throughput for Basic auth, which checks a salted HMAC of
+the API key against the credential store, with signed tokens, which only check
+their own signature. Both are measured with the decision cache off (every request
+is a cold decision) and on (every request after the first is a cache hit).
+
+Run from the authorizer directory:
+
+    python -m benchmarks.verify
+"""
+from base64 import b64encode
+import os
+import time
+from unittest import mock
+
+os.environ.setdefault("TOKEN_SIGNING_KEY", "benchmark-key")
+
+import main  # noqa: E402
+from tokens import issue_token  # noqa: E402
+
+ARN = "arn:aws:execute-api:us-east-1:0000000000:XXXYYY/stage/POST/some/endpoint"
+DURATION_SECONDS = 2
+
+
+def basic_event() -> dict:
+    authorization = "Basic " + b64encode(b"ethan:xyz").decode()
+    return {"methodArn": ARN, "headers": {"Authorization": authorization}}
+
+
+def bearer_event() -> dict:
+    token = issue_token("ethan", ["read", "write"])
+    return {"methodArn": ARN, "headers": {"Authorization": f"Bearer {token}"}}
+
+
+def run(name: str, event: dict, cached: bool) -> None:
+    ttl_seconds = main.DECISION_CACHE_TTL_SECONDS if cached else 0
+    with mock.patch.object(main.decision_cache, "ttl_seconds", ttl_seconds):
+        main.decision_cache.clear()
+        main.handler(event, {})
+        num_requests = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < DURATION_SECONDS:
+            main.handler(event, {})
+            num_requests += 1
+        elapsed = time.perf_counter() - start
+    print(
+        f"{name:>14}: {num_requests / elapsed:>10.0f} requests/s,"
+        f" {elapsed / num_requests * 1e6:>8.1f} us/request"
+    )
+
+
+if __name__ == "__main__":
+    main.logger.setLevel("WARNING")
+    for cached in (False, True):
+        label = "cached" if cached else "uncached"
+        run(f"basic {label}", basic_event(), cached)
+        run(f"bearer {label}", bearer_event(), cached)
@@ -0,0 +1,84 @@
+"""
+Credential stores for the authorizer.
+
+Stores hold a salted HMAC-SHA256 digest of each user's API key, never the key
+itself, and check keys in constant time. API keys are long random secrets, so
+there's nothing for a slow hash such as PBKDF2 to protect, and it would make every
+uncached check cost tens of milliseconds of CPU. FileCredentialStore reads the
+digests from a JSON file of {username: hash}. It stands in for a real store such
+as Secrets Manager, which would implement the same CredentialStore interface.
+
+To add a user to the file, print the hash of their key with
+
+    python credentials.py <api key>
+"""
+from functools import lru_cache
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sys
+from typing import Dict, Optional
+
+HASH_ALGORITHM = "hmac_sha256"
+CREDENTIALS_FILE = os.environ.get(
+    "CREDENTIALS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "credentials.json"),
+)
+
+
+def hash_api_key(api_key: str, salt: Optional[str] = None) -> str:
+    """Hash an API key as hmac_sha256$<salt>$<HMAC-SHA256 of the key>."""
+    if salt is None:
+        salt = secrets.token_hex(16)
+    digest = hmac.new(salt.encode(), api_key.encode(), hashlib.sha256).hexdigest()
+    return f"{HASH_ALGORITHM}${salt}${digest}"
+
+
+def check_api_key(api_key: str, hashed: str) -> bool:
+    """Check an API key against a hash from hash_api_key, in constant time."""
+    try:
+        algorithm, salt, _ = hashed.split("$")
+    except ValueError:
+        return False
+    if algorithm != HASH_ALGORITHM:
+        return False
+    return hmac.compare_digest(hash_api_key(api_key, salt), hashed)
+
+
+@lru_cache(maxsize=None)
+def _dummy_hash() -> str:
+    # Unknown users are checked against this, so that they take as long to reject
+    # as known users with the wrong key.
+    return hash_api_key("", "0" * 32)
+
+
+class CredentialStore:
+    def is_authorized(self, username: str, api_key: str) -> bool:
+        raise NotImplementedError
+
+
+class FileCredentialStore(CredentialStore):
+    """Reads {username: hash} from a JSON file, once."""
+
+    def __init__(self, path: str):
+        with open(path) as f:
+            self.hashes: Dict[str, str] = json.load(f)
+
+    def is_authorized(self, username: str, api_key: str) -> bool:
+        hashed = self.hashes.get(username)
+        if hashed is None:
+            check_api_key(api_key, _dummy_hash())
+            return False
+        return check_api_key(api_key, hashed)
+
+
+@lru_cache(maxsize=None)
+def get_store() -> CredentialStore:
+    """The container's credential store, loaded on first use."""
+    return FileCredentialStore(CREDENTIALS_FILE)
+
+
+if __name__ == "__main__":
+    print(hash_api_key(sys.argv[1]))
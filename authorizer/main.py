@@ -1,23 +1,32 @@
 from base64 import b64decode, b64encode
+from functools import lru_cache
+import hashlib
 import logging
-from typing import Optional
+import os
+import time
+from typing import Optional, Tuple
 from urllib.parse import unquote, quote
 
+from cache import TTLCache
+from credentials import get_store
+from tokens import InvalidToken, verify_token
+
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Allow and Deny responses are reused for this many seconds for the same
+# Authorization header and API. 0 disables the cache.
+DECISION_CACHE_TTL_SECONDS = float(os.environ.get("DECISION_CACHE_TTL_SECONDS", 300))
+DECISION_CACHE_MAX_SIZE = int(os.environ.get("DECISION_CACHE_MAX_SIZE", 10_000))
 
-def is_authorized(username: str, api_key: str) -> bool:
-    # Do a lookup in Secrets Manager.
+decision_cache = TTLCache(DECISION_CACHE_MAX_SIZE, DECISION_CACHE_TTL_SECONDS)
 
-    # But I'm cheap and don't want to pay for that for this demo, so we instead hardcode
-    # the usernames and api keys right here.
-    hardcoded_map = {"ethan": "xyz"}
-    try:
-        return hardcoded_map[username] == api_key
-    except KeyError:
-        return False
+
+def is_authorized(username: str, api_key: str) -> bool:
+    # Secrets Manager would cost money for this demo, so the keys come from a file
+    # (see credentials.py).
+    return get_store().is_authorized(username, api_key)
 
 
 """
@@ -74,6 +83,16 @@ End stolen region
 """
 
 
+@lru_cache(maxsize=256)
+def policy_document(effect: str, resource: str) -> dict:
+    return {
+        "Version": "2012-10-17",
+        "Statement": [
+            {"Action": "execute-api:Invoke", "Effect": effect, "Resource": resource}
+        ],
+    }
+
+
 def generate_auth_response(
     principal_id: str,
     usage_identifier_key: Optional[str],
@@ -81,13 +100,10 @@ def generate_auth_response(
     effect: str,
     resource: str,
 ) -> dict:
-    policy_document = {
-        "Version": "2012-10-17",
-        "Statement": [
-            {"Action": "execute-api:Invoke", "Effect": effect, "Resource": resource}
-        ],
+    auth_response = {
+        "principalId": principal_id,
+        "policyDocument": policy_document(effect, resource),
     }
-    auth_response = {"principalId": principal_id, "policyDocument": policy_document}
     if usage_identifier_key is not None:
         auth_response["usageIdentifierKey"] = usage_identifier_key
     if context is not None:
@@ -109,10 +125,7 @@ def arn_endpoint_wildcard(arn: str) -> str:
     return f"{stripped_arn}/*"
 
 
-def handler(event: dict, lambda_context: dict) -> dict:
-    arn = arn_endpoint_wildcard(event["methodArn"])
-
-    auth_header = event["headers"].get("Authorization")
+def basic_auth_response(auth_header: str, arn: str) -> dict:
     username, provided_api_key = decode(auth_header)
 
     if is_authorized(username, provided_api_key):
@@ -122,3 +135,44 @@ def handler(event: dict, lambda_context: dict) -> dict:
     else:
         logger.info("User is not authorized")
         return generate_auth_response(username, auth_header, None, "Deny", arn)
+
+
+def bearer_auth_response(auth_header: str, arn: str) -> Tuple[dict, Optional[float]]:
+    """
+    Authorize a signed token (see tokens.py) without any lookups. Returns the
+    response and, for an Allow, how many seconds it may be cached for: no longer
+    than the token is valid.
+    """
+    token = auth_header.strip().split(" ", 1)[1].strip()
+    try:
+        verified = verify_token(token)
+    except InvalidToken as e:
+        logger.info(f"Invalid token: {e}")
+        return generate_auth_response("anonymous", None, None, "Deny", arn), None
+
+    # Context values must be strings, numbers or booleans.
+    context = {"username": verified.username, "scopes": " ".join(verified.scopes)}
+    logger.info("Success! Generating auth response")
+    auth_response = generate_auth_response(
+        verified.username, auth_header, context, "Allow", arn
+    )
+    return auth_response, verified.expires_at - time.time()
+
+
+def handler(event: dict, lambda_context: dict) -> dict:
+    arn = arn_endpoint_wildcard(event["methodArn"])
+
+    auth_header = event["headers"].get("Authorization")
+    # Key the cache by a fixed-size digest of the header.
+    cache_key = (hashlib.sha256((auth_header or "").encode()).digest(), arn)
+    auth_response = decision_cache.get(cache_key)
+    if auth_response is not None:
+        return auth_response
+
+    ttl_seconds = None
+    if auth_header and auth_header.strip().lower().startswith("bearer "):
+        auth_response, ttl_seconds = bearer_auth_response(auth_header, arn)
+    else:
+        auth_response = basic_auth_response(auth_header, arn)
+    decision_cache.set(cache_key, auth_response, ttl_seconds)
+    return auth_response
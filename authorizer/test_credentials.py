@@ -0,0 +1,32 @@
+import json
+
+import credentials
+
+
+def test_hash_and_check_api_key():
+    hashed = credentials.hash_api_key("xyz")
+    assert hashed.startswith("hmac_sha256$")
+    assert credentials.check_api_key("xyz", hashed)
+    assert not credentials.check_api_key("xy", hashed)
+    # Every hash gets its own salt.
+    assert credentials.hash_api_key("xyz") != hashed
+
+
+def test_check_api_key_malformed_hash():
+    assert not credentials.check_api_key("xyz", "xyz")
+    assert not credentials.check_api_key("xyz", "md5$salt$hash")
+
+
+def test_file_credential_store(tmp_path):
+    path = tmp_path / "credentials.json"
+    hashed = credentials.hash_api_key("xyz")
+    path.write_text(json.dumps({"ethan": hashed}))
+
+    store = credentials.FileCredentialStore(str(path))
+    assert store.is_authorized("ethan", "xyz")
+    assert not store.is_authorized("ethan", "abc")
+    assert not store.is_authorized("not-ethan", "xyz")
+
+
+def test_bundled_credentials():
+    assert credentials.get_store().is_authorized("ethan", "xyz")
@@ -1,7 +1,20 @@
 from base64 import b64encode
+import os
+import subprocess
+import sys
+from unittest import mock
 from urllib.parse import quote
 
+import pytest
+
 import main
+import tokens
+
+
+@pytest.fixture(autouse=True)
+def clear_decision_cache():
+    main.decision_cache.clear()
+    yield
 
 
 def encode(username, password):
@@ -72,3 +85,86 @@ class Test_handler:
             "usageIdentifierKey": authorization,
         }
         assert result == expected
+
+    def test_decisions_are_cached(self):
+        allowed = {
+            "methodArn": "arn:aws:execute-api:us-east-1:0000000000:XXXYYY/stage/POST/a",
+            "headers": {"Authorization": encode("ethan", "xyz")},
+        }
+        denied = {
+            "methodArn": "arn:aws:execute-api:us-east-1:0000000000:XXXYYY/stage/POST/a",
+            "headers": {"Authorization": encode("ethan", "abc")},
+        }
+        other_api = {
+            "methodArn": "arn:aws:execute-api:us-east-1:0000000000:ZZZ/stage/POST/a",
+            "headers": {"Authorization": encode("ethan", "xyz")},
+        }
+        with mock.patch.object(
+            main, "is_authorized", wraps=main.is_authorized
+        ) as is_authorized:
+            first = main.handler(allowed, {})
+            assert main.handler(allowed, {}) == first
+            assert (
+                main.handler(denied, {})["policyDocument"]["Statement"][0]["Effect"]
+                == "Deny"
+            )
+            main.handler(denied, {})
+            main.handler(other_api, {})
+            assert is_authorized.call_count == 3
+
+
+class Test_bearer_handler:
+    ARN = "arn:aws:execute-api:us-east-1:0000000000:XXXYYY/stage/POST/some/endpoint"
+
+    @pytest.fixture(autouse=True)
+    def signing_key(self, monkeypatch):
+        monkeypatch.setenv("TOKEN_SIGNING_KEY", "test-key")
+        tokens.signing_key.cache_clear()
+        yield
+        tokens.signing_key.cache_clear()
+
+    def _event(self, token):
+        return {"methodArn": self.ARN, "headers": {"Authorization": f"Bearer {token}"}}
+
+    def test_allowed_with_scopes(self):
+        token = tokens.issue_token("ethan", ["read", "write"])
+        result = main.handler(self._event(token), {})
+        assert result["principalId"] == "ethan"
+        assert result["policyDocument"]["Statement"][0]["Effect"] == "Allow"
+        assert result["context"] == {"username": "ethan", "scopes": "read write"}
+
+    def test_invalid_token_denied(self):
+        token = tokens.issue_token("ethan", [], key=b"other-key")
+        result = main.handler(self._event(token), {})
+        assert result["principalId"] == "anonymous"
+        assert result["policyDocument"]["Statement"][0]["Effect"] == "Deny"
+        assert "context" not in result
+
+    def test_cached_no_longer_than_token(self):
+        token = tokens.issue_token("ethan", [], ttl_seconds=5)
+        with mock.patch.object(main.decision_cache, "set") as cache_set:
+            main.handler(self._event(token), {})
+        (_, _, ttl_seconds), _ = cache_set.call_args
+        assert 0 < ttl_seconds <= 5
+
+
+IMPORT_SCRIPT = """
+import time
+
+start = time.perf_counter()
+import main
+print(time.perf_counter() - start)
+"""
+
+
+def test_import_time_budget():
+    # The authorizer runs before every request, so its cold start should stay tiny.
+    budget_seconds = float(os.environ.get("STARTUP_BUDGET_SECONDS", 0.5))
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert float(output) < budget_seconds
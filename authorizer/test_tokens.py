@@ -0,0 +1,56 @@
+import time
+from unittest import mock
+
+import pytest
+
+import tokens
+
+KEY = b"test-key"
+
+
+def test_issue_and_verify():
+    token = tokens.issue_token("ethan", ["read", "write"], 60, key=KEY)
+    verified = tokens.verify_token(token, key=KEY)
+    assert verified.username == "ethan"
+    assert verified.scopes == ["read", "write"]
+    assert verified.expires_at == pytest.approx(time.time() + 60, abs=2)
+
+
+@pytest.mark.parametrize(
+    "tamper",
+    [
+        lambda token: token[:-2] + ("AA" if token[-2:] != "AA" else "BB"),
+        lambda token: token.replace("v1.", "v2.", 1),
+        lambda token: token.split(".", 1)[1],
+        lambda token: "",
+        lambda token: token[:-1] + "\u00e9",
+        lambda token: token + "\ud800",
+        lambda token: token.replace("v1.", "v1.\u00e9", 1),
+    ],
+)
+def test_tampered_token(tamper):
+    token = tokens.issue_token("ethan", [], 60, key=KEY)
+    with pytest.raises(tokens.InvalidToken):
+        tokens.verify_token(tamper(token), key=KEY)
+
+
+def test_wrong_key():
+    token = tokens.issue_token("ethan", [], 60, key=KEY)
+    with pytest.raises(tokens.InvalidToken):
+        tokens.verify_token(token, key=b"other-key")
+
+
+def test_expired_token():
+    token = tokens.issue_token("ethan", [], 60, key=KEY)
+    with mock.patch.object(tokens.time, "time", return_value=time.time() + 61):
+        with pytest.raises(tokens.InvalidToken):
+            tokens.verify_token(token, key=KEY)
+
+
+def test_tokens_disabled(monkeypatch):
+    monkeypatch.delenv("TOKEN_SIGNING_KEY", raising=False)
+    tokens.signing_key.cache_clear()
+    with pytest.raises(tokens.InvalidToken):
+        tokens.verify_token(tokens.issue_token("ethan", [], 60, key=KEY))
+    with pytest.raises(ValueError):
+        tokens.issue_token("ethan")
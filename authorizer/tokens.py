@@ -0,0 +1,107 @@
+"""
+Stateless signed tokens for the authorizer.
+
+A token is v1.<payload>.<signature>, where the payload is base64url-encoded JSON
+with the username ("sub"), a list of scopes and an expiry ("exp", seconds since
+the Unix epoch), and the signature is a base64url-encoded HMAC-SHA256 of
+"v1.<payload>" with the key in TOKEN_SIGNING_KEY. Verifying one needs no lookups.
+
+Issue a token with
+
+    TOKEN_SIGNING_KEY=... python tokens.py <username> [scope ...] [--ttl SECONDS]
+"""
+import argparse
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import lru_cache
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import List, NamedTuple, Optional, Sequence
+
+VERSION = "v1"
+DEFAULT_TTL_SECONDS = 3600
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class Token(NamedTuple):
+    username: str
+    scopes: List[str]
+    expires_at: int
+
+
+@lru_cache(maxsize=None)
+def signing_key() -> Optional[bytes]:
+    """The container's signing key, or None if tokens are disabled."""
+    key = os.environ.get("TOKEN_SIGNING_KEY")
+    return key.encode() if key else None
+
+
+def _b64encode(data: bytes) -> str:
+    return urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(message: str, key: bytes) -> str:
+    return _b64encode(hmac.new(key, message.encode(), hashlib.sha256).digest())
+
+
+def issue_token(
+    username: str,
+    scopes: Sequence[str] = (),
+    ttl_seconds: int = DEFAULT_TTL_SECONDS,
+    key: Optional[bytes] = None,
+) -> str:
+    key = key or signing_key()
+    if key is None:
+        raise ValueError("TOKEN_SIGNING_KEY isn't set")
+    payload = {
+        "sub": username,
+        "scopes": list(scopes),
+        "exp": int(time.time()) + ttl_seconds,
+    }
+    message = f"{VERSION}.{_b64encode(json.dumps(payload).encode())}"
+    return f"{message}.{_sign(message, key)}"
+
+
+def verify_token(token: str, key: Optional[bytes] = None) -> Token:
+    """Check a token's signature and expiry. Raises InvalidToken if either fails."""
+    key = key or signing_key()
+    if key is None:
+        raise InvalidToken("Tokens are disabled")
+    message, _, signature = token.rpartition(".")
+    version, _, payload = message.partition(".")
+    if version != VERSION or not payload:
+        raise InvalidToken("Malformed token")
+    # The token comes from the request, so it may hold any characters. compare_digest
+    # only takes ASCII strs, so compare bytes instead.
+    try:
+        valid = hmac.compare_digest(_sign(message, key).encode(), signature.encode())
+    except UnicodeEncodeError:
+        valid = False
+    if not valid:
+        raise InvalidToken("Bad signature")
+    try:
+        claims = json.loads(_b64decode(payload))
+        verified = Token(claims["sub"], list(claims["scopes"]), int(claims["exp"]))
+    except (ValueError, KeyError, TypeError):
+        raise InvalidToken("Malformed payload")
+    if verified.expires_at <= time.time():
+        raise InvalidToken("Expired")
+    return verified
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Issue a signed token.")
+    parser.add_argument("username")
+    parser.add_argument("scopes", nargs="*")
+    parser.add_argument("--ttl", type=int, default=DEFAULT_TTL_SECONDS)
+    args = parser.parse_args()
+    print(issue_token(args.username, args.scopes, args.ttl))
@@ -0,0 +1,50 @@
+"""
+Compare the per-event overhead of building a Firehose client for every event with
+reusing the container's shared client.
+
+Responses are stubbed with botocore's Stubber, so this measures client setup and
+request serialization only. In AWS the shared client also keeps its HTTP
+connections alive between events, which saves a TLS handshake per event on top of
+the numbers reported here.
+
+Run from the collector directory:
+
+    python -m benchmarks.aws_clients
+"""
+import time
+
+import boto3
+from botocore.stub import Stubber
+
+from collector.aws import AWS_REGION, get_client
+from collector.kinesis import KINESIS_STREAM
+
+NUM_EVENTS = 200
+RECORD = {"Data": '{"session_id": "XYZ", "button_id": "ABC"}\n'}
+RESPONSE = {"RecordId": "record-id", "Encrypted": False}
+
+
+def put_with_new_client() -> None:
+    client = boto3.client("firehose", region_name=AWS_REGION)
+    with Stubber(client) as stubber:
+        stubber.add_response("put_record", RESPONSE)
+        client.put_record(DeliveryStreamName=KINESIS_STREAM, Record=RECORD)
+
+
+def put_with_shared_client(stubber: Stubber) -> None:
+    stubber.add_response("put_record", RESPONSE)
+    get_client("firehose").put_record(DeliveryStreamName=KINESIS_STREAM, Record=RECORD)
+
+
+def run(name: str, put) -> None:
+    start = time.perf_counter()
+    for _ in range(NUM_EVENTS):
+        put()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {elapsed / NUM_EVENTS * 1_000:.3f} ms/event")
+
+
+if __name__ == "__main__":
+    run("new client", put_with_new_client)
+    with Stubber(get_client("firehose")) as stubber:
+        run("shared", lambda: put_with_shared_client(stubber))
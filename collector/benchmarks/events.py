@@ -0,0 +1,44 @@
+"""Synthetic API Gateway proxy events for driving collector.mangum.handler locally."""
+import json
+from typing import Optional
+
+
+def api_gateway_event(
+    method: str,
+    path: str,
+    body: Optional[object] = None,
+    username: Optional[str] = None,
+    query: Optional[dict] = None,
+    headers: Optional[dict] = None,
+    stage: str = "dev",
+) -> dict:
+    """
+    Build a REST API proxy event like the ones API Gateway sends to the collector.
+    username is added to the requestContext the way the authorizer does it.
+    """
+    headers = {"Host": "localhost", **(headers or {})}
+    if body is not None and not isinstance(body, (str, bytes)):
+        body = json.dumps(body)
+        headers.setdefault("Content-Type", "application/json")
+    request_context = {
+        "stage": stage,
+        "path": f"/{stage}{path}",
+        "httpMethod": method,
+        "requestId": "benchmark",
+    }
+    if username is not None:
+        request_context["authorizer"] = {"username": username}
+    return {
+        "resource": path,
+        "path": path,
+        "httpMethod": method,
+        "headers": headers,
+        "multiValueHeaders": {key: [value] for key, value in headers.items()},
+        "queryStringParameters": query,
+        "multiValueQueryStringParameters": (
+            {key: [value] for key, value in query.items()} if query else None
+        ),
+        "requestContext": request_context,
+        "body": body,
+        "isBase64Encoded": False,
+    }
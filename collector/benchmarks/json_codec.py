@@ -0,0 +1,54 @@
+"""
+Compare the standard library with collector.codec for encoding and decoding events.
+
+Run from the collector directory:
+
+    python -m benchmarks.json_codec
+"""
+import json
+import time
+
+from collector import codec
+
+NUM_EVENTS = 100_000
+
+EVENT = {
+    "url": "https://example.com/some/page",
+    "referral_url": "https://example.com/",
+    "ipaddress": "127.0.0.1",
+    "useragent": "Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/89.0",
+    "session_id": "7bd5fc83-4f3b-4cf2-9a8b-2b0d6c4f3f11",
+    "username": "bench-user",
+    "event_type": "page_view",
+    "received_at": 1_612_137_600_000,
+}
+
+
+def stdlib_dumps(event: dict) -> bytes:
+    """How events were encoded before collector.codec."""
+    return (json.dumps(event) + "\n").encode("utf-8")
+
+
+def timed(fn, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return time.perf_counter() - start
+
+
+def run(name: str, dumps, loads) -> None:
+    events = [
+        dict(EVENT, received_at=EVENT["received_at"] + idx) for idx in range(NUM_EVENTS)
+    ]
+    encoded = [dumps(event) for event in events]
+    encode_seconds = timed(dumps, events)
+    decode_seconds = timed(loads, encoded)
+    print(
+        f"{name:>8}: encode {encode_seconds:.3f}s, decode {decode_seconds:.3f}s"
+        f" for {NUM_EVENTS} events"
+    )
+
+
+if __name__ == "__main__":
+    run("stdlib", stdlib_dumps, json.loads)
+    run(codec.BACKEND, codec.dumps, codec.loads)
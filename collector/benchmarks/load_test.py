@@ -0,0 +1,259 @@
+"""
+Load test the collector locally by driving collector.mangum.handler with synthetic
+API Gateway events, one route at a time.
+
+DynamoDB is backed by moto and Firehose by an in-memory stand-in. Both sleep for
+--latency-ms before every call to approximate the network round trip to AWS.
+Latency percentiles come from one pass; allocations per request come from a second
+pass under tracemalloc, so that tracing doesn't skew the timings.
+
+Results are written as JSON to benchmarks/results/ (or --output), and --baseline
+prints the change against an earlier results file.
+
+Run from the collector directory:
+
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --requests 1000 --latency-ms 10
+    python -m benchmarks.load_test --baseline benchmarks/results/<earlier run>.json
+"""
+import argparse
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional
+from unittest import mock
+
+from moto import mock_dynamodb2
+from pynamodb.connection.base import Connection
+
+from benchmarks.events import api_gateway_event
+from collector import dynamo, kinesis, mangum, metrics
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+USERNAME = "bench-user"
+NUM_KEYS = 10
+BATCH_SIZE = 25
+
+
+def page_view(idx: int) -> dict:
+    return {"url": f"https://example.com/{idx % NUM_KEYS}", "session_id": f"s{idx}"}
+
+
+def button_click(idx: int) -> dict:
+    return {"button_id": f"button-{idx % NUM_KEYS}", "session_id": f"s{idx}"}
+
+
+# Route name -> function from request number to API Gateway event.
+ROUTES: Dict[str, Callable[[int], dict]] = {
+    "GET /": lambda idx: api_gateway_event("GET", "/"),
+    "POST /web/page_view": lambda idx: api_gateway_event(
+        "POST", "/web/page_view", page_view(idx), username=USERNAME
+    ),
+    "POST /web/page_views": lambda idx: api_gateway_event(
+        "POST",
+        "/web/page_views",
+        [page_view(idx * BATCH_SIZE + n) for n in range(BATCH_SIZE)],
+        username=USERNAME,
+    ),
+    "POST /button/click": lambda idx: api_gateway_event(
+        "POST", "/button/click", button_click(idx), username=USERNAME
+    ),
+    "POST /events": lambda idx: api_gateway_event(
+        "POST",
+        "/events",
+        [
+            {"event_type": "page_view", **page_view(idx)},
+            {"event_type": "button_click", **button_click(idx)},
+        ],
+        username=USERNAME,
+    ),
+    "GET /web/page_view/count": lambda idx: api_gateway_event(
+        "GET",
+        "/web/page_view/count",
+        query={"url": page_view(idx)["url"]},
+        username=USERNAME,
+    ),
+    "GET /web/page_view/counts/all": lambda idx: api_gateway_event(
+        "GET", "/web/page_view/counts/all", username=USERNAME
+    ),
+}
+
+
+class InMemoryFirehose:
+    """Stands in for the Firehose client, keeping records in memory."""
+
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+        self.records: List[bytes] = []
+
+    def put_record(self, DeliveryStreamName: str, Record: dict) -> dict:
+        time.sleep(self.latency_seconds)
+        self.records.append(Record["Data"])
+        return {"RecordId": "record-id", "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def put_record_batch(self, DeliveryStreamName: str, Records: List[dict]) -> dict:
+        time.sleep(self.latency_seconds)
+        self.records.extend(record["Data"] for record in Records)
+        return {
+            "FailedPutCount": 0,
+            "RequestResponses": [{"RecordId": "record-id"} for _ in Records],
+        }
+
+
+@contextmanager
+def stand_ins(latency_seconds: float) -> Iterator[InMemoryFirehose]:
+    """Back the collector with moto and an in-memory Firehose, both delayed."""
+    firehose = InMemoryFirehose(latency_seconds)
+    dispatch = Connection.dispatch
+
+    def delayed_dispatch(self, operation_name, *args, **kwargs):
+        time.sleep(latency_seconds)
+        return dispatch(self, operation_name, *args, **kwargs)
+
+    with ExitStack() as stack:
+        stack.enter_context(mock_dynamodb2())
+        stack.enter_context(mock.patch.object(Connection, "dispatch", delayed_dispatch))
+        stack.enter_context(
+            mock.patch.object(kinesis, "get_client", lambda _: firehose)
+        )
+        # Don't print an EMF line for every request.
+        stack.enter_context(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        dynamo.ensure_table.cache_clear()
+        dynamo.count_cache.clear()
+        # The read routes don't create tables, so create them all up front.
+        for model in (
+            dynamo.PageViewCounter,
+            dynamo.ButtonClickCounter,
+            dynamo.BucketCounter,
+        ):
+            dynamo.ensure_table(model)
+        yield firehose
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def run_route(make_event: Callable[[int], dict], num_requests: int) -> dict:
+    # Warm up so that table creation and lazy imports aren't part of the numbers.
+    for idx in range(min(10, num_requests)):
+        assert mangum.handler(make_event(idx), {})["statusCode"] == 200
+
+    latencies = []
+    start = time.perf_counter()
+    for idx in range(num_requests):
+        request_start = time.perf_counter()
+        mangum.handler(make_event(idx), {})
+        latencies.append(time.perf_counter() - request_start)
+    elapsed = time.perf_counter() - start
+
+    allocated = []
+    tracemalloc.start()
+    try:
+        for idx in range(num_requests):
+            event = make_event(idx)
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            mangum.handler(event, {})
+            _, peak = tracemalloc.get_traced_memory()
+            allocated.append(peak - before)
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "requests": num_requests,
+        "rps": num_requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1_000,
+        "p95_ms": percentile(latencies, 95) * 1_000,
+        "p99_ms": percentile(latencies, 99) * 1_000,
+        "alloc_kib_per_request": statistics.mean(allocated) / 1024,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def compare(results: dict, baseline: dict) -> None:
+    print(f"\nChange against {baseline['commit']} ({baseline['timestamp']}):")
+    for route, stats in results["routes"].items():
+        if route not in baseline["routes"]:
+            continue
+        old = baseline["routes"][route]
+        changes = ", ".join(
+            f"{name} {(stats[name] - old[name]) / old[name]:+.1%}"
+            for name in ("rps", "p50_ms", "p99_ms", "alloc_kib_per_request")
+            if old[name]
+        )
+        print(f"{route:>30}: {changes}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=300, help="per route")
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0,
+        help="delay added to every DynamoDB and Firehose call",
+    )
+    parser.add_argument("--route", action="append", choices=list(ROUTES))
+    parser.add_argument("--output", help="results file (default: benchmarks/results/)")
+    parser.add_argument("--baseline", help="results file to compare against")
+    args = parser.parse_args()
+    logging.getLogger("mangum").setLevel(logging.WARNING)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "latency_ms": args.latency_ms,
+        "routes": {},
+    }
+    print(
+        f"{'route':>30}  {'rps':>8}  {'p50':>7}  {'p95':>7}  {'p99':>7}  {'KiB/req':>8}"
+    )
+    for route in args.route or ROUTES:
+        with stand_ins(args.latency_ms / 1_000):
+            stats = run_route(ROUTES[route], args.requests)
+        results["routes"][route] = stats
+        print(
+            f"{route:>30}  {stats['rps']:>8.1f}  {stats['p50_ms']:>7.2f}"
+            f"  {stats['p95_ms']:>7.2f}  {stats['p99_ms']:>7.2f}"
+            f"  {stats['alloc_kib_per_request']:>8.1f}"
+        )
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = results["timestamp"].replace(":", "").replace("+0000", "")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{results['commit']}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
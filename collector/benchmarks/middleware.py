@@ -0,0 +1,76 @@
+"""
+Compare the per-request overhead of the old @app.middleware("http") root-path
+middleware with the pure ASGI APIGatewayRootPathMiddleware, through Mangum.
+
+Each variant wraps a minimal app with a single route, so the numbers isolate the
+middleware from the collector's routes and AWS calls.
+
+Run from the collector directory:
+
+    python -m benchmarks.middleware
+"""
+import timeit
+
+from fastapi import FastAPI, Request
+from mangum import Mangum
+
+from benchmarks.events import api_gateway_event
+from collector.main import APIGatewayRootPathMiddleware
+
+NUM_REQUESTS = 500
+REPEATS = 7
+EVENT = api_gateway_event("GET", "/dev/ping", stage="dev")
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    def ping():
+        return {"message": "pong"}
+
+    return app
+
+
+def legacy_app() -> FastAPI:
+    app = build_app()
+
+    @app.middleware("http")
+    async def set_root_path_for_api_gateway(request: Request, call_next):
+        root_path = request.scope["root_path"]
+        if root_path:
+            app.root_path = root_path
+        elif "aws.event" in request.scope:
+            context = request.scope["aws.event"]["requestContext"]
+            if "customDomain" not in context:
+                root_path = f"/{context['stage']}"
+                if request.scope["path"].startswith(root_path):
+                    request.scope["path"] = request.scope["path"][len(root_path) :]
+                request.scope["root_path"] = root_path
+                app.root_path = root_path
+        return await call_next(request)
+
+    return app
+
+
+def asgi_app() -> FastAPI:
+    app = build_app()
+    app.add_middleware(APIGatewayRootPathMiddleware)
+    return app
+
+
+def run(name: str, app: FastAPI) -> float:
+    handler = Mangum(app)
+    assert handler(EVENT, {})["statusCode"] == 200
+    timings = timeit.repeat(
+        lambda: handler(EVENT, {}), number=NUM_REQUESTS, repeat=REPEATS
+    )
+    per_request = min(timings) / NUM_REQUESTS * 1_000
+    print(f"{name:>7}: {per_request:.3f} ms/request")
+    return per_request
+
+
+if __name__ == "__main__":
+    legacy = run("legacy", legacy_app())
+    pure = run("asgi", asgi_app())
+    print(f" delta: {legacy - pure:+.3f} ms/request")
@@ -0,0 +1,92 @@
+"""
+Measure the collector's cold start: the time to import collector.mangum, and the
+time until the handler has answered its first request. Each run uses a fresh
+interpreter, like a new Lambda container.
+
+Run from the collector directory:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --importtime  # also show the slowest imports
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import List
+
+COLLECTOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# These should only be imported once a request needs AWS.
+DEFERRED_MODULES = ["boto3", "botocore", "pynamodb"]
+
+SCRIPT = f"""
+import json
+import sys
+import time
+
+from benchmarks.events import api_gateway_event
+
+event = api_gateway_event("GET", "/")
+start = time.perf_counter()
+from collector.mangum import handler
+imported = time.perf_counter()
+deferred = [name for name in {DEFERRED_MODULES!r} if name in sys.modules]
+handler(event, {{}})
+responded = time.perf_counter()
+print(json.dumps({{
+    "import_seconds": imported - start,
+    "first_response_seconds": responded - start,
+    "deferred_modules_imported": deferred,
+}}))
+"""
+
+
+def run_once() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT],
+        cwd=COLLECTOR_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_startup(runs: int = 5) -> dict:
+    """Median cold start timings over several fresh interpreters."""
+    results = [run_once() for _ in range(runs)]
+    return {
+        "import_seconds": statistics.median(r["import_seconds"] for r in results),
+        "first_response_seconds": statistics.median(
+            r["first_response_seconds"] for r in results
+        ),
+        "deferred_modules_imported": sorted(
+            {name for r in results for name in r["deferred_modules_imported"]}
+        ),
+    }
+
+
+def slowest_imports(limit: int = 15) -> List[str]:
+    """The imports with the largest cumulative time, from python -X importtime."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import collector.mangum"],
+        cwd=COLLECTOR_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    lines = [line for line in stderr.splitlines() if line.startswith("import time:")]
+    timed = []
+    for line in lines[1:]:
+        _, cumulative, name = line[len("import time:") :].split("|")
+        timed.append((int(cumulative), name.rstrip()))
+    timed.sort(reverse=True)
+    return [
+        f"{cumulative / 1_000:8.1f} ms {name}" for cumulative, name in timed[:limit]
+    ]
+
+
+if __name__ == "__main__":
+    print(json.dumps(measure_startup(), indent=2))
+    if "--importtime" in sys.argv:
+        print("\n".join(slowest_imports()))
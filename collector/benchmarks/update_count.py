@@ -0,0 +1,63 @@
+"""
+Compare DynamoDB round trips and latency for counter updates against moto.
+
+Run from the collector directory:
+
+    python -m benchmarks.update_count
+"""
+from collections import Counter
+import time
+from unittest import mock
+
+from moto import mock_dynamodb2
+from pynamodb.connection.base import Connection
+from pynamodb.models import DoesNotExist
+
+from collector.dynamo import PageViewCounter, ensure_table, update_count
+
+NUM_UPDATES = 500
+NUM_KEYS = 10
+
+
+def legacy_update_count(CountModel, *args) -> None:
+    """The exists / get / save / update path that update_count replaced."""
+    if not CountModel.exists():
+        CountModel.create_table(billing_mode="PAY_PER_REQUEST", wait=True)
+    try:
+        model = CountModel.get(*args)
+    except DoesNotExist:
+        model = CountModel(*args)
+        model.save()
+    model.update(actions=[CountModel.count.set(CountModel.count + 1)])
+
+
+def run(name: str, update) -> None:
+    operations: Counter = Counter()
+    dispatch = Connection.dispatch
+
+    def counting_dispatch(self, operation_name, *args, **kwargs):
+        operations[operation_name] += 1
+        return dispatch(self, operation_name, *args, **kwargs)
+
+    with mock_dynamodb2(), mock.patch.object(Connection, "dispatch", counting_dispatch):
+        ensure_table.cache_clear()
+        PageViewCounter.create_table(wait=True)
+        operations.clear()
+
+        start = time.perf_counter()
+        for idx in range(NUM_UPDATES):
+            url = f"https://example.com/{idx % NUM_KEYS}"
+            update(PageViewCounter, "bench-user", url)
+        elapsed = time.perf_counter() - start
+
+    round_trips = sum(operations.values())
+    print(
+        f"{name:>8}: {round_trips / NUM_UPDATES:.2f} round trips/update,"
+        f" {elapsed / NUM_UPDATES * 1_000:.3f} ms/update"
+        f" ({dict(operations)})"
+    )
+
+
+if __name__ == "__main__":
+    run("legacy", legacy_update_count)
+    run("atomic", update_count)
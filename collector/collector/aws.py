@@ -0,0 +1,45 @@
+"""
+Shared AWS clients.
+
+Creating a boto3 client loads the service model from disk and sets up a fresh
+connection pool, so clients are created once per container and reused across
+invocations. boto3 itself is only imported when the first client is created.
+"""
+from functools import lru_cache
+import os
+
+AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", 10))
+AWS_RETRY_MODE = os.environ.get("AWS_RETRY_MODE", "standard")
+AWS_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", 3))
+AWS_CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT", 2))
+AWS_READ_TIMEOUT = float(os.environ.get("AWS_READ_TIMEOUT", 5))
+AWS_TCP_KEEPALIVE = os.environ.get("AWS_TCP_KEEPALIVE", "true").lower() == "true"
+
+
+def client_config():
+    from botocore.config import Config
+
+    options = {
+        "max_pool_connections": AWS_MAX_POOL_CONNECTIONS,
+        "retries": {"mode": AWS_RETRY_MODE, "max_attempts": AWS_MAX_ATTEMPTS},
+        "connect_timeout": AWS_CONNECT_TIMEOUT,
+        "read_timeout": AWS_READ_TIMEOUT,
+    }
+    # Older versions of botocore don't know about TCP keep-alive.
+    if "tcp_keepalive" in Config.OPTION_DEFAULTS:
+        options["tcp_keepalive"] = AWS_TCP_KEEPALIVE
+    return Config(**options)
+
+
+@lru_cache(maxsize=None)
+def _session():
+    import boto3
+
+    return boto3.session.Session(region_name=AWS_REGION)
+
+
+@lru_cache(maxsize=None)
+def get_client(service_name: str):
+    """Get the container's shared client for an AWS service."""
+    return _session().client(service_name, config=client_config())
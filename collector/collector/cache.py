@@ -0,0 +1,90 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Hashable, Optional, Union
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+# Browsers and API Gateway may cache count responses for this many seconds. Unset
+# disables the Cache-Control and ETag headers.
+COUNT_CACHE_CONTROL_MAX_AGE = os.environ.get("COUNT_CACHE_CONTROL_MAX_AGE")
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache whose entries expire ttl_seconds after they were set.
+    Tracks hits and misses so that the hit rate can be reported.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get the value for key, or None if it is missing or has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.ttl_seconds <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def increment(self, key: Hashable, delta: int) -> None:
+        """Add delta to the value for key, if it is cached and hasn't expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries[key] = (entry[0], entry[1] + delta)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def count_response(request: Request, count: int) -> Union[dict, Response]:
+    """
+    Build the response body for a count endpoint. If COUNT_CACHE_CONTROL_MAX_AGE is
+    set, the response gets Cache-Control and ETag headers, and a request whose
+    If-None-Match matches the current ETag gets an empty 304.
+    """
+    body = {"count": count}
+    if COUNT_CACHE_CONTROL_MAX_AGE is None:
+        return body
+
+    etag = '"' + hashlib.md5(str(count).encode()).hexdigest() + '"'
+    headers = {
+        "Cache-Control": f"private, max-age={COUNT_CACHE_CONTROL_MAX_AGE}",
+        "ETag": etag,
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
@@ -0,0 +1,40 @@
+"""
+JSON encoding for event records.
+
+orjson is used when it is installed, and the standard library otherwise. Both
+backends produce the same compact UTF-8 bytes, so records look the same no matter
+which one wrote them, and nothing is encoded to str only to be encoded again.
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _stdlib_loads(data: Union[bytes, str]) -> Any:
+    if isinstance(data, bytes):
+        try:
+            data = data.decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise json.JSONDecodeError(str(e), "", e.start)
+    return json.loads(data)
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+    dumps = orjson.dumps
+    loads = orjson.loads
+else:  # pragma: no cover
+    BACKEND = "json"
+    dumps = _stdlib_dumps
+    loads = _stdlib_loads
+
+# orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+JSONDecodeError = json.JSONDecodeError
@@ -0,0 +1,95 @@
+import os
+import zlib
+
+from fastapi import HTTPException
+
+# Reject gzip bodies that decompress to more than this, so that a small request
+# can't exhaust the Lambda's memory.
+MAX_DECOMPRESSED_BYTES = int(os.environ.get("MAX_DECOMPRESSED_BYTES", 32 * 1024 * 1024))
+# Bodies are passed on to the app in chunks of at most this many bytes.
+DECOMPRESS_CHUNK_BYTES = 64 * 1024
+
+
+class GzipReceive:
+    """
+    Wraps an ASGI receive callable, decompressing a gzip request body as the app
+    reads it, one chunk at a time.
+    """
+
+    def __init__(self, receive, max_size: int, chunk_size: int):
+        self.receive = receive
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        # wbits=16+MAX_WBITS expects a gzip header and trailer.
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._compressed = b""
+        self._more_body = True
+        self._size = 0
+        self._done = False
+
+    async def __call__(self) -> dict:
+        while not self._done:
+            if not self._compressed and self._more_body:
+                message = await self.receive()
+                if message["type"] != "http.request":
+                    return message
+                self._compressed = message.get("body", b"")
+                self._more_body = message.get("more_body", False)
+
+            try:
+                body = self._decompressor.decompress(self._compressed, self.chunk_size)
+            except zlib.error:
+                raise HTTPException(status_code=400, detail="Invalid gzip body")
+            self._compressed = self._decompressor.unconsumed_tail
+            self._size += len(body)
+            if self._size > self.max_size:
+                raise HTTPException(status_code=413, detail="Request body too large")
+
+            if not self._compressed and not self._more_body:
+                if not self._decompressor.eof:
+                    raise HTTPException(status_code=400, detail="Truncated gzip body")
+                self._done = True
+            if body or self._done:
+                return {
+                    "type": "http.request",
+                    "body": body,
+                    "more_body": not self._done,
+                }
+        return await self.receive()
+
+
+class GzipRequestMiddleware:
+    """
+    Decompresses request bodies sent with Content-Encoding: gzip, so that endpoints
+    read them like any other body.
+
+    The body is decompressed as it's read rather than up front, which keeps the
+    memory peak low for endpoints that stream it. Errors in the gzip data are
+    raised as HTTPExceptions when the app reads the body.
+    """
+
+    def __init__(
+        self,
+        app,
+        max_size: int = MAX_DECOMPRESSED_BYTES,
+        chunk_size: int = DECOMPRESS_CHUNK_BYTES,
+    ):
+        self.app = app
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = scope["headers"]
+            encoding = dict(headers).get(b"content-encoding", b"")
+            if encoding.strip().lower() == b"gzip":
+                # The content length was for the compressed body.
+                stripped = (b"content-encoding", b"content-length")
+                headers = [
+                    (key, value) for key, value in headers if key not in stripped
+                ]
+                # Set on the same scope, not a copy, so that outer middleware sees
+                # what the router adds to it, such as the matched endpoint.
+                scope["headers"] = headers
+                receive = GzipReceive(receive, self.max_size, self.chunk_size)
+        await self.app(scope, receive, send)
@@ -1,6 +1,9 @@
 from fastapi import Request
 
+from collector import metrics
+
 
 def get_username(request: Request) -> str:
     """The username gets added to the requestContext when the authorizer runs."""
-    return request.scope["aws.event"]["requestContext"]["authorizer"]["username"]
+    with metrics.timer("auth_context"):
+        return request.scope["aws.event"]["requestContext"]["authorizer"]["username"]
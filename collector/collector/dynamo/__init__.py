@@ -1,20 +1,434 @@
-from pynamodb.models import DoesNotExist, Model
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import datetime as dt
+from functools import lru_cache
+import logging
+import os
+from typing import Dict, List, Optional, Tuple, Type
 
+from pynamodb.exceptions import (
+    DeleteError,
+    DoesNotExist,
+    PutError,
+    TableDoesNotExist,
+    UpdateError,
+)
+from pynamodb.models import Model
+
+from collector import codec, metrics
+from collector.aws import AWS_MAX_POOL_CONNECTIONS
+from collector.cache import TTLCache
+from collector.hll import HyperLogLog
+from collector.dynamo.buckets import (
+    BUCKET_COUNTERS_ENABLED,
+    BucketCounter,
+    ExpiredBuckets,
+    bucket_ranges,
+    buckets_for,
+    counter_id,
+    from_epoch_ms,
+)
 from collector.dynamo.button import ButtonClickCounter
+from collector.dynamo.dedup import (
+    DEDUP_CACHE_MAX_SIZE,
+    DEDUP_ENABLED,
+    DEDUP_TTL,
+    SeenEvent,
+    event_key,
+)
+from collector.dynamo.sessions import (
+    UNIQUE_SESSIONS_ENABLED,
+    UNIQUE_SESSIONS_MAX_RETRIES,
+    UNIQUE_SESSIONS_PRECISION,
+    SessionSketch,
+)
+from collector.dynamo.shards import (
+    SHARD_SEPARATOR,
+    base_key,
+    hot_keys,
+    is_throttle,
+    shard_count,
+    shard_key,
+)
+from collector.dynamo.top_keys import TopKeys, period_key
 from collector.dynamo.web import PageViewCounter
 
+logger = logging.getLogger(__name__)
+
+# Counts read by this container are served from memory for up to this many seconds.
+COUNT_CACHE_TTL_SECONDS = float(os.environ.get("COUNT_CACHE_TTL_SECONDS", 1))
+COUNT_CACHE_MAX_SIZE = int(os.environ.get("COUNT_CACHE_MAX_SIZE", 10_000))
+
+count_cache = TTLCache(COUNT_CACHE_MAX_SIZE, COUNT_CACHE_TTL_SECONDS)
+seen_events = TTLCache(DEDUP_CACHE_MAX_SIZE, DEDUP_TTL.total_seconds())
+
+# Bucket counts are written on here, so that they don't wait on the lifetime count.
+bucket_pool = ThreadPoolExecutor(max_workers=AWS_MAX_POOL_CONNECTIONS)
 
-def update_count(CountModel: Model, *args) -> None:
-    """Add 1 to the counts for a dynamodb model that tracks event counts"""
+
+@lru_cache(maxsize=None)
+def ensure_table(CountModel: Type[Model]) -> None:
+    """Create the table for a model if it doesn't exist yet. Cached per container."""
     if not CountModel.exists():
         CountModel.create_table(billing_mode="PAY_PER_REQUEST", wait=True)
 
-    # Get the model from dyanmodb. If it doesn't exist yet, then create it.
+
+def is_sharded(CountModel: Type[Model]) -> bool:
+    """Whether any key of the model's table may be spread over several items."""
+    return max(CountModel.Meta.shards, CountModel.Meta.hot_key_shards) > 1
+
+
+def update_count(
+    CountModel: Type[Model],
+    username: str,
+    key: str,
+    count: int = 1,
+    received_at: Optional[int] = None,
+):
+    """
+    Add to the counts for a dynamodb model that tracks event counts.
+
+    This is a single atomic UpdateItem which creates the item if it doesn't exist
+    yet, so concurrent updates to the same key can't clobber each other. Keys of
+    sharded tables are written to a random shard, and a key that keeps getting
+    throttled is moved to Meta.hot_key_shards shards.
+
+    If received_at (milliseconds since the Unix epoch) is given, the hour and day
+    buckets that it falls in are updated too.
+    """
+    with metrics.timer("dynamodb"):
+        _update_count(CountModel, username, key, count, received_at)
+
+
+def _update_count(
+    CountModel: Type[Model],
+    username: str,
+    key: str,
+    count: int,
+    received_at: Optional[int],
+) -> None:
+    bucket_updates: List[Future] = []
+    if received_at is not None and BUCKET_COUNTERS_ENABLED:
+        bucket_updates = update_bucket_counts(
+            CountModel, username, key, count, received_at
+        )
+    try:
+        _update_lifetime_count(CountModel, username, key, count)
+    finally:
+        wait(bucket_updates)
+    for update in bucket_updates:
+        update.result()
+
+
+def _update_lifetime_count(
+    CountModel: Type[Model], username: str, key: str, count: int
+) -> None:
+    ensure_table(CountModel)
+    table_name = CountModel.Meta.table_name
+    hot_key_shards = CountModel.Meta.hot_key_shards
+    shards = shard_count(
+        table_name, (username, key), CountModel.Meta.shards, hot_key_shards
+    )
+    try:
+        _add_count(CountModel, username, key, count, shards)
+    except UpdateError as e:
+        if shards >= hot_key_shards or not is_throttle(e):
+            raise
+        if not hot_keys.record_throttle((table_name, username, key)):
+            raise
+        _add_count(CountModel, username, key, count, hot_key_shards)
+
+
+def update_bucket_counts(
+    CountModel: Type[Model], username: str, key: str, count: int, received_at: int
+) -> List[Future]:
+    """
+    Start adding to the hour and day buckets of a counter, pushing back their
+    expiry. The updates run concurrently on bucket_pool; returns their futures.
+    """
+    ensure_table(BucketCounter)
+    bucket_counter_id = counter_id(CountModel.Meta.table_name, username, key)
+    return [
+        bucket_pool.submit(
+            _update_bucket_count, bucket_counter_id, bucket, count, expires_at
+        )
+        for bucket, expires_at in buckets_for(from_epoch_ms(received_at))
+    ]
+
+
+def _update_bucket_count(
+    bucket_counter_id: str, bucket: str, count: int, expires_at: dt.datetime
+) -> None:
+    BucketCounter(bucket_counter_id, bucket).update(
+        actions=[
+            BucketCounter.count.add(count),  # type: ignore
+            BucketCounter.expires_at.set(expires_at),  # type: ignore
+        ]
+    )
+
+
+def update_unique_sessions(
+    CountModel: Type[Model], username: str, key: str, session_ids: List[str]
+) -> None:
+    """
+    Add session IDs to the unique sessions sketch of a counter.
+
+    The sketch is read, merged and saved on the condition that nobody else saved
+    it in the meantime, retrying if they did. Adding a session that the sketch
+    already covers usually leaves it unchanged, and then nothing is written.
+    """
+    with metrics.timer("sessions"):
+        ensure_table(SessionSketch)
+        sketch_id = counter_id(CountModel.Meta.table_name, username, key)
+        for attempt in range(UNIQUE_SESSIONS_MAX_RETRIES + 1):
+            try:
+                model = SessionSketch.get(sketch_id)
+                sketch = HyperLogLog.from_bytes(model.sketch)
+            except DoesNotExist:
+                model = SessionSketch(sketch_id)
+                sketch = HyperLogLog(UNIQUE_SESSIONS_PRECISION)
+            if not sketch.update(session_ids):
+                return
+            model.sketch = sketch.to_bytes()
+            try:
+                model.save()
+            except PutError as e:
+                if e.cause_response_code != "ConditionalCheckFailedException":
+                    raise
+                if attempt == UNIQUE_SESSIONS_MAX_RETRIES:
+                    raise
+            else:
+                count_cache.delete((SessionSketch.Meta.table_name, sketch_id))
+                return
+
+
+def get_unique_sessions(CountModel: Type[Model], username: str, key: str) -> int:
+    """Get the approximate number of distinct sessions seen by a counter."""
+    sketch_id = counter_id(CountModel.Meta.table_name, username, key)
+    cache_key = (SessionSketch.Meta.table_name, sketch_id)
+    count = count_cache.get(cache_key)
+    if count is not None:
+        return count
+
+    try:
+        count = HyperLogLog.from_bytes(SessionSketch.get(sketch_id).sketch).count()
+    except (DoesNotExist, TableDoesNotExist):
+        count = 0
+    count_cache.set(cache_key, count)
+    return count
+
+
+def get_top_keys(
+    event_type: str, username: str, k: int, day: Optional[dt.date] = None
+) -> List[Tuple[str, int, int]]:
+    """
+    Get a user's k most frequent keys for an event type, all time or on one day, as
+    (key, count, error). Counts may be overestimated by up to error. This is a
+    single GetItem of a bounded size, however many keys the user has.
+    """
+    period = period_key(event_type, day)
+    cache_key = (TopKeys.Meta.table_name, username, period)
+    entries = count_cache.get(cache_key)
+    if entries is None:
+        try:
+            entries = codec.loads(TopKeys.get(username, period).summary)
+        except (DoesNotExist, TableDoesNotExist):
+            entries = []
+        count_cache.set(cache_key, entries)
+    return [(key, count, error) for key, count, error in entries[:k]]
+
+
+def claim_event(username: Optional[str], event_id: str) -> bool:
+    """
+    Mark an event ID as seen. Returns False if it already was seen within
+    DEDUP_TTL, by this container or any other.
+
+    The in-memory cache catches retries that land on the same container. Otherwise
+    a conditional PutItem decides which request gets to ingest the event.
+    """
+    key = event_key(username, event_id)
+    if seen_events.get(key):
+        return False
+    with metrics.timer("dedup"):
+        ensure_table(SeenEvent)
+        try:
+            SeenEvent(key, expires_at=DEDUP_TTL).save(
+                condition=SeenEvent.event_key.does_not_exist()  # type: ignore
+            )
+        except PutError as e:
+            if e.cause_response_code != "ConditionalCheckFailedException":
+                raise
+            seen_events.set(key, True)
+            return False
+    seen_events.set(key, True)
+    return True
+
+
+def release_event(username: Optional[str], event_id: str) -> None:
+    """Forget an event ID that couldn't be ingested, so that a retry isn't dropped."""
+    key = event_key(username, event_id)
+    seen_events.delete(key)
+    with metrics.timer("dedup"):
+        try:
+            SeenEvent(key).delete()
+        except DeleteError:
+            logger.exception(f"Failed to release event {key}")
+
+
+def get_count_between(
+    CountModel: Type[Model], username: str, key: str, since: int, until: int
+) -> int:
+    """
+    Get the count for a counter between two times in milliseconds since the Unix
+    epoch, at hour resolution. This takes at most three Queries on the bucket table.
+
+    Raises ExpiredBuckets if part of the range has already expired, rather than
+    returning a count that is too low.
+    """
+    bucket_counter_id = counter_id(CountModel.Meta.table_name, username, key)
+    total = 0
+    try:
+        for first, last in bucket_ranges(from_epoch_ms(since), from_epoch_ms(until)):
+            for model in BucketCounter.query(
+                bucket_counter_id, BucketCounter.bucket.between(first, last)
+            ):
+                total += model.count
+    except TableDoesNotExist:
+        return 0
+    return total
+
+
+def _add_count(
+    CountModel: Type[Model], username: str, key: str, count: int, shards: int
+) -> None:
+    cache_key = (CountModel.Meta.table_name, username, key)
+    if shards > 1:
+        model = CountModel(username, shard_key(key, shards))
+        model.update(actions=[CountModel.count.add(count)])  # type: ignore
+        count_cache.increment(cache_key, count)
+    else:
+        model = CountModel(username, key)
+        model.update(actions=[CountModel.count.add(count)])  # type: ignore
+        if is_sharded(CountModel):
+            count_cache.increment(cache_key, count)
+        else:
+            count_cache.set(cache_key, model.count)
+
+
+def _read_count(CountModel: Type[Model], username: str, key: str) -> int:
+    if not is_sharded(CountModel):
+        try:
+            return CountModel.get(username, key).count
+        except (DoesNotExist, TableDoesNotExist):
+            return 0
+
+    # Add up the unsharded item and all of its shards in one Query. The range ends
+    # after the last shard, so longer keys such as a.com/page aren't read for a.com.
+    range_keyname = CountModel._range_keyname
+    range_key = getattr(CountModel, range_keyname)
+    condition = range_key.between(key, key + SHARD_SEPARATOR + "\uffff")
+    try:
+        return sum(
+            model.count
+            for model in CountModel.query(username, condition)
+            if base_key(getattr(model, range_keyname)) == key
+        )
+    except TableDoesNotExist:
+        return 0
+
+
+def get_count(CountModel: Type[Model], username: str, key: str) -> int:
+    """Get the count for a dynamodb model that tracks event counts, or 0 if missing"""
+    cache_key = (CountModel.Meta.table_name, username, key)
+    count = count_cache.get(cache_key)
+    if count is not None:
+        return count
+
+    count = _read_count(CountModel, username, key)
+    count_cache.set(cache_key, count)
+    return count
+
+
+def get_counts(
+    CountModel: Type[Model], username: str, keys: List[str]
+) -> Dict[str, int]:
+    """
+    Get the counts for many keys of a user with BatchGetItem. PynamoDB splits the
+    keys into pages of 100 and retries any unprocessed keys. Missing keys count as 0.
+    Sharded tables are read with a Query per key instead.
+    """
+    counts = {}
+    to_fetch = []
+    for key in set(keys):
+        count = count_cache.get((CountModel.Meta.table_name, username, key))
+        if count is None:
+            to_fetch.append(key)
+        else:
+            counts[key] = count
+
+    if to_fetch and is_sharded(CountModel):
+        fetched = {key: _read_count(CountModel, username, key) for key in to_fetch}
+    elif to_fetch:
+        fetched = {}
+        try:
+            for model in CountModel.batch_get([(username, key) for key in to_fetch]):
+                fetched[getattr(model, CountModel._range_keyname)] = model.count
+        except TableDoesNotExist:
+            pass
+
+    for key in to_fetch:
+        counts[key] = fetched.get(key, 0)
+        count_cache.set((CountModel.Meta.table_name, username, key), counts[key])
+    return counts
+
+
+def list_counts(
+    CountModel: Type[Model],
+    username: str,
+    limit: int,
+    start_after: Optional[str] = None,
+    sort_by_count: bool = False,
+) -> Tuple[List[Tuple[str, int]], Optional[str]]:
+    """
+    List a user's counts with a Query on the username hash key.
+
+    Results are paginated in key order: pass the returned key as start_after to get
+    the next page. With sort_by_count, the user's whole partition is read and the
+    limit largest counts are returned, without a next page. Sharded tables are also
+    read in full so that shards can be added up before paginating.
+    """
+    range_keyname = CountModel._range_keyname
+    if sort_by_count or is_sharded(CountModel):
+        totals: Dict[str, int] = defaultdict(int)
+        try:
+            for model in CountModel.query(username):
+                totals[base_key(getattr(model, range_keyname))] += model.count
+        except TableDoesNotExist:
+            return [], None
+
+        if sort_by_count:
+            counts = sorted(totals.items(), key=lambda kv: kv[1], reverse=True)
+            return counts[:limit], None
+
+        keys = sorted(key for key in totals if start_after is None or key > start_after)
+        next_key = keys[limit - 1] if len(keys) > limit else None
+        return [(key, totals[key]) for key in keys[:limit]], next_key
+
+    last_evaluated_key = None
+    if start_after is not None:
+        last_evaluated_key = {
+            CountModel._hash_keyname: {"S": username},
+            range_keyname: {"S": start_after},
+        }
     try:
-        model = CountModel.get(*args)
-    except DoesNotExist:
-        model = CountModel(*args)
-        model.save()
+        results = CountModel.query(
+            username, limit=limit, last_evaluated_key=last_evaluated_key
+        )
+        counts = [(getattr(model, range_keyname), model.count) for model in results]
+    except TableDoesNotExist:
+        return [], None
 
-    # Add 1 to the model's count.
-    model.update(actions=[CountModel.count.set(CountModel.count + 1)])  # type: ignore
+    next_key = None
+    if results.last_evaluated_key is not None:
+        next_key = results.last_evaluated_key[range_keyname]["S"]
+    return counts, next_key
@@ -0,0 +1,150 @@
+import datetime as dt
+import json
+import os
+import time
+from typing import List, Tuple
+
+from pynamodb.models import Model
+from pynamodb.attributes import NumberAttribute, TTLAttribute, UnicodeAttribute
+
+from collector.aws import (
+    AWS_CONNECT_TIMEOUT,
+    AWS_MAX_ATTEMPTS,
+    AWS_MAX_POOL_CONNECTIONS,
+    AWS_READ_TIMEOUT,
+    AWS_REGION,
+)
+
+
+ENVIRONMENT = os.environ.get("ENVIRONMENT", "dev")
+BUCKET_COUNTERS_ENABLED = (
+    os.environ.get("BUCKET_COUNTERS_ENABLED", "true").lower() == "true"
+)
+# Buckets expire this long after the end of the hour or day that they count.
+HOUR_BUCKET_RETENTION = dt.timedelta(
+    days=int(os.environ.get("HOUR_BUCKET_RETENTION_DAYS", 7))
+)
+DAY_BUCKET_RETENTION = dt.timedelta(
+    days=int(os.environ.get("DAY_BUCKET_RETENTION_DAYS", 400))
+)
+
+HOUR = dt.timedelta(hours=1)
+DAY = dt.timedelta(days=1)
+
+
+class BucketCounter(Model):
+    """
+    Track event counts per hour and per day for every counter in the counter tables
+    """
+
+    class Meta:
+        table_name = f"{ENVIRONMENT}-bucket-counter"
+        region = AWS_REGION
+        max_pool_connections = AWS_MAX_POOL_CONNECTIONS
+        max_retry_attempts = AWS_MAX_ATTEMPTS
+        connect_timeout_seconds = AWS_CONNECT_TIMEOUT
+        read_timeout_seconds = AWS_READ_TIMEOUT
+
+    counter_id = UnicodeAttribute(hash_key=True)
+    bucket = UnicodeAttribute(range_key=True)
+    count = NumberAttribute(default=0)
+    expires_at = TTLAttribute(null=True)
+
+
+def counter_id(table_name: str, username: str, key: str) -> str:
+    return json.dumps([table_name, username, key])
+
+
+def from_epoch_ms(epoch_ms: int) -> dt.datetime:
+    return dt.datetime.fromtimestamp(epoch_ms / 1_000, tz=dt.timezone.utc)
+
+
+def hour_bucket(timestamp: dt.datetime) -> str:
+    return f"h#{timestamp:%Y-%m-%dT%H}"
+
+
+def day_bucket(timestamp: dt.datetime) -> str:
+    return f"d#{timestamp:%Y-%m-%d}"
+
+
+def floor_hour(timestamp: dt.datetime) -> dt.datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(timestamp: dt.datetime) -> dt.datetime:
+    return floor_hour(timestamp).replace(hour=0)
+
+
+def buckets_for(timestamp: dt.datetime) -> List[Tuple[str, dt.datetime]]:
+    """The (bucket, expires_at) pairs that an event at timestamp is counted in."""
+    return [
+        (hour_bucket(timestamp), floor_hour(timestamp) + HOUR + HOUR_BUCKET_RETENTION),
+        (day_bucket(timestamp), floor_day(timestamp) + DAY + DAY_BUCKET_RETENTION),
+    ]
+
+
+class ExpiredBuckets(ValueError):
+    """Part of a time range is older than its buckets are kept for"""
+
+
+def utc_now() -> dt.datetime:
+    return dt.datetime.fromtimestamp(time.time(), tz=dt.timezone.utc)
+
+
+def _bucket_spans(
+    since: dt.datetime, until: dt.datetime
+) -> List[Tuple[bool, dt.datetime, dt.datetime]]:
+    """
+    The smallest set of (is_hourly, first bucket start, last bucket start) spans
+    that covers [since, until), widened to whole hours. Whole days in the middle are
+    read from day buckets, and only the partial days at either end are read from
+    hour buckets.
+    """
+    start = floor_hour(since)
+    end = floor_hour(until)
+    if end < until:
+        end += HOUR
+    if start >= end:
+        return []
+
+    first_day = floor_day(start)
+    if first_day < start:
+        first_day += DAY
+    last_day = floor_day(end)
+    if first_day >= last_day:
+        return [(True, start, end - HOUR)]
+
+    spans = []
+    if start < first_day:
+        spans.append((True, start, first_day - HOUR))
+    spans.append((False, first_day, last_day - DAY))
+    if last_day < end:
+        spans.append((True, last_day, end - HOUR))
+    return spans
+
+
+def bucket_ranges(since: dt.datetime, until: dt.datetime) -> List[Tuple[str, str]]:
+    """
+    The inclusive (first bucket, last bucket) ranges to read for [since, until).
+
+    Raises ExpiredBuckets if any of the buckets would already have expired, since
+    reading them would silently undercount. Hour buckets are only kept for
+    HOUR_BUCKET_RETENTION, so older ranges must start and end on whole days.
+    """
+    now = utc_now()
+    ranges = []
+    for is_hourly, first, last in _bucket_spans(since, until):
+        if is_hourly:
+            if first + HOUR + HOUR_BUCKET_RETENTION <= now:
+                raise ExpiredBuckets(
+                    f"Counts are only kept at hour resolution for "
+                    f"{HOUR_BUCKET_RETENTION.days} days; use whole days before that"
+                )
+            ranges.append((hour_bucket(first), hour_bucket(last)))
+        else:
+            if first + DAY + DAY_BUCKET_RETENTION <= now:
+                raise ExpiredBuckets(
+                    f"Counts are only kept for {DAY_BUCKET_RETENTION.days} days"
+                )
+            ranges.append((day_bucket(first), day_bucket(last)))
+    return ranges
@@ -3,6 +3,14 @@ import os
 from pynamodb.models import Model
 from pynamodb.attributes import NumberAttribute, UnicodeAttribute
 
+from collector.aws import (
+    AWS_CONNECT_TIMEOUT,
+    AWS_MAX_ATTEMPTS,
+    AWS_MAX_POOL_CONNECTIONS,
+    AWS_READ_TIMEOUT,
+    AWS_REGION,
+)
+
 
 ENVIRONMENT = os.environ.get("ENVIRONMENT", "dev")
 
@@ -14,6 +22,15 @@ class ButtonClickCounter(Model):
 
     class Meta:
         table_name = f"{ENVIRONMENT}-button-click-counter"
+        region = AWS_REGION
+        max_pool_connections = AWS_MAX_POOL_CONNECTIONS
+        max_retry_attempts = AWS_MAX_ATTEMPTS
+        connect_timeout_seconds = AWS_CONNECT_TIMEOUT
+        read_timeout_seconds = AWS_READ_TIMEOUT
+        # Spread each key's writes over this many items (see collector.dynamo.shards)
+        shards = int(os.environ.get("BUTTON_CLICK_COUNTER_SHARDS", 1))
+        # Shards for keys that keep getting throttled. 0 disables automatic sharding.
+        hot_key_shards = int(os.environ.get("BUTTON_CLICK_COUNTER_HOT_KEY_SHARDS", 0))
 
     username = UnicodeAttribute(hash_key=True)
     button_id = UnicodeAttribute(range_key=True)
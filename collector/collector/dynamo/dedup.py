@@ -0,0 +1,46 @@
+import datetime as dt
+import json
+import os
+from typing import Optional
+
+from pynamodb.models import Model
+from pynamodb.attributes import TTLAttribute, UnicodeAttribute
+
+from collector.aws import (
+    AWS_CONNECT_TIMEOUT,
+    AWS_MAX_ATTEMPTS,
+    AWS_MAX_POOL_CONNECTIONS,
+    AWS_READ_TIMEOUT,
+    AWS_REGION,
+)
+
+
+ENVIRONMENT = os.environ.get("ENVIRONMENT", "dev")
+DEDUP_ENABLED = os.environ.get("DEDUP_ENABLED", "true").lower() == "true"
+# An event ID is remembered for this long, so retries within it are dropped.
+DEDUP_TTL = dt.timedelta(seconds=int(os.environ.get("DEDUP_TTL_SECONDS", 24 * 3600)))
+# Event IDs that this container has seen are also remembered in memory, up to this
+# many of them.
+DEDUP_CACHE_MAX_SIZE = int(os.environ.get("DEDUP_CACHE_MAX_SIZE", 10_000))
+
+
+class SeenEvent(Model):
+    """
+    Mark an event ID as ingested, until the item expires
+    """
+
+    class Meta:
+        table_name = f"{ENVIRONMENT}-seen-event"
+        region = AWS_REGION
+        max_pool_connections = AWS_MAX_POOL_CONNECTIONS
+        max_retry_attempts = AWS_MAX_ATTEMPTS
+        connect_timeout_seconds = AWS_CONNECT_TIMEOUT
+        read_timeout_seconds = AWS_READ_TIMEOUT
+
+    event_key = UnicodeAttribute(hash_key=True)
+    expires_at = TTLAttribute(null=True)
+
+
+def event_key(username: Optional[str], event_id: str) -> str:
+    """Event IDs come from clients, so they're only unique per user."""
+    return json.dumps([username, event_id])
@@ -0,0 +1,42 @@
+import os
+
+from pynamodb.models import Model
+from pynamodb.attributes import BinaryAttribute, UnicodeAttribute, VersionAttribute
+
+from collector.aws import (
+    AWS_CONNECT_TIMEOUT,
+    AWS_MAX_ATTEMPTS,
+    AWS_MAX_POOL_CONNECTIONS,
+    AWS_READ_TIMEOUT,
+    AWS_REGION,
+)
+
+
+ENVIRONMENT = os.environ.get("ENVIRONMENT", "dev")
+UNIQUE_SESSIONS_ENABLED = (
+    os.environ.get("UNIQUE_SESSIONS_ENABLED", "true").lower() == "true"
+)
+# Precision of new sketches (see collector.hll). Existing sketches keep theirs.
+UNIQUE_SESSIONS_PRECISION = int(os.environ.get("UNIQUE_SESSIONS_PRECISION", 12))
+# Times to retry a sketch update that lost a race with another update.
+UNIQUE_SESSIONS_MAX_RETRIES = int(os.environ.get("UNIQUE_SESSIONS_MAX_RETRIES", 5))
+
+
+class SessionSketch(Model):
+    """
+    A HyperLogLog sketch of the session IDs seen by each counter in the counter tables
+    """
+
+    class Meta:
+        table_name = f"{ENVIRONMENT}-session-sketch"
+        region = AWS_REGION
+        max_pool_connections = AWS_MAX_POOL_CONNECTIONS
+        max_retry_attempts = AWS_MAX_ATTEMPTS
+        connect_timeout_seconds = AWS_CONNECT_TIMEOUT
+        read_timeout_seconds = AWS_READ_TIMEOUT
+
+    counter_id = UnicodeAttribute(hash_key=True)
+    sketch = BinaryAttribute()
+    # Saves are conditional on the version, so concurrent updates can't clobber
+    # each other.
+    version = VersionAttribute()
@@ -0,0 +1,85 @@
+"""
+Sharded counters.
+
+A hot key can take more writes than a single DynamoDB partition allows. Sharded
+keys spread their writes over sub-items whose range key is the original key plus a
+shard suffix, and reads add the shards back up with a single Query over the range
+from the key to its last shard.
+"""
+from collections import defaultdict, deque
+import os
+import random
+import re
+import threading
+import time
+from typing import Deque, Dict, Hashable, Optional, Set, Tuple
+
+SHARD_SEPARATOR = "#shard="
+# Keys that are throttled this many times within the window get sharded.
+HOT_KEY_THROTTLES = int(os.environ.get("COUNTER_HOT_KEY_THROTTLES", 3))
+HOT_KEY_WINDOW_SECONDS = float(os.environ.get("COUNTER_HOT_KEY_WINDOW_SECONDS", 60))
+
+THROTTLE_ERROR_CODES = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+}
+
+_SHARD_SUFFIX = re.compile(re.escape(SHARD_SEPARATOR) + r"\d+$")
+
+
+def shard_key(key: str, shards: int) -> str:
+    """Pick a random shard of key to write to."""
+    return f"{key}{SHARD_SEPARATOR}{random.randrange(shards)}"
+
+
+def base_key(range_key: str) -> str:
+    """Strip the shard suffix, if any, from a range key."""
+    return _SHARD_SUFFIX.sub("", range_key)
+
+
+class HotKeyTracker:
+    """Track throttled writes per key and flag keys that are throttled repeatedly."""
+
+    def __init__(self, max_throttles: int, window_seconds: float):
+        self.max_throttles = max_throttles
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._throttles: Dict[Hashable, Deque[float]] = defaultdict(deque)
+        self._hot: Set[Hashable] = set()
+
+    def is_hot(self, key: Hashable) -> bool:
+        return key in self._hot
+
+    def record_throttle(self, key: Hashable) -> bool:
+        """Record a throttled write for key. Returns whether the key is now hot."""
+        now = time.monotonic()
+        with self._lock:
+            throttles = self._throttles[key]
+            throttles.append(now)
+            while throttles and throttles[0] <= now - self.window_seconds:
+                throttles.popleft()
+            if len(throttles) >= self.max_throttles:
+                self._hot.add(key)
+                del self._throttles[key]
+        return key in self._hot
+
+    def clear(self) -> None:
+        with self._lock:
+            self._throttles.clear()
+            self._hot.clear()
+
+
+hot_keys = HotKeyTracker(HOT_KEY_THROTTLES, HOT_KEY_WINDOW_SECONDS)
+
+
+def shard_count(table_name: str, key: Tuple, shards: int, hot_key_shards: int) -> int:
+    """The number of shards to write key to."""
+    if hot_key_shards > shards and hot_keys.is_hot((table_name, *key)):
+        return hot_key_shards
+    return shards
+
+
+def is_throttle(error: Exception) -> bool:
+    code: Optional[str] = getattr(error, "cause_response_code", None)
+    return code in THROTTLE_ERROR_CODES
@@ -0,0 +1,48 @@
+import datetime as dt
+import os
+from typing import Optional
+
+from pynamodb.models import Model
+from pynamodb.attributes import (
+    TTLAttribute,
+    UnicodeAttribute,
+    VersionAttribute,
+)
+
+from collector.aws import (
+    AWS_CONNECT_TIMEOUT,
+    AWS_MAX_ATTEMPTS,
+    AWS_MAX_POOL_CONNECTIONS,
+    AWS_READ_TIMEOUT,
+    AWS_REGION,
+)
+
+
+ENVIRONMENT = os.environ.get("ENVIRONMENT", "dev")
+
+
+class TopKeys(Model):
+    """
+    A Space-Saving summary of each user's most frequent keys per event type. fan_out
+    writes these (see fan_out/topk.py) and the collector only reads them.
+    """
+
+    class Meta:
+        table_name = f"{ENVIRONMENT}-top-keys"
+        region = AWS_REGION
+        max_pool_connections = AWS_MAX_POOL_CONNECTIONS
+        max_retry_attempts = AWS_MAX_ATTEMPTS
+        connect_timeout_seconds = AWS_CONNECT_TIMEOUT
+        read_timeout_seconds = AWS_READ_TIMEOUT
+
+    username = UnicodeAttribute(hash_key=True)
+    period = UnicodeAttribute(range_key=True)
+    # A JSON list of [key, count, error], most frequent first.
+    summary = UnicodeAttribute()
+    version = VersionAttribute()
+    expires_at = TTLAttribute(null=True)
+
+
+def period_key(event_type: str, day: Optional[dt.date] = None) -> str:
+    """The range key of the all-time summary, or of the summary for one day."""
+    return event_type if day is None else f"{event_type}#{day:%Y-%m-%d}"
@@ -0,0 +1,89 @@
+import hashlib
+import math
+from typing import Iterable, Optional
+import zlib
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HyperLogLog:
+    """
+    A HyperLogLog sketch for estimating the number of distinct strings added to it.
+
+    The sketch has 2**precision one-byte registers, and its standard error is about
+    1.04 / sqrt(2**precision): 1.6% at the default precision of 12, for 4 KiB. With a
+    64-bit hash, no large range correction is needed.
+    """
+
+    def __init__(self, precision: int, registers: Optional[bytearray] = None):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(
+                f"precision must be between {MIN_PRECISION} and {MAX_PRECISION}"
+            )
+        self.precision = precision
+        self.num_registers = 1 << precision
+        if registers is None:
+            registers = bytearray(self.num_registers)
+        elif len(registers) != self.num_registers:
+            raise ValueError("registers don't match the precision")
+        self.registers = registers
+
+    def add(self, value: str) -> bool:
+        """Add a value. Returns whether the sketch changed."""
+        hashed = _hash(value)
+        num_bits = 64 - self.precision
+        idx = hashed >> num_bits
+        rest = hashed & ((1 << num_bits) - 1)
+        # The position of the leftmost 1 bit in the rest of the hash.
+        rank = num_bits - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+            return True
+        return False
+
+    def update(self, values: Iterable[str]) -> bool:
+        changed = False
+        for value in values:
+            changed |= self.add(value)
+        return changed
+
+    def merge(self, other: "HyperLogLog") -> bool:
+        """Merge another sketch of the same precision in. Returns whether it changed."""
+        if other.precision != self.precision:
+            raise ValueError("Can't merge sketches of different precisions")
+        merged = bytearray(map(max, self.registers, other.registers))
+        changed = merged != self.registers
+        self.registers = merged
+        return changed
+
+    def count(self) -> int:
+        m = self.num_registers
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities.
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        """Serialize as the precision and the compressed registers."""
+        return bytes([self.precision]) + zlib.compress(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        return cls(data[0], bytearray(zlib.decompress(data[1:])))
@@ -0,0 +1,242 @@
+import asyncio
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import logging
+import time
+from typing import DefaultDict, List, Optional, Set, Tuple
+
+from pydantic import constr
+from starlette.concurrency import run_in_threadpool
+
+from collector import metrics
+from collector.aws import AWS_MAX_POOL_CONNECTIONS
+from collector.kinesis import put_record, put_record_batch
+from collector.lazy import lazy_import
+
+logger = logging.getLogger(__name__)
+
+dynamo = lazy_import("collector.dynamo")
+
+# The counter model in collector.dynamo for each event type, and the event field
+# that it counts by.
+COUNTERS = {
+    "page_view": ("PageViewCounter", "url"),
+    "button_click": ("ButtonClickCounter", "button_id"),
+}
+
+# An ID that clients may set on an event, so that retries of it are dropped.
+EventId = constr(min_length=1, max_length=128)
+
+
+def counter_for(event_type: str) -> tuple:
+    """Get the (counter model, key field) for an event type."""
+    model_name, key = COUNTERS[event_type]
+    return getattr(dynamo, model_name), key
+
+
+def update_unique_sessions(
+    CountModel, username: str, key: str, session_ids: List[str]
+) -> None:
+    """
+    Add session IDs to a counter's unique sessions sketch. Errors are logged rather
+    than raised, since the sketch is only an estimate.
+    """
+    if not dynamo.UNIQUE_SESSIONS_ENABLED:
+        return
+    try:
+        dynamo.update_unique_sessions(CountModel, username, key, session_ids)
+    except Exception:
+        logger.exception(f"Failed to update unique sessions for {username}/{key}")
+
+
+async def ingest_record(record: dict) -> bool:
+    """
+    Send a stamped record to Firehose and, if it has a username, update its counter.
+
+    The two writes run concurrently. If Firehose rejects the record, the counter
+    increment is undone so that rejected events are never counted. A record whose
+    event_id was already ingested is dropped, and counts as a success.
+    """
+    metrics.set_event_type(record["event_type"])
+    claimed = False
+    if record.get("event_id") is None:
+        record.pop("event_id", None)
+    elif dynamo.DEDUP_ENABLED:
+        args = (record.get("username"), record["event_id"])
+        claimed = await run_in_threadpool(dynamo.claim_event, *args)
+        if not claimed:
+            return True
+
+    accepted = False
+    try:
+        accepted, error = await _ingest_record(record)
+    finally:
+        # Once Firehose has the record, a retry must not send it again, even if
+        # the counter update failed.
+        if claimed and not accepted:
+            await run_in_threadpool(dynamo.release_event, *args)
+    if error is not None:
+        raise error
+    return accepted
+
+
+async def _ingest_record(record: dict) -> Tuple[bool, Optional[BaseException]]:
+    """
+    Returns whether Firehose accepted the record, and the error from either write
+    if one failed.
+    """
+    put = run_in_threadpool(put_record, record)
+    if "username" not in record:
+        try:
+            return await put, None
+        except Exception as e:
+            return False, e
+
+    CountModel, key = counter_for(record["event_type"])
+    count_args = (CountModel, record["username"], record[key])
+    received_at = record["received_at"]
+    # Adding a session to a sketch twice is harmless, so unlike the count, the
+    # sketch isn't rolled back if Firehose rejects the record.
+    success, counted, _ = await asyncio.gather(
+        put,
+        run_in_threadpool(dynamo.update_count, *count_args, received_at=received_at),
+        run_in_threadpool(update_unique_sessions, *count_args, [record["session_id"]]),
+        return_exceptions=True,
+    )
+    if isinstance(success, BaseException) or not success:
+        if not isinstance(counted, BaseException):
+            await run_in_threadpool(
+                dynamo.update_count, *count_args, count=-1, received_at=received_at
+            )
+        if isinstance(success, BaseException):
+            return False, success
+        return False, None
+    if isinstance(counted, BaseException):
+        return True, counted
+    return True, None
+
+
+def claim_records(records: List[dict]) -> List[bool]:
+    """
+    Claim the event IDs of a batch of records, concurrently. Returns whether each
+    record should be ingested, which is False for repeats of an event ID that was
+    already ingested or appears earlier in the batch.
+    """
+    keep = [True] * len(records)
+    if not dynamo.DEDUP_ENABLED or not any("event_id" in r for r in records):
+        return keep
+
+    in_batch = set()
+    to_claim = []
+    for idx, record in enumerate(records):
+        if "event_id" not in record:
+            continue
+        key = (record.get("username"), record["event_id"])
+        if key in in_batch:
+            keep[idx] = False
+        else:
+            in_batch.add(key)
+            to_claim.append(idx)
+
+    with ThreadPoolExecutor(max_workers=AWS_MAX_POOL_CONNECTIONS) as pool:
+        claims = [
+            # Copy the context so that the claims are timed in the request metrics.
+            pool.submit(
+                contextvars.copy_context().run,
+                dynamo.claim_event,
+                records[idx].get("username"),
+                records[idx]["event_id"],
+            )
+            for idx in to_claim
+        ]
+    errors = [claim.exception() for claim in claims if claim.exception() is not None]
+    if errors:
+        # Don't leave claims behind for events that won't be ingested.
+        for idx, claim in zip(to_claim, claims):
+            if claim.exception() is None and claim.result():
+                release_record(records[idx])
+        raise errors[0]
+    for idx, claim in zip(to_claim, claims):
+        keep[idx] = claim.result()
+    return keep
+
+
+def release_record(record: dict) -> None:
+    dynamo.release_event(record.get("username"), record["event_id"])
+
+
+def ingest_batch(events: List[Tuple[str, dict]], username: Optional[str]) -> dict:
+    """
+    Stamp a batch of (event_type, event) pairs, send them to Firehose in bulk, and
+    update the counters for every event that Firehose accepted.
+
+    Events whose event_id was already ingested are dropped, with a status of
+    "Duplicate". Returns a response body with a status for each event, in request
+    order.
+    """
+    event_types = {event_type for event_type, _ in events}
+    metrics.set_event_type(event_types.pop() if len(event_types) == 1 else "mixed")
+    received_at = int(time.time() * 1_000)  # Milliseconds since Unix epoch
+    records = []
+    for event_type, event in events:
+        record = dict(event)
+        if username is not None:
+            record["username"] = username
+        record["event_type"] = event_type
+        record["received_at"] = received_at
+        if record.get("event_id") is None:
+            record.pop("event_id", None)
+        records.append(record)
+
+    keep = claim_records(records)
+    new_records = [record for record, is_new in zip(records, keep) if is_new]
+    try:
+        new_successes = put_record_batch(new_records) if new_records else []
+    except BaseException:
+        # Nothing is known to have reached Firehose, so a retry must not be dropped.
+        for record in new_records:
+            if "event_id" in record:
+                release_record(record)
+        raise
+    for record, success in zip(new_records, new_successes):
+        if not success and "event_id" in record:
+            release_record(record)
+
+    # Duplicates were already ingested, so they count as received.
+    statuses = []
+    successes = iter(new_successes)
+    for is_new in keep:
+        if not is_new:
+            statuses.append("Duplicate")
+        else:
+            statuses.append("Received" if next(successes) else "Failed")
+
+    if username is not None:
+        # Aggregate the batch so that each counter gets a single update.
+        counts: Counter = Counter()
+        sessions: DefaultDict[Tuple[str, str], Set[str]] = defaultdict(set)
+        for record, success in zip(new_records, new_successes):
+            if success:
+                _, key = COUNTERS[record["event_type"]]
+                counts[(record["event_type"], record[key])] += 1
+                sessions[(record["event_type"], record[key])].add(record["session_id"])
+        for (event_type, key_value), count in counts.items():
+            CountModel, _ = counter_for(event_type)
+            dynamo.update_count(
+                CountModel, username, key_value, count=count, received_at=received_at
+            )
+            update_unique_sessions(
+                CountModel,
+                username,
+                key_value,
+                sorted(sessions[(event_type, key_value)]),
+            )
+
+    num_failed = statuses.count("Failed")
+    return {
+        "message": "Received",
+        "received": len(records) - num_failed,
+        "failed": num_failed,
+        "results": [{"status": status} for status in statuses],
+    }
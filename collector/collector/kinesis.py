@@ -1,21 +1,111 @@
-import json
 import logging
 import os
+import time
+from typing import Iterator, List
 
-import boto3
+from collector import codec, metrics
+from collector.aws import get_client
 
 logger = logging.getLogger(__name__)
 
 KINESIS_STREAM = os.environ.get("KINESIS_STREAM", "dev")
-AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
+
+# Firehose accepts at most 500 records, and 4 MiB, per PutRecordBatch call.
+MAX_BATCH_SIZE = 500
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+# Errors from Firehose that are worth retrying. Anything else fails immediately.
+RETRYABLE_ERROR_CODES = {
+    "ServiceUnavailableException",
+    "ThrottlingException",
+    "LimitExceededException",
+}
+MAX_BATCH_RETRIES = int(os.environ.get("KINESIS_MAX_BATCH_RETRIES", 3))
+BATCH_RETRY_BACKOFF_SECONDS = float(
+    os.environ.get("KINESIS_BATCH_RETRY_BACKOFF_SECONDS", 0.05)
+)
+
+
+def _encode(record: dict) -> bytes:
+    return codec.dumps(record) + b"\n"
 
 
 def put_record(record: dict) -> bool:
-    kinesis_client = boto3.client("firehose", region_name=AWS_REGION)
-    put_response = kinesis_client.put_record(
-        DeliveryStreamName=KINESIS_STREAM, Record={"Data": json.dumps(record) + "\n"}
-    )
+    kinesis_client = get_client("firehose")
+    with metrics.timer("firehose"):
+        put_response = kinesis_client.put_record(
+            DeliveryStreamName=KINESIS_STREAM, Record={"Data": _encode(record)}
+        )
     success = put_response["ResponseMetadata"]["HTTPStatusCode"] == 200
     if not success:
         logger.exception(put_response)
     return success
+
+
+def put_record_batch(records: List[dict]) -> List[bool]:
+    """
+    Put records into Firehose with PutRecordBatch. Records are sent in chunks of at
+    most MAX_BATCH_SIZE records and MAX_BATCH_BYTES, and only the records that
+    Firehose failed to ingest with a retryable error are retried.
+
+    Returns a list of success flags in the same order as records.
+    """
+    with metrics.timer("firehose"):
+        return _put_encoded_batch([{"Data": _encode(record)} for record in records])
+
+
+def _chunks(encoded: List[dict], indices: List[int]) -> Iterator[List[int]]:
+    """Split indices into encoded into chunks that fit in one PutRecordBatch call."""
+    chunk: List[int] = []
+    num_bytes = 0
+    for idx in indices:
+        size = len(encoded[idx]["Data"])
+        if chunk and (
+            len(chunk) == MAX_BATCH_SIZE or num_bytes + size > MAX_BATCH_BYTES
+        ):
+            yield chunk
+            chunk = []
+            num_bytes = 0
+        chunk.append(idx)
+        num_bytes += size
+    if chunk:
+        yield chunk
+
+
+def _put_encoded_batch(encoded: List[dict]) -> List[bool]:
+    from botocore.exceptions import ClientError
+
+    kinesis_client = get_client("firehose")
+    successes = [False] * len(encoded)
+    pending = list(range(len(encoded)))
+
+    for attempt in range(MAX_BATCH_RETRIES + 1):
+        if attempt > 0:
+            time.sleep(BATCH_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+        retryable = []
+        for chunk in _chunks(encoded, pending):
+            try:
+                put_response = kinesis_client.put_record_batch(
+                    DeliveryStreamName=KINESIS_STREAM,
+                    Records=[encoded[idx] for idx in chunk],
+                )
+            except ClientError as e:
+                logger.exception("Failed to put record batch")
+                if e.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES:
+                    retryable.extend(chunk)
+                continue
+
+            for idx, response in zip(chunk, put_response["RequestResponses"]):
+                if "ErrorCode" not in response:
+                    successes[idx] = True
+                elif response["ErrorCode"] in RETRYABLE_ERROR_CODES:
+                    retryable.append(idx)
+
+        pending = retryable
+        if not pending:
+            break
+
+    num_failed = successes.count(False)
+    if num_failed:
+        logger.error(f"Failed to put {num_failed} of {len(encoded)} records")
+    return successes
@@ -0,0 +1,47 @@
+import importlib.util
+import sys
+import threading
+from types import ModuleType
+from typing import Optional
+
+
+class LazyModule(ModuleType):
+    """
+    Stands in for a module until one of its attributes is used, then imports it and
+    forwards every attribute lookup to it.
+
+    The first lookup imports under a lock, since several threadpool calls of the
+    same request can reach it at once. importlib.util.LazyLoader isn't safe for
+    that: another thread can see the module half executed.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lock = threading.Lock()
+        self._module: Optional[ModuleType] = None
+
+    def _load(self) -> ModuleType:
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self.__name__)
+                module = self._module
+        return module
+
+    def __getattr__(self, attr: str):
+        # Only called for attributes that the stand-in doesn't have itself.
+        return getattr(self._load(), attr)
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Import a module without executing it until one of its attributes is used. This
+    keeps heavy dependencies like boto3 and pynamodb out of the Lambda cold start
+    until a request actually needs them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    return LazyModule(name)
@@ -1,11 +1,18 @@
+from functools import lru_cache
+
 from fastapi import FastAPI, Request
+from fastapi.exception_handlers import http_exception_handler
+from starlette.exceptions import HTTPException
 from starlette.middleware.cors import CORSMiddleware
 
-from collector.routers import web, button
+from collector.compression import GzipRequestMiddleware
+from collector.metrics import MetricsMiddleware
+from collector.routers import web, button, events
 
 tags_metadata = [
     {"name": "web", "description": "General website product analytics"},
     {"name": "button", "description": "Operations related to clicking buttons"},
+    {"name": "events", "description": "Batches of mixed event types"},
 ]
 
 app = FastAPI(
@@ -22,6 +29,7 @@ app = FastAPI(
 )
 app.include_router(web.router)
 app.include_router(button.router)
+app.include_router(events.router)
 
 # Some copy pasta from https://github.com/chgangaraju/fastapi-mangum-example/blob/master/app/main.py
 # Seems to allow me to query using client side javascript
@@ -32,6 +40,22 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Accept gzip-compressed request bodies (see collector.compression)
+app.add_middleware(GzipRequestMiddleware)
+# Time each request and emit its metrics (see collector.metrics)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(HTTPException)
+async def body_http_exception_handler(request: Request, exc: HTTPException):
+    """
+    FastAPI turns any error raised while reading a JSON body into a generic 400.
+    Errors that were already HTTP errors, such as the 413 for a gzip body that
+    decompresses to too much, are passed on as they were raised.
+    """
+    if isinstance(exc.__cause__, HTTPException):
+        exc = exc.__cause__
+    return await http_exception_handler(request, exc)
 
 
 @app.get("/")
@@ -39,34 +63,41 @@ def hello_world():
     return {"message": "Hello World"}
 
 
-# Below is taken from
+# Below is adapted from
 # https://github.com/jordaneremieff/mangum/issues/147#issuecomment-795857251
 # The code is needed to set the FastAPI root_path to contain the stage that serverless
 # deploys the API to (e.g. /dev). Specifically, the middleware below ensures that the
 # docs will be served correctly.
 
 
-@app.middleware("http")
-async def set_root_path_for_api_gateway(request: Request, call_next):
-    """Sets the FastAPI root_path dynamically from the ASGI request data."""
+@lru_cache(maxsize=None)
+def stage_root_path(stage: str) -> str:
+    return f"/{stage}"
+
+
+class APIGatewayRootPathMiddleware:
+    """
+    Sets the root_path of each request from the API Gateway stage in the ASGI scope.
 
-    root_path = request.scope["root_path"]
-    if root_path:
-        # Assume set correctly in this case
-        app.root_path = root_path
+    This is plain ASGI rather than @app.middleware("http") so that requests aren't
+    wrapped in an extra task and response stream, and it only changes the request's
+    scope, never the shared app.
+    """
 
-    else:
-        # fetch from AWS requestContext
-        if "aws.event" in request.scope:
-            context = request.scope["aws.event"]["requestContext"]
+    def __init__(self, app):
+        self.app = app
 
-            if "customDomain" not in context:
-                root_path = f"/{context['stage']}"
+    async def __call__(self, scope, receive, send):
+        # If the root_path is already set, assume that it is set correctly.
+        if scope["type"] == "http" and not scope.get("root_path"):
+            context = scope.get("aws.event", {}).get("requestContext", {})
+            if "stage" in context and "customDomain" not in context:
+                root_path = stage_root_path(context["stage"])
+                scope = dict(scope, root_path=root_path)
+                if scope["path"].startswith(root_path):
+                    scope["path"] = scope["path"][len(root_path) :]
+        await self.app(scope, receive, send)
 
-                if request.scope["path"].startswith(root_path):
-                    request.scope["path"] = request.scope["path"][len(root_path) :]
-                request.scope["root_path"] = root_path
-                app.root_path = root_path
 
-    response = await call_next(request)
-    return response
+# Added last so that the metrics middleware sees the path without the stage.
+app.add_middleware(APIGatewayRootPathMiddleware)
@@ -0,0 +1,127 @@
+"""
+Per-request latency metrics.
+
+Each request through the collector gets a RequestMetrics that the request path adds
+stage timings to. When the request finishes, the timings are printed to stdout as a
+CloudWatch Embedded Metric Format (EMF) log line, which CloudWatch turns into
+metrics without any extra API calls.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+import sys
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+from collector import codec
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "ServerlessEventCollector")
+DIMENSIONS = ["route", "event_type", "start"]
+
+_current: ContextVar[Optional["RequestMetrics"]] = ContextVar(
+    "request_metrics", default=None
+)
+_cold_start = True
+
+
+class RequestMetrics:
+    def __init__(self, start: str):
+        self.dimensions = {"route": "unmatched", "event_type": "none", "start": start}
+        self.timings: Dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _add(self, stage: str, milliseconds: float) -> None:
+        with self._lock:
+            self.timings[stage] = self.timings.get(stage, 0) + milliseconds
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        with self._lock:
+            # Everything before the first timed stage is routing, reading the body
+            # and validating it.
+            self.timings.setdefault("validation", (start - self._started) * 1_000)
+        try:
+            yield
+        finally:
+            self._add(stage, (time.perf_counter() - start) * 1_000)
+
+    def emf(self) -> dict:
+        self.timings["total"] = (time.perf_counter() - self._started) * 1_000
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1_000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [DIMENSIONS],
+                        "Metrics": [
+                            {"Name": stage, "Unit": "Milliseconds"}
+                            for stage in self.timings
+                        ],
+                    }
+                ],
+            },
+            **self.dimensions,
+            **self.timings,
+        }
+
+
+@contextmanager
+def timer(stage: str) -> Iterator[None]:
+    """Time a stage of the current request. Does nothing outside of a request."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+    else:
+        with metrics.timer(stage):
+            yield
+
+
+def set_event_type(event_type: str) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.dimensions["event_type"] = event_type
+
+
+def route_path(scope) -> str:
+    """
+    The path template of the route that handled a request, such as
+    "/web/page_view", or "unmatched". Raw request paths aren't used as they would
+    give the route dimension unbounded values.
+    """
+    endpoint = scope.get("endpoint")
+    router = scope.get("router")
+    if endpoint is not None and router is not None:
+        for route in router.routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware that times every HTTP request and emits its metrics."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        global _cold_start
+        metrics = RequestMetrics("cold" if _cold_start else "warm")
+        _cold_start = False
+        token = _current.set(metrics)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            # The router only records the matched route in the scope once it has
+            # routed the request.
+            metrics.dimensions["route"] = route_path(scope)
+            sys.stdout.write(codec.dumps(metrics.emf()).decode("utf-8") + "\n")
@@ -1,12 +1,17 @@
+import datetime as dt
 import time
+from typing import List, Optional
 
-from fastapi import APIRouter, Request, HTTPException
-from pydantic import BaseModel
-from pynamodb.exceptions import DoesNotExist, TableDoesNotExist
+from fastapi import APIRouter, Request, HTTPException, Query
+from pydantic import BaseModel, conlist
 
+from collector.cache import count_response
 from collector.context_utils import get_username
-from collector.dynamo import ButtonClickCounter, update_count
-from collector.kinesis import put_record
+from collector.ingest import EventId, ingest_batch, ingest_record
+from collector.kinesis import MAX_BATCH_SIZE
+from collector.lazy import lazy_import
+
+dynamo = lazy_import("collector.dynamo")
 
 router = APIRouter(prefix="/button")
 
@@ -14,36 +19,147 @@ router = APIRouter(prefix="/button")
 class ButtonClick(BaseModel):
     session_id: str
     button_id: str
+    # Set by clients so that retried events are only ingested once.
+    event_id: Optional[EventId]
+
+
+ButtonClickBatch = conlist(ButtonClick, min_items=1, max_items=MAX_BATCH_SIZE)
 
 
 @router.post("/click", tags=["button"])
-def button_click(button_click: ButtonClick, request: Request):
+async def button_click(button_click: ButtonClick, request: Request):
     record = button_click.dict()
-    username_provided = False
     try:
         record["username"] = get_username(request)
-        username_provided = True
     except KeyError:
         pass
     record["event_type"] = "button_click"
     record["received_at"] = int(time.time() * 1_000)  # Milliseconds since Unix epoch
-    success = put_record(record)
+    success = await ingest_record(record)
     if success:
-        if username_provided:
-            update_count(ButtonClickCounter, record["username"], record["button_id"])
         return {"message": "Received"}
     else:
         raise HTTPException(status_code=500, detail="Unknown error")
 
 
+@router.post("/clicks", tags=["button"])
+def button_clicks(button_clicks: ButtonClickBatch, request: Request):
+    try:
+        username = get_username(request)
+    except KeyError:
+        username = None
+    response = ingest_batch(
+        [("button_click", button_click.dict()) for button_click in button_clicks],
+        username,
+    )
+    if not response["received"]:
+        raise HTTPException(status_code=500, detail="Unknown error")
+    return response
+
+
 @router.get("/click/count", tags=["button"])
-def button_click_counts(button_id: str, request: Request):
+def button_click_counts(
+    button_id: str,
+    request: Request,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+):
+    """
+    Get the lifetime count, or the count between since and until (milliseconds since
+    the Unix epoch, at hour resolution) if since is given.
+    """
+    if since is None and until is not None:
+        raise HTTPException(status_code=422, detail="until requires since")
     try:
         username = get_username(request)
     except KeyError:
         return {"count": 0}
 
+    if since is not None:
+        if until is None:
+            until = int(time.time() * 1_000)
+        try:
+            count = dynamo.get_count_between(
+                dynamo.ButtonClickCounter, username, button_id, since, until
+            )
+        except dynamo.ExpiredBuckets as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return {"count": count}
+    return count_response(
+        request, dynamo.get_count(dynamo.ButtonClickCounter, username, button_id)
+    )
+
+
+@router.get("/click/counts", tags=["button"])
+def button_click_bulk_counts(request: Request, button_id: List[str] = Query(...)):
     try:
-        return {"count": ButtonClickCounter.get(username, button_id).count}
-    except (DoesNotExist, TableDoesNotExist):
-        return {"count": 0}
+        username = get_username(request)
+    except KeyError:
+        return {"counts": {key: 0 for key in button_id}}
+
+    return {"counts": dynamo.get_counts(dynamo.ButtonClickCounter, username, button_id)}
+
+
+@router.get("/click/counts/all", tags=["button"])
+def button_click_all_counts(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    start_after: Optional[str] = None,
+    sort_by_count: bool = False,
+):
+    try:
+        username = get_username(request)
+    except KeyError:
+        return {"counts": [], "next": None}
+
+    counts, next_key = dynamo.list_counts(
+        dynamo.ButtonClickCounter,
+        username,
+        limit,
+        start_after=start_after,
+        sort_by_count=sort_by_count,
+    )
+    return {
+        "counts": [{"button_id": key, "count": count} for key, count in counts],
+        "next": next_key,
+    }
+
+
+@router.get("/click/unique_sessions", tags=["button"])
+def button_click_unique_sessions(button_id: str, request: Request):
+    """Get the approximate number of distinct sessions that clicked a button."""
+    try:
+        username = get_username(request)
+    except KeyError:
+        return {"unique_sessions": 0}
+
+    return {
+        "unique_sessions": dynamo.get_unique_sessions(
+            dynamo.ButtonClickCounter, username, button_id
+        )
+    }
+
+
+@router.get("/click/top", tags=["button"])
+def button_click_top(
+    request: Request,
+    k: int = Query(20, ge=1, le=1000),
+    day: Optional[dt.date] = None,
+):
+    """
+    Get the most clicked buttons, all time or on one day (UTC). Each count may be an
+    overestimate by up to its error. These are updated by fan_out, so they lag
+    behind the counts by Firehose's buffering interval.
+    """
+    try:
+        username = get_username(request)
+    except KeyError:
+        return {"top": []}
+
+    top = dynamo.get_top_keys("button_click", username, k, day)
+    return {
+        "top": [
+            {"button_id": key, "count": count, "error": error}
+            for key, count, error in top
+        ]
+    }
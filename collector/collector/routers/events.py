@@ -0,0 +1,166 @@
+from typing import AsyncIterator, List, Literal, Tuple, Union
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import ValidationError, conlist
+from starlette.concurrency import run_in_threadpool
+
+from collector import codec
+from collector.context_utils import get_username
+from collector.ingest import ingest_batch
+from collector.kinesis import MAX_BATCH_SIZE
+from collector.routers.button import ButtonClick
+from collector.routers.web import PageView
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class PageViewEvent(PageView):
+    event_type: Literal["page_view"]
+
+
+class ButtonClickEvent(ButtonClick):
+    event_type: Literal["button_click"]
+
+
+Event = Union[PageViewEvent, ButtonClickEvent]
+EventBatch = conlist(Event, min_items=1, max_items=MAX_BATCH_SIZE)
+EVENT_MODELS = {"page_view": PageViewEvent, "button_click": ButtonClickEvent}
+
+
+async def iter_lines(request: Request) -> AsyncIterator[bytes]:
+    """Split the request body into lines as it streams in."""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def parse_line(line: bytes) -> Event:
+    """Parse and validate one NDJSON line. Raises ValueError if it's invalid."""
+    try:
+        obj = codec.loads(line)
+    except codec.JSONDecodeError as e:
+        raise ValueError([{"loc": [], "msg": str(e), "type": "value_error.json"}])
+    event_type = obj.get("event_type") if isinstance(obj, dict) else None
+    if event_type not in EVENT_MODELS:
+        raise ValueError(
+            [
+                {
+                    "loc": ["event_type"],
+                    "msg": f"must be one of {', '.join(EVENT_MODELS)}",
+                    "type": "value_error",
+                }
+            ]
+        )
+    try:
+        return EVENT_MODELS[event_type].parse_obj(obj)
+    except ValidationError as e:
+        raise ValueError(e.errors())
+
+
+async def ndjson_events(request: Request) -> JSONResponse:
+    """
+    Ingest an NDJSON body of mixed events. Lines are validated one at a time and
+    forwarded to Firehose in batches of MAX_BATCH_SIZE, so the whole body is never
+    held in memory. Each non-empty line gets its own result.
+    """
+    try:
+        username = get_username(request)
+    except KeyError:
+        username = None
+
+    results: List[dict] = []
+    batch: List[Tuple[int, Event]] = []
+    received = failed = 0
+
+    async def send_batch():
+        nonlocal received, failed
+        response = await run_in_threadpool(
+            ingest_batch,
+            [
+                (event.event_type, event.dict(exclude={"event_type"}))
+                for _, event in batch
+            ],
+            username,
+        )
+        for (idx, _), result in zip(batch, response["results"]):
+            results[idx].update(result)
+        received += response["received"]
+        failed += response["failed"]
+        batch.clear()
+
+    line_number = 0
+    async for line in iter_lines(request):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            event = parse_line(line)
+        except ValueError as e:
+            (errors,) = e.args
+            results.append({"line": line_number, "status": "Invalid", "errors": errors})
+            continue
+        results.append({"line": line_number})
+        batch.append((len(results) - 1, event))
+        if len(batch) == MAX_BATCH_SIZE:
+            await send_batch()
+    if batch:
+        await send_batch()
+
+    if not received and not failed:
+        raise HTTPException(status_code=422, detail=results or "No events")
+    if not received:
+        raise HTTPException(status_code=500, detail="Unknown error")
+    return JSONResponse(
+        {
+            "message": "Received",
+            "received": received,
+            "failed": failed,
+            "invalid": len(results) - received - failed,
+            "results": results,
+        }
+    )
+
+
+class EventsRoute(APIRoute):
+    """Sends NDJSON bodies to ndjson_events instead of parsing them as JSON."""
+
+    def get_route_handler(self):
+        json_handler = super().get_route_handler()
+
+        async def handler(request: Request):
+            content_type = request.headers.get("content-type", "")
+            if content_type.split(";")[0].strip().lower() == NDJSON_MEDIA_TYPE:
+                return await ndjson_events(request)
+            return await json_handler(request)
+
+        return handler
+
+
+router = APIRouter(route_class=EventsRoute)
+
+
+@router.post("/events", tags=["events"])
+def events(events: EventBatch, request: Request):
+    """
+    Send a JSON array of events, or a body of newline-delimited events with
+    Content-Type: application/x-ndjson. NDJSON bodies aren't limited in the number
+    of events, and each line is validated on its own.
+    """
+    try:
+        username = get_username(request)
+    except KeyError:
+        username = None
+    response = ingest_batch(
+        [(event.event_type, event.dict(exclude={"event_type"})) for event in events],
+        username,
+    )
+    if not response["received"]:
+        raise HTTPException(status_code=500, detail="Unknown error")
+    return response
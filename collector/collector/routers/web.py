@@ -1,13 +1,17 @@
+import datetime as dt
 import time
-from typing import Optional
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, Request
-from pydantic import BaseModel
-from pynamodb.exceptions import DoesNotExist, TableDoesNotExist
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import BaseModel, conlist
 
+from collector.cache import count_response
 from collector.context_utils import get_username
-from collector.dynamo import PageViewCounter, update_count
-from collector.kinesis import put_record
+from collector.ingest import EventId, ingest_batch, ingest_record
+from collector.kinesis import MAX_BATCH_SIZE
+from collector.lazy import lazy_import
+
+dynamo = lazy_import("collector.dynamo")
 
 router = APIRouter(prefix="/web")
 
@@ -18,36 +22,145 @@ class PageView(BaseModel):
     ipaddress: Optional[str]
     useragent: Optional[str]
     session_id: str
+    # Set by clients so that retried events are only ingested once.
+    event_id: Optional[EventId]
+
+
+PageViewBatch = conlist(PageView, min_items=1, max_items=MAX_BATCH_SIZE)
 
 
 @router.post("/page_view", tags=["web"])
-def page_view(page_view: PageView, request: Request):
+async def page_view(page_view: PageView, request: Request):
     record = page_view.dict()
-    username_provided = False
     try:
         record["username"] = get_username(request)
-        username_provided = True
     except KeyError:
         pass
     record["event_type"] = "page_view"
     record["received_at"] = int(time.time() * 1_000)  # Milliseconds since Unix epoch
-    success = put_record(record)
+    success = await ingest_record(record)
     if success:
-        if username_provided:
-            update_count(PageViewCounter, record["username"], record["url"])
         return {"message": "Received"}
     else:
         raise HTTPException(status_code=500, detail="Unknown error")
 
 
+@router.post("/page_views", tags=["web"])
+def page_views(page_views: PageViewBatch, request: Request):
+    try:
+        username = get_username(request)
+    except KeyError:
+        username = None
+    response = ingest_batch(
+        [("page_view", page_view.dict()) for page_view in page_views], username
+    )
+    if not response["received"]:
+        raise HTTPException(status_code=500, detail="Unknown error")
+    return response
+
+
 @router.get("/page_view/count", tags=["web"])
-def page_view_counts(url: str, request: Request):
+def page_view_counts(
+    url: str,
+    request: Request,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+):
+    """
+    Get the lifetime count, or the count between since and until (milliseconds since
+    the Unix epoch, at hour resolution) if since is given.
+    """
+    if since is None and until is not None:
+        raise HTTPException(status_code=422, detail="until requires since")
     try:
         username = get_username(request)
     except KeyError:
         return {"count": 0}
 
+    if since is not None:
+        if until is None:
+            until = int(time.time() * 1_000)
+        try:
+            count = dynamo.get_count_between(
+                dynamo.PageViewCounter, username, url, since, until
+            )
+        except dynamo.ExpiredBuckets as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return {"count": count}
+    return count_response(
+        request, dynamo.get_count(dynamo.PageViewCounter, username, url)
+    )
+
+
+@router.get("/page_view/counts", tags=["web"])
+def page_view_bulk_counts(request: Request, url: List[str] = Query(...)):
     try:
-        return {"count": PageViewCounter.get(username, url).count}
-    except (DoesNotExist, TableDoesNotExist):
-        return {"count": 0}
+        username = get_username(request)
+    except KeyError:
+        return {"counts": {key: 0 for key in url}}
+
+    return {"counts": dynamo.get_counts(dynamo.PageViewCounter, username, url)}
+
+
+@router.get("/page_view/counts/all", tags=["web"])
+def page_view_all_counts(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    start_after: Optional[str] = None,
+    sort_by_count: bool = False,
+):
+    try:
+        username = get_username(request)
+    except KeyError:
+        return {"counts": [], "next": None}
+
+    counts, next_key = dynamo.list_counts(
+        dynamo.PageViewCounter,
+        username,
+        limit,
+        start_after=start_after,
+        sort_by_count=sort_by_count,
+    )
+    return {
+        "counts": [{"url": key, "count": count} for key, count in counts],
+        "next": next_key,
+    }
+
+
+@router.get("/page_view/unique_sessions", tags=["web"])
+def page_view_unique_sessions(url: str, request: Request):
+    """Get the approximate number of distinct sessions that viewed a page."""
+    try:
+        username = get_username(request)
+    except KeyError:
+        return {"unique_sessions": 0}
+
+    return {
+        "unique_sessions": dynamo.get_unique_sessions(
+            dynamo.PageViewCounter, username, url
+        )
+    }
+
+
+@router.get("/page_view/top", tags=["web"])
+def page_view_top(
+    request: Request,
+    k: int = Query(20, ge=1, le=1000),
+    day: Optional[dt.date] = None,
+):
+    """
+    Get the most viewed pages, all time or on one day (UTC). Each count may be an
+    overestimate by up to its error. These are updated by fan_out, so they lag
+    behind the counts by Firehose's buffering interval.
+    """
+    try:
+        username = get_username(request)
+    except KeyError:
+        return {"top": []}
+
+    top = dynamo.get_top_keys("page_view", username, k, day)
+    return {
+        "top": [
+            {"url": key, "count": count, "error": error} for key, count, error in top
+        ]
+    }
@@ -1,6 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
 
+from collector.dynamo import count_cache, ensure_table, seen_events
 from collector.main import app
 
 
@@ -8,3 +9,12 @@ from collector.main import app
 def test_app():
     client = TestClient(app)
     yield client
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Each test gets a fresh moto backend, so tables may need creating again.
+    count_cache.clear()
+    seen_events.clear()
+    ensure_table.cache_clear()
+    yield
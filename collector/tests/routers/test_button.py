@@ -3,14 +3,15 @@ from unittest import mock
 from moto import mock_dynamodb2
 import pytest
 
+from collector import dynamo, ingest
 from collector.routers import button
 
 
 @pytest.fixture(scope="function")
 def setup_dynamo():
     with mock_dynamodb2():
-        button.ButtonClickCounter.create_table(wait=True)
-        button.ButtonClickCounter(username="test-user", button_id="ABC", count=5).save()
+        dynamo.ButtonClickCounter.create_table(wait=True)
+        dynamo.ButtonClickCounter(username="test-user", button_id="ABC", count=5).save()
         yield
 
 
@@ -19,7 +20,7 @@ Button Click POST Tests
 """
 
 
-@mock.patch.object(button, "put_record")
+@mock.patch.object(ingest, "put_record")
 @mock.patch.object(button, "get_username")
 @mock.patch.object(button.time, "time")
 def test_button_click_success(
@@ -41,10 +42,10 @@ def test_button_click_success(
             "received_at": 123_000,
         }
     )
-    assert button.ButtonClickCounter.get("test-user", "ABC").count == 6
+    assert dynamo.ButtonClickCounter.get("test-user", "ABC").count == 6
 
 
-@mock.patch.object(button, "put_record")
+@mock.patch.object(ingest, "put_record")
 @mock.patch.object(button, "get_username")
 def test_button_click_new_user(mock_get_user, mock_put_record, test_app, setup_dynamo):
     mock_get_user.return_value = "new-user"
@@ -53,12 +54,12 @@ def test_button_click_new_user(mock_get_user, mock_put_record, test_app, setup_d
     response = test_app.post("/button/click", json=payload)
 
     assert response.status_code == 200
-    assert button.ButtonClickCounter.get("new-user", "ABC").count == 1
+    assert dynamo.ButtonClickCounter.get("new-user", "ABC").count == 1
 
 
 def test_button_click_success_bad_put(test_app, setup_dynamo):
     payload = {"session_id": "XYZ", "button_id": "ABC"}
-    with mock.patch.object(button, "put_record") as put_record:
+    with mock.patch.object(ingest, "put_record") as put_record:
         put_record.return_value = False
         response = test_app.post("/button/click", json=payload)
         assert response.status_code == 500
@@ -66,7 +67,7 @@ def test_button_click_success_bad_put(test_app, setup_dynamo):
 
 def test_button_click_success_bad_payload(test_app, setup_dynamo):
     payload = {"button_id": "ABC"}
-    with mock.patch.object(button, "put_record") as put_record:
+    with mock.patch.object(ingest, "put_record") as put_record:
         put_record.return_value = False
         response = test_app.post("/button/click", json=payload)
         assert response.status_code == 422
@@ -109,3 +110,102 @@ def test_button_click_counts_unknown_button(mock_get_user, test_app, setup_dynam
     response = test_app.get("/button/click/count", params=payload)
     assert response.status_code == 200
     assert response.json() == {"count": 0}
+
+
+"""
+Button Clicks Batch POST Tests
+"""
+
+
+@mock.patch.object(button, "get_username")
+def test_button_clicks_success(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+
+    payload = [
+        {"session_id": "XYZ", "button_id": "ABC"},
+        {"session_id": "XYZ", "button_id": "DEF"},
+    ]
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        put_record_batch.return_value = [True, False]
+        response = test_app.post("/button/clicks", json=payload)
+
+    assert response.status_code == 200
+    assert response.json()["results"] == [{"status": "Received"}, {"status": "Failed"}]
+    assert dynamo.ButtonClickCounter.get("test-user", "ABC").count == 6
+    with pytest.raises(dynamo.ButtonClickCounter.DoesNotExist):
+        dynamo.ButtonClickCounter.get("test-user", "DEF")
+
+
+"""
+Bulk and Listing Count Tests
+"""
+
+
+@mock.patch.object(button, "get_username")
+def test_button_click_bulk_counts(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+    params = {"button_id": ["ABC", "MISSING"]}
+    response = test_app.get("/button/click/counts", params=params)
+    assert response.status_code == 200
+    assert response.json() == {"counts": {"ABC": 5, "MISSING": 0}}
+
+
+def test_button_click_bulk_counts_no_username(test_app, setup_dynamo):
+    params = {"button_id": ["ABC"]}
+    response = test_app.get("/button/click/counts", params=params)
+    assert response.json() == {"counts": {"ABC": 0}}
+
+
+@mock.patch.object(button, "get_username")
+def test_button_click_all_counts(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+    dynamo.ButtonClickCounter(username="test-user", button_id="DEF", count=9).save()
+    dynamo.ButtonClickCounter(username="test-user", button_id="GHI", count=1).save()
+    dynamo.ButtonClickCounter(username="other-user", button_id="ABC", count=7).save()
+
+    response = test_app.get("/button/click/counts/all", params={"limit": 2})
+    assert response.json() == {
+        "counts": [
+            {"button_id": "ABC", "count": 5},
+            {"button_id": "DEF", "count": 9},
+        ],
+        "next": "DEF",
+    }
+
+    params = {"limit": 2, "start_after": "DEF"}
+    response = test_app.get("/button/click/counts/all", params=params)
+    assert response.json()["counts"] == [{"button_id": "GHI", "count": 1}]
+
+    params = {"limit": 2, "sort_by_count": True}
+    response = test_app.get("/button/click/counts/all", params=params)
+    assert response.json() == {
+        "counts": [
+            {"button_id": "DEF", "count": 9},
+            {"button_id": "ABC", "count": 5},
+        ],
+        "next": None,
+    }
+
+
+"""
+Button Click Unique Sessions Tests
+"""
+
+
+@mock.patch.object(button, "get_username")
+def test_button_click_unique_sessions(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+
+    payload = [
+        {"button_id": "ABC", "session_id": "XYZ"},
+        {"button_id": "ABC", "session_id": "XYZ"},
+        {"button_id": "ABC", "session_id": "DEF"},
+    ]
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        put_record_batch.return_value = [True, True, True]
+        assert test_app.post("/button/clicks", json=payload).status_code == 200
+
+    params = {"button_id": "ABC"}
+    response = test_app.get("/button/click/unique_sessions", params=params)
+    assert response.status_code == 200
+    assert response.json() == {"unique_sessions": 2}
@@ -0,0 +1,175 @@
+from unittest import mock
+
+from moto import mock_dynamodb2
+import pytest
+
+from collector import dynamo, ingest
+from collector.routers import events
+
+
+@pytest.fixture(scope="function")
+def setup_dynamo():
+    with mock_dynamodb2():
+        dynamo.PageViewCounter.create_table(wait=True)
+        dynamo.ButtonClickCounter.create_table(wait=True)
+        yield
+
+
+@mock.patch.object(ingest, "put_record_batch")
+@mock.patch.object(events, "get_username")
+@mock.patch.object(ingest.time, "time")
+def test_events_success(
+    mock_time, mock_get_user, mock_put_record_batch, test_app, setup_dynamo
+):
+    mock_time.return_value = 123
+    mock_get_user.return_value = "test-user"
+    mock_put_record_batch.return_value = [True, True]
+
+    payload = [
+        {"event_type": "page_view", "url": "http://something.com", "session_id": "XYZ"},
+        {"event_type": "button_click", "button_id": "ABC", "session_id": "XYZ"},
+    ]
+    response = test_app.post("/events", json=payload)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "message": "Received",
+        "received": 2,
+        "failed": 0,
+        "results": [{"status": "Received"}, {"status": "Received"}],
+    }
+    mock_put_record_batch.assert_called_with(
+        [
+            {
+                "url": "http://something.com",
+                "referral_url": None,
+                "ipaddress": None,
+                "useragent": None,
+                "session_id": "XYZ",
+                "username": "test-user",
+                "event_type": "page_view",
+                "received_at": 123_000,
+            },
+            {
+                "session_id": "XYZ",
+                "button_id": "ABC",
+                "username": "test-user",
+                "event_type": "button_click",
+                "received_at": 123_000,
+            },
+        ]
+    )
+    assert dynamo.PageViewCounter.get("test-user", "http://something.com").count == 1
+    assert dynamo.ButtonClickCounter.get("test-user", "ABC").count == 1
+
+
+@mock.patch.object(ingest, "put_record_batch")
+@mock.patch.object(events, "get_username")
+def test_events_partial_failure(
+    mock_get_user, mock_put_record_batch, test_app, setup_dynamo
+):
+    mock_get_user.return_value = "test-user"
+    mock_put_record_batch.return_value = [False, True]
+
+    payload = [
+        {"event_type": "button_click", "button_id": "ABC", "session_id": "XYZ"},
+        {"event_type": "button_click", "button_id": "DEF", "session_id": "XYZ"},
+    ]
+    response = test_app.post("/events", json=payload)
+
+    assert response.status_code == 200
+    assert response.json()["results"] == [{"status": "Failed"}, {"status": "Received"}]
+    with pytest.raises(dynamo.ButtonClickCounter.DoesNotExist):
+        dynamo.ButtonClickCounter.get("test-user", "ABC")
+    assert dynamo.ButtonClickCounter.get("test-user", "DEF").count == 1
+
+
+def test_events_all_failed(test_app):
+    payload = [{"event_type": "button_click", "button_id": "ABC", "session_id": "XYZ"}]
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        put_record_batch.return_value = [False]
+        response = test_app.post("/events", json=payload)
+        assert response.status_code == 500
+
+
+def test_events_unknown_event_type(test_app):
+    payload = [{"event_type": "scroll", "session_id": "XYZ"}]
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        response = test_app.post("/events", json=payload)
+        assert response.status_code == 422
+        put_record_batch.assert_not_called()
+
+
+def test_events_too_many(test_app):
+    payload = [
+        {"event_type": "button_click", "button_id": "ABC", "session_id": "XYZ"}
+    ] * (events.MAX_BATCH_SIZE + 1)
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        response = test_app.post("/events", json=payload)
+        assert response.status_code == 422
+        put_record_batch.assert_not_called()
+
+
+@mock.patch.object(ingest, "put_record_batch")
+@mock.patch.object(events, "get_username")
+def test_events_ndjson(mock_get_user, mock_put_record_batch, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+    mock_put_record_batch.return_value = [True, True]
+
+    lines = [
+        b'{"event_type": "page_view", "url": "http://something.com", "session_id": "XYZ"}',
+        b"",
+        b'{"event_type": "button_click", "session_id": "XYZ"}',
+        b"not json",
+        b'{"event_type": "scroll", "session_id": "XYZ"}',
+        b'{"event_type": "button_click", "button_id": "ABC", "session_id": "XYZ"}',
+    ]
+    response = test_app.post(
+        "/events",
+        data=b"\n".join(lines) + b"\n",
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["received"], body["failed"], body["invalid"]) == (2, 0, 3)
+    assert [(result["line"], result["status"]) for result in body["results"]] == [
+        (1, "Received"),
+        (3, "Invalid"),
+        (4, "Invalid"),
+        (5, "Invalid"),
+        (6, "Received"),
+    ]
+    assert body["results"][1]["errors"][0]["loc"] == ["button_id"]
+    assert body["results"][3]["errors"][0]["loc"] == ["event_type"]
+    records = mock_put_record_batch.call_args[0][0]
+    assert [record["event_type"] for record in records] == ["page_view", "button_click"]
+    assert dynamo.ButtonClickCounter.get("test-user", "ABC").count == 1
+
+
+@mock.patch.object(ingest, "put_record_batch")
+def test_events_ndjson_batches(mock_put_record_batch, test_app):
+    mock_put_record_batch.side_effect = lambda records: [True] * len(records)
+    line = b'{"event_type": "button_click", "button_id": "ABC", "session_id": "XYZ"}'
+    response = test_app.post(
+        "/events",
+        data=b"\n".join([line] * (events.MAX_BATCH_SIZE + 1)),
+        headers={"Content-Type": "application/x-ndjson; charset=utf-8"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["received"] == events.MAX_BATCH_SIZE + 1
+    batch_sizes = [len(call[0][0]) for call in mock_put_record_batch.call_args_list]
+    assert batch_sizes == [events.MAX_BATCH_SIZE, 1]
+
+
+def test_events_ndjson_all_invalid(test_app):
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        response = test_app.post(
+            "/events",
+            data=b'{"event_type": "scroll"}\n',
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        put_record_batch.assert_not_called()
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["status"] == "Invalid"
@@ -1,16 +1,18 @@
+import threading
 from unittest import mock
 
 from moto import mock_dynamodb2
 import pytest
 
+from collector import cache, dynamo, ingest
 from collector.routers import web
 
 
 @pytest.fixture(scope="function")
 def setup_dynamo():
     with mock_dynamodb2():
-        web.PageViewCounter.create_table(wait=True)
-        web.PageViewCounter(
+        dynamo.PageViewCounter.create_table(wait=True)
+        dynamo.PageViewCounter(
             username="test-user", url="http://something.com", count=5
         ).save()
         yield
@@ -21,7 +23,7 @@ Page View POST Tests
 """
 
 
-@mock.patch.object(web, "put_record")
+@mock.patch.object(ingest, "put_record")
 @mock.patch.object(web, "get_username")
 @mock.patch.object(web.time, "time")
 def test_page_view_success(
@@ -51,10 +53,10 @@ def test_page_view_success(
             "received_at": 123_000,
         }
     )
-    assert web.PageViewCounter.get("test-user", "http://something.com").count == 6
+    assert dynamo.PageViewCounter.get("test-user", "http://something.com").count == 6
 
 
-@mock.patch.object(web, "put_record")
+@mock.patch.object(ingest, "put_record")
 @mock.patch.object(web, "get_username")
 def test_page_view_new_user(mock_get_user, mock_put_record, test_app, setup_dynamo):
     mock_get_user.return_value = "new-user"
@@ -68,7 +70,7 @@ def test_page_view_new_user(mock_get_user, mock_put_record, test_app, setup_dyna
     response = test_app.post("/web/page_view", json=payload)
 
     assert response.status_code == 200
-    assert web.PageViewCounter.get("new-user", "http://something.com").count == 1
+    assert dynamo.PageViewCounter.get("new-user", "http://something.com").count == 1
 
 
 def test_page_view_success_bad_put(test_app):
@@ -78,15 +80,97 @@ def test_page_view_success_bad_put(test_app):
         "useragent": "some-string",
         "session_id": "XYZ",
     }
-    with mock.patch.object(web, "put_record") as put_record:
+    with mock.patch.object(ingest, "put_record") as put_record:
         put_record.return_value = False
         response = test_app.post("/web/page_view", json=payload)
         assert response.status_code == 500
 
 
+@mock.patch.object(web, "get_username")
+def test_page_view_bad_put_not_counted(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+
+    payload = {"url": "http://something.com", "session_id": "XYZ"}
+    with mock.patch.object(ingest, "put_record") as put_record:
+        put_record.return_value = False
+        response = test_app.post("/web/page_view", json=payload)
+        assert response.status_code == 500
+    assert dynamo.PageViewCounter.get("test-user", "http://something.com").count == 5
+
+
+@mock.patch.object(web, "get_username")
+def test_page_view_duplicate(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+
+    payload = {"url": "http://something.com", "session_id": "XYZ", "event_id": "1"}
+    with mock.patch.object(ingest, "put_record") as put_record:
+        put_record.return_value = True
+        for _ in range(2):
+            response = test_app.post("/web/page_view", json=payload)
+            assert response.status_code == 200
+        put_record.assert_called_once()
+        assert put_record.call_args[0][0]["event_id"] == "1"
+    assert dynamo.PageViewCounter.get("test-user", "http://something.com").count == 6
+
+
+@mock.patch.object(web, "get_username")
+def test_page_view_retry_after_bad_put(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+
+    payload = {"url": "http://something.com", "session_id": "XYZ", "event_id": "1"}
+    with mock.patch.object(ingest, "put_record") as put_record:
+        put_record.return_value = False
+        response = test_app.post("/web/page_view", json=payload)
+        assert response.status_code == 500
+        put_record.return_value = True
+        response = test_app.post("/web/page_view", json=payload)
+        assert response.status_code == 200
+        assert put_record.call_count == 2
+    assert dynamo.PageViewCounter.get("test-user", "http://something.com").count == 6
+
+
+@mock.patch.object(web, "get_username")
+def test_page_view_retry_after_failed_count(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+
+    payload = {"url": "http://something.com", "session_id": "XYZ", "event_id": "1"}
+    with mock.patch.object(ingest, "put_record") as put_record, mock.patch.object(
+        dynamo, "update_count", side_effect=RuntimeError("Throttled")
+    ):
+        put_record.return_value = True
+        with pytest.raises(RuntimeError):
+            test_app.post("/web/page_view", json=payload)
+        # Firehose already has the event, so the retry mustn't send it again.
+        response = test_app.post("/web/page_view", json=payload)
+        assert response.status_code == 200
+        put_record.assert_called_once()
+
+
+@mock.patch.object(web, "get_username")
+def test_page_view_writes_concurrently(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+    # Both writes must be in flight at the same time to get past the barrier.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def put_record(record):
+        barrier.wait()
+        return True
+
+    def update_count(*args, **kwargs):
+        barrier.wait()
+        return 6
+
+    payload = {"url": "http://something.com", "session_id": "XYZ"}
+    with mock.patch.object(ingest, "put_record", put_record), mock.patch.object(
+        dynamo, "update_count", update_count
+    ):
+        response = test_app.post("/web/page_view", json=payload)
+    assert response.status_code == 200
+
+
 def test_page_view_success_bad_payload(test_app):
     payload = {"referral_url": "/", "useragent": "some-string", "session_id": "XYZ"}
-    with mock.patch.object(web, "put_record") as put_record:
+    with mock.patch.object(ingest, "put_record") as put_record:
         put_record.return_value = False
         response = test_app.post("/web/page_view", json=payload)
         assert response.status_code == 422
@@ -137,6 +221,80 @@ def test_page_view_counts_user_not_found(mock_get_user, test_app, setup_dynamo):
     assert response.json() == {"count": 0}
 
 
+@mock.patch.object(web, "get_username")
+def test_page_view_counts_cached(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+    payload = {"url": "http://something.com"}
+    assert test_app.get("/web/page_view/count", params=payload).json() == {"count": 5}
+
+    with mock.patch.object(dynamo.PageViewCounter, "get") as mock_get:
+        response = test_app.get("/web/page_view/count", params=payload)
+        mock_get.assert_not_called()
+    assert response.json() == {"count": 5}
+
+    # Local increments write through to the cache
+    with mock.patch.object(ingest, "put_record"):
+        test_app.post("/web/page_view", json={**payload, "session_id": "XYZ"})
+    with mock.patch.object(dynamo.PageViewCounter, "get") as mock_get:
+        response = test_app.get("/web/page_view/count", params=payload)
+        mock_get.assert_not_called()
+    assert response.json() == {"count": 6}
+
+
+@mock.patch.object(cache, "COUNT_CACHE_CONTROL_MAX_AGE", "10")
+@mock.patch.object(web, "get_username")
+def test_page_view_counts_etag(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+    payload = {"url": "http://something.com"}
+    response = test_app.get("/web/page_view/count", params=payload)
+    assert response.headers["cache-control"] == "private, max-age=10"
+    assert response.json() == {"count": 5}
+
+    etag = response.headers["etag"]
+    response = test_app.get(
+        "/web/page_view/count", params=payload, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+
+@mock.patch.object(web, "get_username")
+@mock.patch.object(web.time, "time")
+def test_page_view_counts_since(mock_time, mock_get_user, test_app, setup_dynamo):
+    mock_time.return_value = 1_612_139_400  # 2021-02-01 00:30 UTC
+    mock_get_user.return_value = "test-user"
+    payload = {"url": "http://something.com", "session_id": "XYZ"}
+    with mock.patch.object(ingest, "put_record"):
+        test_app.post("/web/page_view", json=payload)
+
+    params = {"url": "http://something.com", "since": 1_612_137_600_000}
+    response = test_app.get("/web/page_view/count", params=params)
+    assert response.json() == {"count": 1}
+
+    params["since"] += 3_600_000
+    params["until"] = params["since"] + 3_600_000
+    response = test_app.get("/web/page_view/count", params=params)
+    assert response.json() == {"count": 0}
+
+
+@mock.patch.object(web, "get_username")
+@mock.patch.object(web.time, "time")
+def test_page_view_counts_since_expired(
+    mock_time, mock_get_user, test_app, setup_dynamo
+):
+    mock_time.return_value = 1_612_139_400 + 30 * 86_400  # 2021-03-03 00:30 UTC
+    mock_get_user.return_value = "test-user"
+    # Hour buckets for 2021-02-01 have expired by now.
+    params = {"url": "http://something.com", "since": 1_612_141_200_000}
+    response = test_app.get("/web/page_view/count", params=params)
+    assert response.status_code == 422
+
+
+def test_page_view_counts_until_without_since(test_app):
+    params = {"url": "http://something.com", "until": 1_612_137_600_000}
+    response = test_app.get("/web/page_view/count", params=params)
+    assert response.status_code == 422
+
+
 @mock.patch.object(web, "get_username")
 def test_page_view_counts_unknown_url(mock_get_user, test_app, setup_dynamo):
     mock_get_user.return_value = "test-user"
@@ -149,3 +307,129 @@ def test_page_view_counts_unknown_url(mock_get_user, test_app, setup_dynamo):
     response = test_app.get("/web/page_view/count", params=payload)
     assert response.status_code == 200
     assert response.json() == {"count": 0}
+
+
+"""
+Page Views Batch POST Tests
+"""
+
+
+@mock.patch.object(web, "get_username")
+def test_page_views_success(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+
+    payload = [
+        {"url": "http://something.com", "session_id": "XYZ"},
+        {"url": "http://something.com", "session_id": "XYZ"},
+    ]
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        put_record_batch.return_value = [True, True]
+        response = test_app.post("/web/page_views", json=payload)
+
+    assert response.status_code == 200
+    assert response.json()["received"] == 2
+    assert dynamo.PageViewCounter.get("test-user", "http://something.com").count == 7
+
+
+@mock.patch.object(web, "get_username")
+def test_page_views_duplicates(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+    dynamo.claim_event("test-user", "1")
+
+    payload = [
+        {"url": "http://something.com", "session_id": "XYZ", "event_id": "1"},
+        {"url": "http://something.com", "session_id": "XYZ", "event_id": "2"},
+        {"url": "http://something.com", "session_id": "XYZ", "event_id": "2"},
+        {"url": "http://something.com", "session_id": "XYZ"},
+    ]
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        put_record_batch.return_value = [True, True]
+        response = test_app.post("/web/page_views", json=payload)
+        records = put_record_batch.call_args[0][0]
+
+    assert response.status_code == 200
+    assert response.json()["received"] == 4
+    assert [result["status"] for result in response.json()["results"]] == [
+        "Duplicate",
+        "Received",
+        "Duplicate",
+        "Received",
+    ]
+    assert [record.get("event_id") for record in records] == ["2", None]
+    assert "event_id" not in records[1]
+    assert dynamo.PageViewCounter.get("test-user", "http://something.com").count == 7
+
+
+@mock.patch.object(web, "get_username")
+def test_page_views_retry_after_failed_put(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+    payload = [{"url": "http://something.com", "session_id": "XYZ", "event_id": "1"}]
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        put_record_batch.side_effect = RuntimeError("Connection lost")
+        with pytest.raises(RuntimeError):
+            test_app.post("/web/page_views", json=payload)
+
+        put_record_batch.side_effect = None
+        put_record_batch.return_value = [True]
+        response = test_app.post("/web/page_views", json=payload)
+
+    assert response.status_code == 200
+    assert response.json()["results"] == [{"status": "Received"}]
+    assert put_record_batch.call_count == 2
+
+
+"""
+Page View Unique Sessions Tests
+"""
+
+
+@mock.patch.object(web, "get_username")
+def test_page_view_unique_sessions(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+
+    payload = [
+        {"url": "http://something.com", "session_id": "XYZ"},
+        {"url": "http://something.com", "session_id": "XYZ"},
+        {"url": "http://something.com", "session_id": "ABC"},
+    ]
+    with mock.patch.object(ingest, "put_record") as put_record:
+        put_record.return_value = True
+        for page_view in payload:
+            assert test_app.post("/web/page_view", json=page_view).status_code == 200
+
+    params = {"url": "http://something.com"}
+    response = test_app.get("/web/page_view/unique_sessions", params=params)
+    assert response.status_code == 200
+    assert response.json() == {"unique_sessions": 2}
+
+
+def test_page_view_unique_sessions_no_username(test_app, setup_dynamo):
+    params = {"url": "http://something.com"}
+    response = test_app.get("/web/page_view/unique_sessions", params=params)
+    assert response.json() == {"unique_sessions": 0}
+
+
+"""
+Page View Top Tests
+"""
+
+
+@mock.patch.object(web, "get_username")
+def test_page_view_top(mock_get_user, test_app, setup_dynamo):
+    mock_get_user.return_value = "test-user"
+    dynamo.TopKeys.create_table(wait=True)
+    dynamo.TopKeys(
+        "test-user", "page_view", summary='[["a.com",5,0],["b.com",3,1]]'
+    ).save()
+
+    response = test_app.get("/web/page_view/top", params={"k": 1})
+    assert response.status_code == 200
+    assert response.json() == {"top": [{"url": "a.com", "count": 5, "error": 0}]}
+
+    response = test_app.get("/web/page_view/top", params={"day": "2021-02-01"})
+    assert response.json() == {"top": []}
+
+
+def test_page_view_top_bad_k(test_app):
+    response = test_app.get("/web/page_view/top", params={"k": 0})
+    assert response.status_code == 422
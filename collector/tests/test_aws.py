@@ -0,0 +1,15 @@
+from collector import aws
+
+
+def test_get_client_is_shared():
+    assert aws.get_client("firehose") is aws.get_client("firehose")
+    assert aws.get_client("firehose") is not aws.get_client("s3")
+
+
+def test_client_config():
+    config = aws.client_config()
+    assert config.max_pool_connections == aws.AWS_MAX_POOL_CONNECTIONS
+    assert config.retries == {
+        "mode": aws.AWS_RETRY_MODE,
+        "max_attempts": aws.AWS_MAX_ATTEMPTS,
+    }
@@ -0,0 +1,33 @@
+from unittest import mock
+
+from collector import cache
+
+
+@mock.patch.object(cache.time, "monotonic")
+def test_ttl_cache_expires(mock_monotonic):
+    ttl_cache = cache.TTLCache(10, 5)
+    mock_monotonic.return_value = 100
+    ttl_cache.set("a", 1)
+    assert ttl_cache.get("a") == 1
+
+    mock_monotonic.return_value = 105
+    assert ttl_cache.get("a") is None
+    assert (ttl_cache.hits, ttl_cache.misses) == (1, 1)
+    assert len(ttl_cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    ttl_cache = cache.TTLCache(2, 60)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    ttl_cache.get("a")
+    ttl_cache.set("c", 3)
+    assert ttl_cache.get("b") is None
+    assert ttl_cache.get("a") == 1
+    assert ttl_cache.get("c") == 3
+
+
+def test_ttl_cache_disabled():
+    ttl_cache = cache.TTLCache(10, 0)
+    ttl_cache.set("a", 1)
+    assert ttl_cache.get("a") is None
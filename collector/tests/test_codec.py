@@ -0,0 +1,34 @@
+import pytest
+
+from collector import codec
+
+RECORD = {
+    "url": "https://example.com/ünïcode",
+    "referral_url": None,
+    "session_id": "XYZ",
+    "received_at": 1_612_137_600_000,
+}
+
+
+def test_backends_produce_the_same_bytes():
+    assert codec.dumps(RECORD) == codec._stdlib_dumps(RECORD)
+    assert isinstance(codec.dumps(RECORD), bytes)
+
+
+@pytest.mark.parametrize("dumps", [codec.dumps, codec._stdlib_dumps])
+def test_record_format(dumps):
+    # Downstream consumers see these bytes, so changing them needs a note in the
+    # README.
+    assert dumps({"url": "a.com/é", "n": 1}) == '{"url":"a.com/é","n":1}'.encode()
+
+
+@pytest.mark.parametrize("loads", [codec.loads, codec._stdlib_loads])
+def test_round_trip(loads):
+    assert loads(codec.dumps(RECORD)) == RECORD
+
+
+@pytest.mark.parametrize("loads", [codec.loads, codec._stdlib_loads])
+@pytest.mark.parametrize("data", [b"{not json", b'{"a": "\xff"}'])
+def test_decode_error(loads, data):
+    with pytest.raises(codec.JSONDecodeError):
+        loads(data)
@@ -0,0 +1,108 @@
+import asyncio
+import gzip
+import json
+from unittest import mock
+
+from fastapi import HTTPException
+import pytest
+
+from collector import compression, ingest
+
+
+def test_gzip_json_body(test_app):
+    payload = [{"button_id": "ABC", "session_id": "XYZ"}]
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        put_record_batch.return_value = [True]
+        response = test_app.post(
+            "/button/clicks",
+            data=gzip.compress(json.dumps(payload).encode()),
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+    assert response.status_code == 200
+    assert put_record_batch.call_args[0][0][0]["button_id"] == "ABC"
+
+
+def test_invalid_gzip_body(test_app):
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        response = test_app.post(
+            "/button/clicks",
+            data=b"not gzip",
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+        put_record_batch.assert_not_called()
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid gzip body"}
+
+
+def test_oversized_gzip_json_body(test_app):
+    button_id = "A" * compression.MAX_DECOMPRESSED_BYTES
+    payload = [{"button_id": button_id, "session_id": "XYZ"}]
+    with mock.patch.object(ingest, "put_record_batch") as put_record_batch:
+        response = test_app.post(
+            "/button/clicks",
+            data=gzip.compress(json.dumps(payload).encode()),
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+        put_record_batch.assert_not_called()
+    assert response.status_code == 413
+
+
+def _read_all(receive) -> bytes:
+    async def read():
+        body, more_body = b"", True
+        while more_body:
+            message = await receive()
+            body += message["body"]
+            more_body = message["more_body"]
+        return body
+
+    # Not asyncio.run, which leaves no current event loop for Mangum's tests.
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(read())
+    finally:
+        loop.close()
+
+
+def _receive_chunks(chunks):
+    messages = iter(
+        {"type": "http.request", "body": chunk, "more_body": idx < len(chunks) - 1}
+        for idx, chunk in enumerate(chunks)
+    )
+
+    async def receive():
+        return next(messages)
+
+    return receive
+
+
+def test_gzip_receive_streams_chunks():
+    body = b"x" * 10_000
+    compressed = gzip.compress(body)
+    chunks = [compressed[:10], compressed[10:]]
+    receive = compression.GzipReceive(
+        _receive_chunks(chunks), max_size=len(body), chunk_size=1_000
+    )
+    assert _read_all(receive) == body
+
+
+def test_gzip_receive_max_size():
+    receive = compression.GzipReceive(
+        _receive_chunks([gzip.compress(b"x" * 10_000)]),
+        max_size=5_000,
+        chunk_size=1_000,
+    )
+    with pytest.raises(HTTPException) as e:
+        _read_all(receive)
+    assert e.value.status_code == 413
+
+
+def test_gzip_receive_truncated():
+    receive = compression.GzipReceive(
+        _receive_chunks([gzip.compress(b"x" * 10_000)[:-8]]),
+        max_size=10_000,
+        chunk_size=1_000,
+    )
+    with pytest.raises(HTTPException) as e:
+        _read_all(receive)
+    assert e.value.status_code == 400
@@ -0,0 +1,306 @@
+import datetime as dt
+import threading
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+from moto import mock_dynamodb2
+from pynamodb.exceptions import UpdateError
+import pytest
+
+from collector import dynamo
+from collector.dynamo import buckets, shards
+
+
+@pytest.fixture(scope="function")
+def setup_dynamo():
+    with mock_dynamodb2():
+        dynamo.ensure_table.cache_clear()
+        yield
+    dynamo.ensure_table.cache_clear()
+    dynamo.hot_keys.clear()
+
+
+def test_update_count_creates_table_and_item(setup_dynamo):
+    dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com")
+    assert dynamo.PageViewCounter.get("test-user", "a.com").count == 1
+    dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com")
+    assert dynamo.PageViewCounter.get("test-user", "a.com").count == 2
+
+
+def test_update_count_by_n(setup_dynamo):
+    dynamo.update_count(dynamo.ButtonClickCounter, "test-user", "ABC", count=5)
+    assert dynamo.ButtonClickCounter.get("test-user", "ABC").count == 5
+
+
+def test_update_count_checks_table_once(setup_dynamo):
+    dynamo.PageViewCounter.create_table(wait=True)
+    with mock.patch.object(
+        dynamo.PageViewCounter, "exists", return_value=True
+    ) as mock_exists:
+        dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com")
+        dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com")
+    assert mock_exists.call_count == 1
+
+
+"""
+Sharded Counter Tests
+"""
+
+
+@mock.patch.object(dynamo.PageViewCounter.Meta, "shards", 4)
+def test_sharded_counts(setup_dynamo):
+    for _ in range(20):
+        dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com")
+    dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com/b", count=3)
+
+    items = list(dynamo.PageViewCounter.query("test-user"))
+    assert len(items) > 2
+    assert all("#shard=" in item.url for item in items)
+
+    assert dynamo.get_count(dynamo.PageViewCounter, "test-user", "a.com") == 20
+    counts = dynamo.get_counts(dynamo.PageViewCounter, "test-user", ["a.com", "x"])
+    assert counts == {"a.com": 20, "x": 0}
+    assert dynamo.list_counts(dynamo.PageViewCounter, "test-user", 1) == (
+        [("a.com", 20)],
+        "a.com",
+    )
+    assert dynamo.list_counts(
+        dynamo.PageViewCounter, "test-user", 1, start_after="a.com"
+    ) == ([("a.com/b", 3)], None)
+
+
+@mock.patch.object(dynamo.PageViewCounter.Meta, "shards", 4)
+def test_sharded_count_only_reads_its_shards(setup_dynamo):
+    dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com", count=2)
+    for _ in range(100):
+        dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com/page")
+
+    query = dynamo.PageViewCounter.query
+    read = []
+
+    def record_query(*args, **kwargs):
+        for item in query(*args, **kwargs):
+            read.append(item.url)
+            yield item
+
+    with mock.patch.object(dynamo.PageViewCounter, "query", record_query):
+        assert dynamo.get_count(dynamo.PageViewCounter, "test-user", "a.com") == 2
+    assert read and all(url.startswith("a.com#shard=") for url in read)
+
+
+@mock.patch.object(dynamo.PageViewCounter.Meta, "hot_key_shards", 4)
+def test_throttled_key_becomes_sharded(setup_dynamo):
+    dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com", count=5)
+
+    throttle = UpdateError(
+        "Throttled",
+        cause=ClientError(
+            {"Error": {"Code": "ProvisionedThroughputExceededException"}},
+            "UpdateItem",
+        ),
+    )
+    update = dynamo.PageViewCounter.update
+
+    def throttled_update(self, *args, **kwargs):
+        if self.url == "a.com":
+            raise throttle
+        return update(self, *args, **kwargs)
+
+    with mock.patch.object(dynamo.PageViewCounter, "update", throttled_update):
+        for _ in range(shards.HOT_KEY_THROTTLES - 1):
+            with pytest.raises(UpdateError):
+                dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com")
+        dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com")
+        dynamo.update_count(dynamo.PageViewCounter, "test-user", "a.com")
+
+    assert dynamo.get_count(dynamo.PageViewCounter, "test-user", "a.com") == 7
+
+
+"""
+Time Bucketed Counter Tests
+"""
+
+
+def _epoch_ms(*args):
+    return int(dt.datetime(*args, tzinfo=dt.timezone.utc).timestamp() * 1_000)
+
+
+@pytest.fixture
+def mock_now():
+    with mock.patch.object(buckets, "utc_now") as utc_now:
+        utc_now.return_value = dt.datetime(2021, 2, 6, tzinfo=dt.timezone.utc)
+        yield utc_now
+
+
+def test_bucket_ranges_within_a_day(mock_now):
+    since = dt.datetime(2021, 2, 1, 3, 30, tzinfo=dt.timezone.utc)
+    until = dt.datetime(2021, 2, 1, 5, 10, tzinfo=dt.timezone.utc)
+    assert buckets.bucket_ranges(since, until) == [
+        ("h#2021-02-01T03", "h#2021-02-01T05")
+    ]
+
+
+def test_bucket_ranges_across_days(mock_now):
+    since = dt.datetime(2021, 2, 1, 22, tzinfo=dt.timezone.utc)
+    until = dt.datetime(2021, 2, 5, 2, tzinfo=dt.timezone.utc)
+    assert buckets.bucket_ranges(since, until) == [
+        ("h#2021-02-01T22", "h#2021-02-01T23"),
+        ("d#2021-02-02", "d#2021-02-04"),
+        ("h#2021-02-05T00", "h#2021-02-05T01"),
+    ]
+
+
+def test_bucket_ranges_whole_days(mock_now):
+    since = dt.datetime(2021, 2, 1, tzinfo=dt.timezone.utc)
+    until = dt.datetime(2021, 2, 3, tzinfo=dt.timezone.utc)
+    assert buckets.bucket_ranges(since, until) == [("d#2021-02-01", "d#2021-02-02")]
+
+
+def test_bucket_ranges_rejects_expired_hours(mock_now):
+    mock_now.return_value = dt.datetime(2021, 2, 10, 12, tzinfo=dt.timezone.utc)
+    until = dt.datetime(2021, 2, 10, tzinfo=dt.timezone.utc)
+    with pytest.raises(buckets.ExpiredBuckets):
+        buckets.bucket_ranges(
+            dt.datetime(2021, 2, 3, 11, tzinfo=dt.timezone.utc), until
+        )
+    # Whole days are still kept, and so are hours that haven't expired yet.
+    assert buckets.bucket_ranges(
+        dt.datetime(2021, 2, 3, tzinfo=dt.timezone.utc), until
+    ) == [("d#2021-02-03", "d#2021-02-09")]
+    assert buckets.bucket_ranges(
+        dt.datetime(2021, 2, 3, 12, tzinfo=dt.timezone.utc), until
+    ) == [("h#2021-02-03T12", "h#2021-02-03T23"), ("d#2021-02-04", "d#2021-02-09")]
+
+
+def test_bucket_ranges_rejects_expired_days(mock_now):
+    mock_now.return_value = dt.datetime(2022, 3, 9, tzinfo=dt.timezone.utc)
+    since = dt.datetime(2021, 2, 1, tzinfo=dt.timezone.utc)
+    until = dt.datetime(2021, 2, 3, tzinfo=dt.timezone.utc)
+    with pytest.raises(buckets.ExpiredBuckets):
+        buckets.bucket_ranges(since, until)
+
+
+def test_get_count_between(setup_dynamo, mock_now):
+    for received_at in [
+        _epoch_ms(2021, 2, 1, 23, 59),
+        _epoch_ms(2021, 2, 2, 12),
+        _epoch_ms(2021, 2, 3, 1),
+        _epoch_ms(2021, 2, 3, 2),
+    ]:
+        dynamo.update_count(
+            dynamo.PageViewCounter, "test-user", "a.com", received_at=received_at
+        )
+
+    def count_between(since, until):
+        return dynamo.get_count_between(
+            dynamo.PageViewCounter, "test-user", "a.com", since, until
+        )
+
+    assert dynamo.get_count(dynamo.PageViewCounter, "test-user", "a.com") == 4
+    assert count_between(_epoch_ms(2021, 2, 1), _epoch_ms(2021, 2, 4)) == 4
+    assert count_between(_epoch_ms(2021, 2, 1, 23), _epoch_ms(2021, 2, 3, 2)) == 3
+    assert count_between(_epoch_ms(2021, 2, 2), _epoch_ms(2021, 2, 3)) == 1
+
+    bucket = buckets.BucketCounter.get(
+        buckets.counter_id(
+            dynamo.PageViewCounter.Meta.table_name, "test-user", "a.com"
+        ),
+        "h#2021-02-03T01",
+    )
+    assert bucket.expires_at == dt.datetime(2021, 2, 10, 2, tzinfo=dt.timezone.utc)
+
+
+def test_update_count_writes_buckets_concurrently(setup_dynamo):
+    # Each write waits for the other two, so this only passes if they overlap.
+    barrier = threading.Barrier(3)
+    with mock.patch.object(
+        dynamo, "_update_bucket_count", side_effect=lambda *_: barrier.wait(5)
+    ) as update_bucket, mock.patch.object(
+        dynamo, "_add_count", side_effect=lambda *_: barrier.wait(5)
+    ):
+        dynamo.update_count(
+            dynamo.PageViewCounter,
+            "test-user",
+            "a.com",
+            received_at=_epoch_ms(2021, 2, 1),
+        )
+    assert update_bucket.call_count == 2
+
+
+def test_update_count_raises_bucket_errors(setup_dynamo):
+    with mock.patch.object(
+        dynamo, "_update_bucket_count", side_effect=RuntimeError("boom")
+    ), pytest.raises(RuntimeError):
+        dynamo.update_count(
+            dynamo.PageViewCounter,
+            "test-user",
+            "a.com",
+            received_at=_epoch_ms(2021, 2, 1),
+        )
+    # The lifetime count was still written.
+    assert dynamo.PageViewCounter.get("test-user", "a.com").count == 1
+
+
+def test_claim_event(setup_dynamo):
+    assert dynamo.claim_event("test-user", "event-1")
+    assert not dynamo.claim_event("test-user", "event-1")
+    # Another container only has the conditional put to go on.
+    dynamo.seen_events.clear()
+    assert not dynamo.claim_event("test-user", "event-1")
+    # Event IDs are only unique per user.
+    assert dynamo.claim_event("other-user", "event-1")
+
+
+def test_release_event(setup_dynamo):
+    assert dynamo.claim_event("test-user", "event-1")
+    dynamo.release_event("test-user", "event-1")
+    assert dynamo.claim_event("test-user", "event-1")
+
+
+def test_unique_sessions(setup_dynamo):
+    model = dynamo.PageViewCounter
+    assert dynamo.get_unique_sessions(model, "test-user", "a.com") == 0
+    dynamo.update_unique_sessions(model, "test-user", "a.com", ["s1", "s2"])
+    dynamo.update_unique_sessions(model, "test-user", "a.com", ["s2", "s3"])
+    dynamo.count_cache.clear()
+    assert dynamo.get_unique_sessions(model, "test-user", "a.com") == 3
+    assert dynamo.get_unique_sessions(model, "test-user", "b.com") == 0
+
+
+def test_unique_sessions_retries_conflicts(setup_dynamo):
+    model = dynamo.PageViewCounter
+    dynamo.update_unique_sessions(model, "test-user", "a.com", ["s1"])
+    get = dynamo.SessionSketch.get
+    calls = []
+
+    def racing_get(*args, **kwargs):
+        sketch = get(*args, **kwargs)
+        if not calls:
+            calls.append(1)
+            # Another update lands between this read and the save.
+            dynamo.update_unique_sessions(model, "test-user", "a.com", ["s2"])
+        return sketch
+
+    with mock.patch.object(dynamo.SessionSketch, "get", racing_get):
+        dynamo.update_unique_sessions(model, "test-user", "a.com", ["s3"])
+    dynamo.count_cache.clear()
+    assert dynamo.get_unique_sessions(model, "test-user", "a.com") == 3
+
+
+def test_get_top_keys(setup_dynamo):
+    assert dynamo.get_top_keys("page_view", "test-user", 2) == []
+    dynamo.TopKeys.create_table(wait=True)
+    dynamo.TopKeys(
+        "test-user",
+        "page_view#2021-02-01",
+        summary='[["a.com",5,0],["b.com",3,1],["c.com",1,0]]',
+    ).save()
+    dynamo.count_cache.clear()
+
+    day = dt.date(2021, 2, 1)
+    assert dynamo.get_top_keys("page_view", "test-user", 2, day) == [
+        ("a.com", 5, 0),
+        ("b.com", 3, 1),
+    ]
+    assert dynamo.get_top_keys("page_view", "test-user", 2) == []
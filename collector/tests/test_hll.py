@@ -0,0 +1,57 @@
+import math
+
+import pytest
+
+from collector.hll import HyperLogLog
+
+
+@pytest.mark.parametrize("precision", [10, 12, 14])
+@pytest.mark.parametrize("num_sessions", [10, 1_000, 50_000])
+def test_error_bound(precision, num_sessions):
+    sketch = HyperLogLog(precision)
+    for idx in range(num_sessions):
+        sketch.add(f"session-{idx}")
+        # Repeats don't change the estimate.
+        sketch.add(f"session-{idx // 2}")
+    # Three standard errors, so this is deterministic in practice.
+    bound = 3 * 1.04 / math.sqrt(2**precision)
+    assert abs(sketch.count() - num_sessions) <= max(1, bound * num_sessions)
+
+
+def test_add_reports_changes():
+    sketch = HyperLogLog(12)
+    assert sketch.add("a")
+    assert not sketch.add("a")
+    assert not sketch.update(["a", "a"])
+
+
+def test_merge():
+    first, second, both = HyperLogLog(12), HyperLogLog(12), HyperLogLog(12)
+    first.update(f"a-{idx}" for idx in range(3_000))
+    second.update(f"b-{idx}" for idx in range(3_000))
+    both.update(f"a-{idx}" for idx in range(3_000))
+    both.update(f"b-{idx}" for idx in range(3_000))
+
+    assert first.merge(second)
+    assert first.registers == both.registers
+    assert not first.merge(second)
+    with pytest.raises(ValueError):
+        first.merge(HyperLogLog(10))
+
+
+def test_bytes_round_trip():
+    sketch = HyperLogLog(14)
+    sketch.update(f"session-{idx}" for idx in range(100))
+    data = sketch.to_bytes()
+    # Mostly empty registers compress well.
+    assert len(data) < 2**14 / 4
+    restored = HyperLogLog.from_bytes(data)
+    assert restored.precision == 14
+    assert restored.registers == sketch.registers
+
+
+def test_precision_bounds():
+    with pytest.raises(ValueError):
+        HyperLogLog(3)
+    with pytest.raises(ValueError):
+        HyperLogLog(17)
@@ -0,0 +1,91 @@
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+from collector import kinesis
+
+
+def _batch_response(error_indices, size):
+    return {
+        "FailedPutCount": len(error_indices),
+        "RequestResponses": [
+            {"ErrorCode": "ServiceUnavailableException"}
+            if idx in error_indices
+            else {"RecordId": str(idx)}
+            for idx in range(size)
+        ],
+    }
+
+
+@mock.patch.object(kinesis.time, "sleep")
+@mock.patch.object(kinesis, "get_client")
+def test_put_record_batch_retries_failed_records(mock_client, mock_sleep):
+    firehose = mock_client.return_value
+    firehose.put_record_batch.side_effect = [
+        _batch_response({1}, 3),
+        _batch_response(set(), 1),
+    ]
+    records = [{"n": 0}, {"n": 1}, {"n": 2}]
+
+    assert kinesis.put_record_batch(records) == [True, True, True]
+
+    retry_call = firehose.put_record_batch.call_args_list[1]
+    assert retry_call.kwargs["Records"] == [{"Data": b'{"n":1}\n'}]
+
+
+@mock.patch.object(kinesis.time, "sleep")
+@mock.patch.object(kinesis, "get_client")
+def test_put_record_batch_chunks(mock_client, mock_sleep):
+    firehose = mock_client.return_value
+    firehose.put_record_batch.side_effect = lambda **kwargs: _batch_response(
+        set(), len(kwargs["Records"])
+    )
+    records = [{"n": idx} for idx in range(kinesis.MAX_BATCH_SIZE + 1)]
+
+    assert all(kinesis.put_record_batch(records))
+    chunk_sizes = [
+        len(call.kwargs["Records"]) for call in firehose.put_record_batch.call_args_list
+    ]
+    assert chunk_sizes == [kinesis.MAX_BATCH_SIZE, 1]
+
+
+@mock.patch.object(kinesis.time, "sleep")
+@mock.patch.object(kinesis, "get_client")
+def test_put_record_batch_gives_up(mock_client, mock_sleep):
+    firehose = mock_client.return_value
+    firehose.put_record_batch.side_effect = ClientError(
+        {"Error": {"Code": "ServiceUnavailableException"}}, "PutRecordBatch"
+    )
+
+    assert kinesis.put_record_batch([{"n": 0}]) == [False]
+    assert firehose.put_record_batch.call_count == kinesis.MAX_BATCH_RETRIES + 1
+
+
+@mock.patch.object(kinesis.time, "sleep")
+@mock.patch.object(kinesis, "get_client")
+def test_put_record_batch_chunks_by_bytes(mock_client, mock_sleep):
+    firehose = mock_client.return_value
+    firehose.put_record_batch.side_effect = lambda **kwargs: _batch_response(
+        set(), len(kwargs["Records"])
+    )
+    # Each record is a little over 1 MiB encoded, so four don't fit in one call.
+    records = [{"n": "x" * 1024 * 1024} for _ in range(5)]
+
+    assert all(kinesis.put_record_batch(records))
+    chunk_sizes = [
+        len(call.kwargs["Records"]) for call in firehose.put_record_batch.call_args_list
+    ]
+    assert chunk_sizes == [3, 2]
+
+
+@mock.patch.object(kinesis.time, "sleep")
+@mock.patch.object(kinesis, "get_client")
+def test_put_record_batch_doesnt_retry_bad_requests(mock_client, mock_sleep):
+    firehose = mock_client.return_value
+    firehose.put_record_batch.side_effect = ClientError(
+        {"Error": {"Code": "InvalidArgumentException"}}, "PutRecordBatch"
+    )
+
+    assert kinesis.put_record_batch([{"n": 0}]) == [False]
+    firehose.put_record_batch.assert_called_once()
+    mock_sleep.assert_not_called()
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+import sys
+
+import pytest
+
+from collector.lazy import lazy_import
+
+
+@pytest.fixture
+def slow_module(tmp_path, monkeypatch):
+    (tmp_path / "slow_module.py").write_text(
+        "import time\ntime.sleep(0.2)\nVALUE = 42\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield "slow_module"
+    sys.modules.pop("slow_module", None)
+
+
+def test_lazy_import_defers_import(slow_module):
+    module = lazy_import(slow_module)
+    assert slow_module not in sys.modules
+    assert module.VALUE == 42
+    assert slow_module in sys.modules
+
+
+def test_lazy_import_concurrent_first_access(slow_module):
+    module = lazy_import(slow_module)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        values = list(pool.map(lambda _: module.VALUE, range(8)))
+    assert values == [42] * 8
+
+
+def test_lazy_import_missing_module():
+    with pytest.raises(ModuleNotFoundError):
+        lazy_import("collector.no_such_module")
@@ -0,0 +1,18 @@
+from benchmarks.events import api_gateway_event
+from collector import mangum
+from collector.main import app
+
+
+def test_stage_root_path():
+    response = mangum.handler(api_gateway_event("GET", "/dev/docs", stage="dev"), {})
+    assert response["statusCode"] == 200
+    assert "/dev/openapi.json" in response["body"]
+    assert app.root_path == ""
+
+
+def test_custom_domain_root_path():
+    event = api_gateway_event("GET", "/docs", stage="dev")
+    event["requestContext"]["customDomain"] = {"basePathMatched": "(none)"}
+    response = mangum.handler(event, {})
+    assert response["statusCode"] == 200
+    assert "/dev/openapi.json" not in response["body"]
@@ -0,0 +1,91 @@
+import base64
+import gzip
+import json
+from unittest import mock
+
+from moto import mock_dynamodb2
+import pytest
+
+from benchmarks.events import api_gateway_event
+from collector import dynamo, kinesis, mangum, metrics
+
+
+@pytest.fixture(scope="function")
+def setup_dynamo():
+    with mock_dynamodb2():
+        dynamo.PageViewCounter.create_table(wait=True)
+        yield
+
+
+def _emitted(capsys):
+    lines = capsys.readouterr().out.splitlines()
+    return [json.loads(line) for line in lines if line.startswith('{"_aws"')]
+
+
+@mock.patch.object(kinesis, "get_client")
+def test_page_view_metrics(mock_client, setup_dynamo, capsys):
+    mock_client.return_value.put_record.return_value = {
+        "ResponseMetadata": {"HTTPStatusCode": 200}
+    }
+    payload = {"url": "http://something.com", "session_id": "XYZ"}
+    event = api_gateway_event("POST", "/web/page_view", payload, username="test")
+
+    response = mangum.handler(event, {})
+    assert response["statusCode"] == 200
+
+    (emitted,) = _emitted(capsys)
+    assert emitted["route"] == "/web/page_view"
+    assert emitted["event_type"] == "page_view"
+    assert emitted["start"] in ("cold", "warm")
+    stages = ["validation", "auth_context", "firehose", "dynamodb", "sessions", "total"]
+    for stage in stages:
+        assert emitted[stage] >= 0
+    (directive,) = emitted["_aws"]["CloudWatchMetrics"]
+    assert directive["Namespace"] == metrics.METRICS_NAMESPACE
+    assert directive["Dimensions"] == [["route", "event_type", "start"]]
+    assert {metric["Name"] for metric in directive["Metrics"]} == set(stages)
+
+
+def test_second_request_is_warm(capsys):
+    mangum.handler(api_gateway_event("GET", "/"), {})
+    mangum.handler(api_gateway_event("GET", "/"), {})
+    emitted = _emitted(capsys)
+    assert emitted[-1]["start"] == "warm"
+    assert emitted[-1]["route"] == "/"
+    assert emitted[-1]["event_type"] == "none"
+
+
+@mock.patch.object(kinesis, "get_client")
+def test_gzip_request_route(mock_client, setup_dynamo, capsys):
+    mock_client.return_value.put_record.return_value = {
+        "ResponseMetadata": {"HTTPStatusCode": 200}
+    }
+    payload = {"url": "http://something.com", "session_id": "XYZ"}
+    body = gzip.compress(json.dumps(payload).encode())
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    event = api_gateway_event(
+        "POST",
+        "/web/page_view",
+        base64.b64encode(body).decode(),
+        username="test",
+        headers=headers,
+    )
+    event["isBase64Encoded"] = True
+
+    response = mangum.handler(event, {})
+    assert response["statusCode"] == 200
+    (emitted,) = _emitted(capsys)
+    assert emitted["route"] == "/web/page_view"
+
+
+def test_unmatched_route(capsys):
+    for path in ["/no/such/page", "/another/random/path"]:
+        response = mangum.handler(api_gateway_event("GET", path), {})
+        assert response["statusCode"] == 404
+    emitted = _emitted(capsys)
+    assert [e["route"] for e in emitted] == ["unmatched", "unmatched"]
+
+
+def test_timer_outside_request():
+    with metrics.timer("firehose"):
+        pass
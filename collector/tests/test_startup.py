@@ -0,0 +1,12 @@
+import os
+
+from benchmarks import startup
+
+# Generous enough for a slow CI machine, but catches heavy imports at startup.
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", 1.5))
+
+
+def test_startup_budget():
+    result = startup.measure_startup(runs=3)
+    assert result["deferred_modules_imported"] == []
+    assert result["first_response_seconds"] < STARTUP_BUDGET_SECONDS
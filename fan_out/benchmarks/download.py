@@ -0,0 +1,128 @@
+"""
+Measure fan_out's peak memory while reading synthetic Firehose objects of
+increasing size.
+
+Each object is served by a stand-in for botocore's StreamingBody that generates
+its lines on the fly, so the benchmark itself holds none of the object. Every
+case runs in a fresh process so that peak RSS (ru_maxrss) is its own:
+
+- read: the old download_key, which read the whole object and split it into
+  lines, with each line discarded as soon as it is iterated over.
+- stream: main.download_key, streaming the same lines.
+- read_record: main.read_record, streaming and routing every event. Routed events
+  are kept, encoded, until they're written, so this still grows with the object:
+  allow about five times the object size in memory.
+
+Run from the fan_out directory:
+
+    python -m benchmarks.download
+    python -m benchmarks.download --sizes 10 100 --cases stream read_record
+"""
+import argparse
+import datetime as dt
+import multiprocessing
+import resource
+import time
+import tracemalloc
+from typing import Iterator, List, Optional
+from unittest import mock
+
+import main
+
+CASES = ["read", "stream", "read_record"]
+RECEIVED_AT = int(dt.datetime(2021, 2, 1).timestamp() * 1_000)
+
+
+# An event line as the collector writes it, but much quicker to fill in.
+LINE_TEMPLATE = (
+    b'{"session_id":"session-%06d","url":"https://example.com/page/%d",'
+    b'"event_id":"event-%012d","username":"user-%d","event_type":"page_view",'
+    b'"received_at":%d}\n'
+)
+
+
+def synthetic_line(n: int) -> bytes:
+    return LINE_TEMPLATE % (n % 5_000, n % 1_000, n, n % 10, RECEIVED_AT + n)
+
+
+class SyntheticBody:
+    """Generates size_bytes of newline-delimited events, a whole line at a time."""
+
+    def __init__(self, size_bytes: int):
+        self.size_bytes = size_bytes
+        self.position = 0
+        self.line_number = 0
+        self.pending = b""
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        if amt is None:
+            return b"".join(iter(lambda: self.read(1024 * 1024), b""))
+        parts: List[bytes] = [self.pending]
+        length = len(self.pending)
+        while length < amt and self.position + length < self.size_bytes:
+            line = synthetic_line(self.line_number)
+            self.line_number += 1
+            parts.append(line)
+            length += len(line)
+        data = b"".join(parts)
+        chunk, self.pending = data[:amt], data[amt:]
+        self.position += len(chunk)
+        return chunk
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[bytes]:
+        return iter(lambda: self.read(chunk_size), b"")
+
+
+def old_download_key(body: SyntheticBody) -> List[bytes]:
+    return body.read().rstrip(b"\n").split(b"\n")
+
+
+def measure(case: str, size_mb: int, queue: multiprocessing.Queue) -> None:
+    body = SyntheticBody(size_mb * 1024 * 1024)
+    s3_client = mock.Mock()
+    s3_client.get_object.return_value = {"Body": body}
+    tracemalloc.start()
+    start = time.perf_counter()
+    with mock.patch.object(main, "get_client", return_value=s3_client):
+        if case == "read":
+            num_lines = sum(1 for _ in old_download_key(body))
+        elif case == "stream":
+            num_lines = sum(1 for _ in main.download_key("source", "key"))
+        else:
+            batch = main.read_record("source", "key")
+            num_lines = sum(batch.counter.values())
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    max_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((num_lines, elapsed, peak, max_rss_kib))
+
+
+def run() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    args = parser.parse_args()
+
+    main.logger.setLevel("WARNING")
+    print(
+        f"{'case':>12} {'size MB':>8} {'lines':>10} {'seconds':>8}"
+        f" {'peak traced MiB':>16} {'peak RSS MiB':>13}"
+    )
+    for size_mb in args.sizes:
+        for case in args.cases:
+            queue: multiprocessing.Queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=measure, args=(case, size_mb, queue)
+            )
+            process.start()
+            num_lines, elapsed, peak, max_rss_kib = queue.get()
+            process.join()
+            print(
+                f"{case:>12} {size_mb:>8} {num_lines:>10} {elapsed:>8.1f}"
+                f" {peak / 2**20:>16.1f} {max_rss_kib / 1024:>13.1f}"
+            )
+
+
+if __name__ == "__main__":
+    run()
@@ -1,23 +1,102 @@
 from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
 from functools import lru_cache
-import json
 import logging
-from typing import cast, Dict, List, Tuple, Optional
+from typing import (
+    cast,
+    AbstractSet,
+    Dict,
+    Iterable,
+    Iterator,
+    Set,
+    Tuple,
+    Type,
+    Optional,
+)
 import os
+import random
+import time
 import urllib
 import uuid
 
-import boto3
 from botocore.client import ClientError
+from pynamodb.exceptions import PutError, UpdateError
 from pynamodb.models import DoesNotExist, Model
-from pynamodb.attributes import NumberAttribute, UnicodeAttribute
+from pynamodb.attributes import (
+    NumberAttribute,
+    TTLAttribute,
+    UnicodeAttribute,
+    VersionAttribute,
+)
+
+import codec
+from aws import (
+    AWS_CONNECT_TIMEOUT,
+    AWS_MAX_ATTEMPTS,
+    AWS_MAX_POOL_CONNECTIONS,
+    AWS_READ_TIMEOUT,
+    AWS_REGION,
+    get_client,
+)
+from topk import SpaceSaving
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
 ENVIRONMENT = os.environ.get("ENVIRONMENT", "dev")
+# Keys kept in each top keys summary. Keys that make up more than 1/capacity of a
+# user's events are always among them.
+TOP_KEYS_CAPACITY = int(os.environ.get("TOP_KEYS_CAPACITY", 100))
+TOP_KEYS_DAILY_RETENTION = dt.timedelta(
+    days=int(os.environ.get("TOP_KEYS_DAILY_RETENTION_DAYS", 30))
+)
+# Longer keys, such as URLs with huge query strings, are cut to this many characters
+# in the top keys summaries.
+TOP_KEYS_MAX_KEY_LENGTH = int(os.environ.get("TOP_KEYS_MAX_KEY_LENGTH", 512))
+# Summaries are cut down to this size to stay well under DynamoDB's 400 KB item
+# size limit, which would otherwise make every save of the summary fail.
+TOP_KEYS_MAX_SUMMARY_BYTES = 350_000
+# Times to retry a summary update that lost a race with another fan_out.
+TOP_KEYS_MAX_RETRIES = int(os.environ.get("TOP_KEYS_MAX_RETRIES", 5))
+# The field that each event type's top keys are ranked by.
+TOP_KEY_FIELDS = {"page_view": "url", "button_click": "button_id"}
+# Objects in one S3 notification that are downloaded and parsed at once.
+RECORD_MAX_WORKERS = int(os.environ.get("RECORD_MAX_WORKERS", 4))
+# Bytes read from S3 at a time. Only this much of each object is held undecoded.
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 1024 * 1024))
+# Partitions written to the users' buckets at once.
+UPLOAD_MAX_WORKERS = int(os.environ.get("UPLOAD_MAX_WORKERS", 8))
+# Retries of a throttled PUT, on top of botocore's own.
+UPLOAD_MAX_RETRIES = int(os.environ.get("UPLOAD_MAX_RETRIES", 3))
+# Counter and top keys updates sent to DynamoDB at once.
+COUNTER_MAX_WORKERS = int(os.environ.get("COUNTER_MAX_WORKERS", 8))
+# Retries of a throttled counter update, on top of botocore's own.
+COUNTER_MAX_RETRIES = int(os.environ.get("COUNTER_MAX_RETRIES", 3))
+# Retries of throttled requests wait a random time up to base * 2**attempt seconds,
+# capped at the max.
+BACKOFF_BASE_SECONDS = float(os.environ.get("BACKOFF_BASE_SECONDS", 0.1))
+BACKOFF_MAX_SECONDS = float(os.environ.get("BACKOFF_MAX_SECONDS", 5))
+# Partitions that can't be written go under this prefix in the source bucket. It
+# must be outside the prefix that triggers fan_out.
+DEAD_LETTER_PREFIX = os.environ.get("DEAD_LETTER_PREFIX", "dead-letter")
+# DynamoDB error codes worth retrying.
+THROTTLE_ERROR_CODES = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+}
+# S3 error codes worth retrying.
+RETRYABLE_ERROR_CODES = {
+    "InternalError",
+    "RequestLimitExceeded",
+    "RequestTimeout",
+    "ServiceUnavailable",
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+}
 
 
 class EventCounter(Model):
@@ -27,69 +106,218 @@ class EventCounter(Model):
 
     class Meta:
         table_name = f"{ENVIRONMENT}-event-counter"
+        region = AWS_REGION
+        max_pool_connections = AWS_MAX_POOL_CONNECTIONS
+        max_retry_attempts = AWS_MAX_ATTEMPTS
+        connect_timeout_seconds = AWS_CONNECT_TIMEOUT
+        read_timeout_seconds = AWS_READ_TIMEOUT
 
     username = UnicodeAttribute(hash_key=True)
     event_name = UnicodeAttribute(range_key=True)
     count = NumberAttribute(default=0)
 
 
+@lru_cache(maxsize=None)
+def ensure_table(model: Type[Model]) -> None:
+    """Create the table for a model if it doesn't exist yet. Cached per container."""
+    if not model.exists():
+        model.create_table(billing_mode="PAY_PER_REQUEST", wait=True)
+
+
+def backoff(attempt: int) -> None:
+    """Sleep before retry number attempt + 1, with full jitter."""
+    limit = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+    time.sleep(random.uniform(0, limit))
+
+
+def add_count(username: str, event_name: str, count: int) -> None:
+    """
+    Add to a counter with a single atomic UpdateItem, which creates the item if it
+    doesn't exist yet. Throttled updates are retried with backoff.
+    """
+    for attempt in range(COUNTER_MAX_RETRIES + 1):
+        try:
+            EventCounter(username, event_name).update(
+                actions=[EventCounter.count.add(count)]  # type: ignore
+            )
+            return
+        except UpdateError as e:
+            if e.cause_response_code not in THROTTLE_ERROR_CODES:
+                raise
+            if attempt == COUNTER_MAX_RETRIES:
+                raise
+        backoff(attempt)
+
+
 def update_dynamo(counter: Counter) -> None:
-    if not EventCounter.exists():
-        EventCounter.create_table(billing_mode="PAY_PER_REQUEST", wait=True)
+    """Add every count in the counter, concurrently."""
+    if not counter:
+        return
+    ensure_table(EventCounter)
+    max_workers = min(COUNTER_MAX_WORKERS, len(counter))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(add_count, username, event_name, count)
+            for (username, event_name), count in counter.items()
+        ]
+        for future in futures:
+            future.result()
+
+
+class TopKeys(Model):
+    """
+    A Space-Saving summary of each user's most frequent keys per event type, all
+    time (period is the event type) and per day (period is event_type#YYYY-MM-DD)
+    """
+
+    class Meta:
+        table_name = f"{ENVIRONMENT}-top-keys"
+        region = AWS_REGION
+        max_pool_connections = AWS_MAX_POOL_CONNECTIONS
+        max_retry_attempts = AWS_MAX_ATTEMPTS
+        connect_timeout_seconds = AWS_CONNECT_TIMEOUT
+        read_timeout_seconds = AWS_READ_TIMEOUT
+
+    username = UnicodeAttribute(hash_key=True)
+    period = UnicodeAttribute(range_key=True)
+    summary = UnicodeAttribute()
+    # Saves are conditional on the version, so concurrent fan_outs can't clobber
+    # each other.
+    version = VersionAttribute()
+    expires_at = TTLAttribute(null=True)
+
+
+def update_top_keys(key_counts: Dict[Tuple[str, str, str], Counter]) -> None:
+    """
+    Merge counts per (username, event_type, day) and key into the all-time and daily
+    top keys summaries, concurrently.
 
-    for (username, event_name), count in counter.items():
+    The summaries are estimates, so a summary that can't be updated is logged and
+    skipped rather than failing the others.
+    """
+    if not key_counts:
+        return
+    ensure_table(TopKeys)
+
+    periods: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+    expiry: Dict[str, Optional[dt.datetime]] = {}
+    for (username, event_type, day), counts in key_counts.items():
+        for key, count in counts.items():
+            key = key[:TOP_KEYS_MAX_KEY_LENGTH]
+            periods[(username, event_type)][key] += count
+            periods[(username, f"{event_type}#{day}")][key] += count
+        expiry[event_type] = None
+        end_of_day = dt.datetime.strptime(day, "%Y-%m-%d") + dt.timedelta(days=1)
+        expiry[f"{event_type}#{day}"] = (
+            end_of_day.replace(tzinfo=dt.timezone.utc) + TOP_KEYS_DAILY_RETENTION
+        )
+
+    max_workers = min(COUNTER_MAX_WORKERS, len(periods))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _merge_top_keys, username, period, counts, expiry[period]
+            ): (username, period)
+            for (username, period), counts in periods.items()
+        }
+        for future, (username, period) in futures.items():
+            try:
+                future.result()
+            except Exception:
+                logger.exception(f"Failed to update top keys {username}/{period}")
+
+
+def _merge_top_keys(
+    username: str, period: str, counts: Counter, expires_at: Optional[dt.datetime]
+) -> None:
+    for attempt in range(TOP_KEYS_MAX_RETRIES + 1):
         try:
-            event_counter = EventCounter.get(username, event_name)
+            model = TopKeys.get(username, period)
+            summary = SpaceSaving.from_json(model.summary, TOP_KEYS_CAPACITY)
         except DoesNotExist:
-            event_counter = EventCounter(username, event_name)
-            event_counter.save()
-        # Increment the count
-        event_counter.update(
-            actions=[EventCounter.count.set(EventCounter.count + count)]  # type: ignore
-        )
+            model = TopKeys(username, period)
+            summary = SpaceSaving(TOP_KEYS_CAPACITY)
+        summary.update(counts)
+        model.summary = summary.to_json(TOP_KEYS_MAX_SUMMARY_BYTES)
+        model.expires_at = expires_at
+        try:
+            model.save()
+            return
+        except PutError as e:
+            if e.cause_response_code != "ConditionalCheckFailedException":
+                raise
+            if attempt == TOP_KEYS_MAX_RETRIES:
+                raise
 
 
 class EventParseError(BaseException):
     """Exception in parsing event"""
 
 
+class RecordReadError(Exception):
+    """Some of the objects in an S3 notification couldn't be read"""
+
+
+MS_PER_HOUR = 3_600_000
+
+
+def to_timestamp(received_at) -> dt.datetime:
+    try:
+        timestamp = dt.datetime.utcfromtimestamp(received_at / 1000)
+    except Exception as e:
+        logger.exception("Unknown error constructing timestamp")
+        raise EventParseError(e)
+
+    return timestamp
+
+
+def hour_of(received_at) -> int:
+    """The hour since the Unix epoch that received_at falls in."""
+    try:
+        return int(received_at // MS_PER_HOUR)
+    except Exception as e:
+        logger.exception("Unknown error constructing timestamp")
+        raise EventParseError(e)
+
+
+# Every event in an hour shares its partition path and day, so they're only
+# formatted once per hour rather than once per event.
+@lru_cache(maxsize=4096)
+def partition_path(event_type: str, hour: int) -> str:
+    timestamp = to_timestamp(hour * MS_PER_HOUR)
+    path = (
+        f"{event_type}"
+        f"/year={timestamp.year}"
+        f"/month={timestamp.month}"
+        f"/day={timestamp.day}"
+        f"/hour={timestamp.hour}"
+    )
+    return path
+
+
+@lru_cache(maxsize=1024)
+def utc_day(hour: int) -> str:
+    return f"{to_timestamp(hour * MS_PER_HOUR):%Y-%m-%d}"
+
+
 class S3LocationMapper:
     def __init__(self):
         self.locations: Dict[Tuple[str, str], str] = {}
-        self.event_store: Dict[Tuple[str, str], List[dict]] = defaultdict(list)
+        # Each partition's events, encoded and newline-delimited as they'll be
+        # written.
+        self.event_store: Dict[Tuple[str, str], bytearray] = defaultdict(bytearray)
 
     @staticmethod
     def get_bucket(username: str) -> str:
         return f"{username}-raw-events"
 
-    def _construct_path(self, event_type: str, timestamp: dt.datetime) -> str:
-        path = (
-            f"{event_type}"
-            f"/year={timestamp.year}"
-            f"/month={timestamp.month}"
-            f"/day={timestamp.day}"
-            f"/hour={timestamp.hour}"
-        )
-        return path
-
-    @staticmethod
-    def parse_timestamp(event: dict) -> dt.datetime:
-        received_at = event["received_at"]
-        try:
-            timestamp = dt.datetime.utcfromtimestamp(received_at / 1000)
-        except Exception as e:
-            logger.exception("Unknown error constructing timestamp")
-            raise EventParseError(e)
-
-        return timestamp
-
     def add(self, event: dict, username: str, event_type: str) -> None:
-        timestamp = self.parse_timestamp(event)
+        received_at = event["received_at"]
         bucket = self.get_bucket(username)
-        path = self._construct_path(event_type, timestamp)
-        if (bucket, path) in self.locations:
-            key = self.locations[(bucket, path)]
-        else:
+        path = partition_path(event_type, hour_of(received_at))
+        key = self.locations.get((bucket, path))
+        if key is None:
+            timestamp = to_timestamp(received_at)
             key = (
                 f"{path}/records-{timestamp.year:04d}-{timestamp.month:02d}-"
                 f"{timestamp.day:02d}-{timestamp.hour:02d}-{timestamp.minute:02d}-"
@@ -97,60 +325,175 @@ class S3LocationMapper:
             )
             self.locations[(bucket, path)] = key
 
-        self.event_store[(bucket, key)].append(event)
+        # Encoding each event as it's routed means that only the bytes to be
+        # written are kept, not the decoded events.
+        buffer = self.event_store[(bucket, key)]
+        if buffer:
+            buffer += b"\n"
+        buffer += codec.dumps(event)
+
+    def merge(self, other: "S3LocationMapper") -> None:
+        """Move another mapper's events in, keeping one key per location."""
+        for (bucket, path), other_key in other.locations.items():
+            key = self.locations.setdefault((bucket, path), other_key)
+            buffer = self.event_store[(bucket, key)]
+            if buffer:
+                buffer += b"\n"
+            buffer += other.event_store[(bucket, other_key)]
+
+
+class Batch:
+    """Events read from one or more Firehose objects, routed and counted."""
+
+    def __init__(self):
+        self.loc_mapper = S3LocationMapper()
+        self.counter: Counter = Counter()
+        self.key_counts: Dict[Tuple[str, str, str], Counter] = defaultdict(Counter)
+        # The (username, event_id) pairs of the events in the batch.
+        self.event_ids: Set[Tuple[str, str]] = set()
+
+    def add(self, event: dict, username: str, event_type: str) -> None:
+        self.loc_mapper.add(event, username, event_type)
+        self.counter[(username, event_type)] += 1
+        top_key_field = TOP_KEY_FIELDS.get(event_type)
+        if top_key_field in event:
+            day = utc_day(hour_of(event["received_at"]))
+            self.key_counts[(username, event_type, day)][event[top_key_field]] += 1
+
+    def merge(self, other: "Batch") -> None:
+        self.loc_mapper.merge(other.loc_mapper)
+        self.counter.update(other.counter)
+        for key, counts in other.key_counts.items():
+            self.key_counts[key].update(counts)
+        self.event_ids |= other.event_ids
 
 
 @lru_cache(maxsize=32)
 def bucket_exists(bucket_name: str) -> bool:
-    s3 = boto3.resource("s3")
-    bucket = s3.Bucket(bucket_name)
     try:
-        s3.meta.client.head_bucket(Bucket=bucket.name)
+        get_client("s3").head_bucket(Bucket=bucket_name)
         exists = True
     except ClientError:
         exists = False
     return exists
 
 
-def put_events(events: List[dict], bucket: str, key: str) -> None:
-    s3_client = boto3.client("s3")
+class BucketNotFound(Exception):
+    """A user's bucket doesn't exist"""
+
+
+def put_object(bucket: str, key: str, body: bytes) -> None:
+    """Put an object, retrying throttling with backoff."""
+    s3_client = get_client("s3")
+    for attempt in range(UPLOAD_MAX_RETRIES + 1):
+        try:
+            s3_client.put_object(
+                Bucket=bucket, Key=key, Body=body, ContentType="application/json"
+            )
+            return
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in RETRYABLE_ERROR_CODES or attempt == UPLOAD_MAX_RETRIES:
+                raise
+        backoff(attempt)
+
+
+def put_events(body: bytes, bucket: str, key: str) -> int:
+    """
+    Write newline-delimited events to a user's bucket. Returns the number of bytes
+    written.
+    """
     if not bucket_exists(bucket):
-        logger.exception(f"No bucket found for bucket {bucket}")
-        # TODO: Throw them into a "not found" bin.
-        return
-    body = "\n".join(json.dumps(e) for e in events)
-    body = body.rstrip("\n")
-    s3_client.put_object(
-        Bucket=bucket, Key=key, Body=body, ContentType="application/json"
-    )
+        raise BucketNotFound(bucket)
+    put_object(bucket, key, body)
+    return len(body)
+
+
+def dead_letter_key(bucket: str, key: str) -> str:
+    return f"{DEAD_LETTER_PREFIX}/{bucket}/{key}"
 
 
-def download_key(bucket: str, key: str) -> List[str]:
-    s3_client = boto3.client("s3")
+def write_partition(
+    body: bytes, bucket: str, key: str, dead_letter_bucket: str
+) -> Tuple[str, int]:
+    """
+    Write one partition's events, falling back to the dead-letter prefix. Returns
+    where they went ("written" or "dead_lettered") and the number of bytes.
+    """
+    try:
+        return "written", put_events(body, bucket, key)
+    except BucketNotFound:
+        logger.error(f"No bucket found for bucket {bucket}")
+    except Exception:
+        logger.exception(f"Failed to put events in {bucket}/{key}")
+    put_object(dead_letter_bucket, dead_letter_key(bucket, key), body)
+    return "dead_lettered", len(body)
+
+
+def write_partitions(
+    event_store: Dict[Tuple[str, str], bytearray], dead_letter_bucket: str
+) -> Dict[str, int]:
+    """Write every partition concurrently, and summarize what was written."""
+    summary = {
+        "objects_written": 0,
+        "bytes_written": 0,
+        "objects_dead_lettered": 0,
+        "bytes_dead_lettered": 0,
+        "objects_failed": 0,
+    }
+    if not event_store:
+        return summary
+    max_workers = min(UPLOAD_MAX_WORKERS, len(event_store))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            (bucket, key): executor.submit(
+                write_partition, body, bucket, key, dead_letter_bucket
+            )
+            for (bucket, key), body in event_store.items()
+        }
+        for (bucket, key), future in futures.items():
+            try:
+                outcome, num_bytes = future.result()
+            except Exception:
+                logger.exception(f"Lost events for {bucket}/{key}")
+                summary["objects_failed"] += 1
+                continue
+            summary[f"objects_{outcome}"] += 1
+            summary[f"bytes_{outcome}"] += num_bytes
+    return summary
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Split a stream of chunks into newline-delimited lines, skipping blank ones."""
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        yield from (line for line in lines if line)
+    if pending:
+        yield pending
+
+
+def download_key(bucket: str, key: str) -> Iterator[bytes]:
+    """Stream an object's lines without reading the whole object into memory."""
+    s3_client = get_client("s3")
     response = s3_client.get_object(Bucket=bucket, Key=key)
-    body = response["Body"].read()
-    # Convert to string
-    body = body.decode("utf-8")
-    # There will always be a trailing newline
-    body = body.rstrip("\n")
-    # Now, split up each event into its own json string
-    body = body.split("\n")
-    return body
-
-
-def handler(lambda_event: dict, lambda_context: dict) -> None:
-    source_bucket = lambda_event["Records"][0]["s3"]["bucket"]["name"]
-    key = urllib.parse.unquote_plus(lambda_event["Records"][0]["s3"]["object"]["key"])
-    logger.info(f"Reading {key} from {source_bucket}")
-
-    events = download_key(source_bucket, key)
-    loc_mapper = S3LocationMapper()
-    counter: Counter = Counter()
-
-    for event_string in events:
+    return iter_lines(response["Body"].iter_chunks(DOWNLOAD_CHUNK_SIZE))
+
+
+def read_record(
+    bucket: str, key: str, skip_event_ids: AbstractSet[Tuple[str, str]] = frozenset()
+) -> Batch:
+    """
+    Download one Firehose object and route its events, dropping repeated events
+    and any whose (username, event_id) is in skip_event_ids.
+    """
+    logger.info(f"Reading {key} from {bucket}")
+    batch = Batch()
+    for event_string in download_key(bucket, key):
         try:
-            event: dict = cast(dict, json.loads(event_string))
-        except json.JSONDecodeError:
+            event: dict = cast(dict, codec.loads(event_string))
+        except codec.JSONDecodeError:
             logger.exception("Failed to load decode event")
             continue
 
@@ -161,13 +504,58 @@ def handler(lambda_event: dict, lambda_context: dict) -> None:
             logger.exception(f"Missing required key for event {event}")
             continue
 
-        loc_mapper.add(event, username, event_type)
-        counter[(username, event_type)] += 1
-
-    update_dynamo(counter)
-
-    for (bucket, key), events in loc_mapper.event_store.items():
-        try:
-            put_events(events, bucket, key)
-        except:
-            logger.exception(f"Unknown error putting events in {bucket}/{key}")
+        # Firehose may deliver a retried event twice. The collector drops most
+        # repeats of events with an event_id, and any that got through end up here.
+        event_id = event.get("event_id")
+        if event_id is not None:
+            pair = (username, event_id)
+            if pair in batch.event_ids or pair in skip_event_ids:
+                logger.info(f"Dropping duplicate event {event_id} for {username}")
+                continue
+            batch.event_ids.add(pair)
+
+        batch.add(event, username, event_type)
+    return batch
+
+
+def handler(lambda_event: dict, lambda_context: dict) -> dict:
+    records = [
+        (
+            record["s3"]["bucket"]["name"],
+            urllib.parse.unquote_plus(record["s3"]["object"]["key"]),
+        )
+        for record in lambda_event["Records"]
+    ]
+    batch = Batch()
+    failed_records = []
+    max_workers = max(1, min(RECORD_MAX_WORKERS, len(records)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(read_record, bucket, key) for bucket, key in records]
+        for (bucket, key), future in zip(records, futures):
+            try:
+                record_batch = future.result()
+                if failed_records:
+                    continue
+                # Events only count as seen once the object holding them has been
+                # read. An object that repeats some of them is read again without.
+                if not record_batch.event_ids.isdisjoint(batch.event_ids):
+                    record_batch = read_record(bucket, key, batch.event_ids)
+                batch.merge(record_batch)
+            except (Exception, EventParseError):
+                logger.exception(f"Failed to read {key} from {bucket}")
+                failed_records.append(f"{bucket}/{key}")
+
+    # Nothing has been written yet, so failing the invocation lets S3 retry all of
+    # its records without counting any twice.
+    if failed_records:
+        raise RecordReadError(f"Failed to read {', '.join(failed_records)}")
+
+    update_dynamo(batch.counter)
+    update_top_keys(batch.key_counts)
+
+    # An S3 notification only holds records from one bucket.
+    source_bucket = records[0][0] if records else ""
+    summary = write_partitions(batch.loc_mapper.event_store, source_bucket)
+    logger.info(f"Finished writing partitions: {summary}")
+
+    return {"records": len(records), **summary}
@@ -1,9 +1,27 @@
+from collections import Counter
 import datetime as dt
+import os
+import subprocess
+import sys
 from unittest import mock
 
+from botocore.client import ClientError
+from moto import mock_dynamodb2, mock_s3
+import pytest
+
 import main
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Tables and buckets are only created inside each test's mocks.
+    main.ensure_table.cache_clear()
+    main.bucket_exists.cache_clear()
+    yield
+    main.ensure_table.cache_clear()
+    main.bucket_exists.cache_clear()
+
+
 def dt_to_epoch_ms(datetime_):
     return datetime_.replace(tzinfo=dt.timezone.utc).timestamp() * 1_000
 
@@ -38,7 +56,9 @@ class TestS3LocationMapper:
         expected_locations = {(expected_bucket, expected_path): expected_key}
         assert mgr.locations == expected_locations
 
-        expected_event_store = {(expected_bucket, expected_key): [event]}
+        expected_event_store = {
+            (expected_bucket, expected_key): main.codec.dumps(event)
+        }
         assert mgr.event_store == expected_event_store
 
     def test_put_two_events_with_same_path_for_same_user(self):
@@ -65,7 +85,9 @@ class TestS3LocationMapper:
         assert mgr.locations == expected_locations
 
         expected_event_store = {
-            (expected_bucket, expected_key): [first_event, second_event]
+            (expected_bucket, expected_key): main.codec.dumps(first_event)
+            + b"\n"
+            + main.codec.dumps(second_event)
         }
         assert mgr.event_store == expected_event_store
 
@@ -99,8 +121,8 @@ class TestS3LocationMapper:
         assert mgr.locations == expected_locations
 
         expected_event_store = {
-            (expected_bucket, first_key): [first_event],
-            (expected_bucket, second_key): [second_event],
+            (expected_bucket, first_key): main.codec.dumps(first_event),
+            (expected_bucket, second_key): main.codec.dumps(second_event),
         }
         assert mgr.event_store == expected_event_store
 
@@ -136,7 +158,317 @@ class TestS3LocationMapper:
         assert mgr.locations == expected_locations
 
         expected_event_store = {
-            (first_bucket, first_key): [first_event],
-            (second_bucket, second_key): [second_event],
+            (first_bucket, first_key): main.codec.dumps(first_event),
+            (second_bucket, second_key): main.codec.dumps(second_event),
         }
         assert mgr.event_store == expected_event_store
+
+
+def test_handler_drops_duplicate_events():
+    lambda_event = {
+        "Records": [{"s3": {"bucket": {"name": "source"}, "object": {"key": "key"}}}]
+    }
+    received_at = dt_to_epoch_ms(dt.datetime(2021, 2, 1, 0, 1))
+    events = [
+        {"event_type": "button_click", "username": "a", "event_id": "1"},
+        {"event_type": "button_click", "username": "a", "event_id": "1"},
+        {"event_type": "button_click", "username": "b", "event_id": "1"},
+        {"event_type": "button_click", "username": "a"},
+        {"event_type": "button_click", "username": "a"},
+    ]
+    lines = [
+        main.codec.dumps({"received_at": received_at, **event}) for event in events
+    ]
+    with mock.patch.object(main, "download_key", return_value=lines), mock.patch.object(
+        main, "update_dynamo"
+    ) as update_dynamo, mock.patch.object(main, "update_top_keys"), mock.patch.object(
+        main, "put_events"
+    ) as put_events:
+        main.handler(lambda_event, {})
+
+    (counter,), _ = update_dynamo.call_args
+    assert counter == {("a", "button_click"): 3, ("b", "button_click"): 1}
+    bodies = [call[0][0] for call in put_events.call_args_list]
+    assert sum(len(body.split(b"\n")) for body in bodies) == 4
+
+
+def s3_notification(*keys):
+    return {
+        "Records": [
+            {"s3": {"bucket": {"name": "source"}, "object": {"key": key}}}
+            for key in keys
+        ]
+    }
+
+
+def download_events(bucket, key):
+    if key == "broken":
+        raise ValueError("Can't read this")
+    received_at = dt_to_epoch_ms(dt.datetime(2021, 2, 1, 0, 1))
+    events = [
+        {"event_type": "page_view", "username": "a", "url": key},
+        # A repeat of an event from another object.
+        {"event_type": "page_view", "username": "a", "event_id": "1"},
+    ]
+    return [main.codec.dumps({"received_at": received_at, **event}) for event in events]
+
+
+def test_handler_reads_every_record():
+    with mock.patch.object(
+        main, "download_key", side_effect=download_events
+    ) as download_key, mock.patch.object(
+        main, "update_dynamo"
+    ) as update_dynamo, mock.patch.object(
+        main, "update_top_keys"
+    ) as update_top_keys, mock.patch.object(
+        main, "put_events", return_value=100
+    ) as put_events:
+        response = main.handler(s3_notification("first", "second"), {})
+
+    assert response["records"] == 2
+    # "second" repeats an event from "first", so it's read again without it.
+    assert download_key.call_count == 3
+    assert response["objects_written"] == 1
+    assert response["bytes_written"] == 100
+    update_dynamo.assert_called_once_with({("a", "page_view"): 3})
+    (key_counts,), _ = update_top_keys.call_args
+    assert key_counts == {("a", "page_view", "2021-02-01"): {"first": 1, "second": 1}}
+    # Events from both objects for the same hour go in one object.
+    put_events.assert_called_once()
+    assert len(put_events.call_args[0][0].split(b"\n")) == 3
+
+
+def test_handler_fails_before_writing_if_a_record_fails():
+    with mock.patch.object(
+        main, "download_key", side_effect=download_events
+    ), mock.patch.object(main, "update_dynamo") as update_dynamo, mock.patch.object(
+        main, "update_top_keys"
+    ) as update_top_keys, mock.patch.object(
+        main, "put_events"
+    ) as put_events:
+        with pytest.raises(main.RecordReadError, match="source/broken"):
+            main.handler(s3_notification("first", "broken", "second"), {})
+
+    update_dynamo.assert_not_called()
+    update_top_keys.assert_not_called()
+    put_events.assert_not_called()
+
+
+def test_read_record_skips_events():
+    with mock.patch.object(main, "download_key", side_effect=download_events):
+        batch = main.read_record("source", "first", {("a", "1")})
+    assert batch.counter == {("a", "page_view"): 1}
+    assert batch.event_ids == set()
+
+
+def test_read_record_output_format():
+    # Consumers read each event as the collector wrote it, without the username and
+    # event type, which are in the bucket and path.
+    event = {
+        "session_id": "XYZ",
+        "url": "https://example.com/ü",
+        "event_id": "1",
+        "username": "a",
+        "event_type": "page_view",
+        "received_at": 1612137660123,
+    }
+    with mock.patch.object(
+        main, "download_key", return_value=[main.codec.dumps(event)]
+    ):
+        batch = main.read_record("source", "key")
+    ((_, body),) = batch.loc_mapper.event_store.items()
+    assert body == (
+        b'{"session_id":"XYZ","url":"https://example.com/\xc3\xbc","event_id":"1",'
+        b'"received_at":1612137660123}'
+    )
+    assert batch.key_counts == {
+        ("a", "page_view", "2021-02-01"): {"https://example.com/ü": 1}
+    }
+
+
+def test_location_mapper_merge():
+    first, second = main.S3LocationMapper(), main.S3LocationMapper()
+    event = {"received_at": dt_to_epoch_ms(dt.datetime(2021, 2, 1, 0, 1))}
+    first.add(event, "a", "page_view")
+    second.add(event, "a", "page_view")
+    second.add(event, "b", "page_view")
+    first.merge(second)
+    assert len(first.event_store) == 2
+    assert sorted(body.count(b"\n") for body in first.event_store.values()) == [0, 1]
+
+
+def test_iter_lines():
+    chunks = [b'{"a": 1}\n{"b"', b": 2}", b"\n\n", b'{"c": 3}\n']
+    assert list(main.iter_lines(chunks)) == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+    # Firehose objects end in a newline, but the last line is kept if one doesn't.
+    assert list(main.iter_lines([b"x\ny"])) == [b"x", b"y"]
+    assert list(main.iter_lines([])) == []
+
+
+@mock_s3
+def test_download_key():
+    s3_client = main.get_client("s3")
+    s3_client.create_bucket(Bucket="source")
+    body = b"".join(main.codec.dumps({"n": n}) + b"\n" for n in range(1000))
+    s3_client.put_object(Bucket="source", Key="key", Body=body)
+    with mock.patch.object(main, "DOWNLOAD_CHUNK_SIZE", 100):
+        lines = list(main.download_key("source", "key"))
+    assert lines == [main.codec.dumps({"n": n}) for n in range(1000)]
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code}}, "PutObject")
+
+
+def test_put_object_retries_throttling():
+    s3_client = mock.Mock()
+    s3_client.put_object.side_effect = [client_error("SlowDown"), None]
+    with mock.patch.object(
+        main, "get_client", return_value=s3_client
+    ), mock.patch.object(main.time, "sleep") as sleep:
+        main.put_object("bucket", "key", b"body")
+    assert s3_client.put_object.call_count == 2
+    sleep.assert_called_once()
+
+    s3_client.put_object.reset_mock()
+    s3_client.put_object.side_effect = client_error("AccessDenied")
+    with mock.patch.object(main, "get_client", return_value=s3_client):
+        with pytest.raises(ClientError):
+            main.put_object("bucket", "key", b"body")
+    assert s3_client.put_object.call_count == 1
+
+
+@mock_s3
+def test_write_partitions_dead_letters_missing_buckets():
+    s3_client = main.get_client("s3")
+    s3_client.create_bucket(Bucket="source")
+    s3_client.create_bucket(Bucket="a-raw-events")
+    event_store = {
+        ("a-raw-events", "page_view/records-a"): bytearray(b'{"url":"x"}\n{"url":"y"}'),
+        ("b-raw-events", "page_view/records-b"): bytearray(b'{"url":"z"}'),
+    }
+    summary = main.write_partitions(event_store, "source")
+
+    assert summary == {
+        "objects_written": 1,
+        "bytes_written": len(b'{"url":"x"}\n{"url":"y"}'),
+        "objects_dead_lettered": 1,
+        "bytes_dead_lettered": len(b'{"url":"z"}'),
+        "objects_failed": 0,
+    }
+    dead_letter = s3_client.get_object(
+        Bucket="source", Key="dead-letter/b-raw-events/page_view/records-b"
+    )
+    assert dead_letter["Body"].read() == b'{"url":"z"}'
+
+
+@mock_dynamodb2
+def test_update_dynamo():
+    main.update_dynamo(Counter({("a", "page_view"): 3, ("b", "page_view"): 1}))
+    main.update_dynamo(Counter({("a", "page_view"): 2}))
+    assert main.EventCounter.get("a", "page_view").count == 5
+    assert main.EventCounter.get("b", "page_view").count == 1
+
+
+def test_add_count_retries_throttling():
+    throttle = main.UpdateError(
+        "Throttled", cause=client_error("ProvisionedThroughputExceededException")
+    )
+    with mock.patch.object(
+        main.EventCounter, "update", side_effect=[throttle, None]
+    ) as update, mock.patch.object(main.time, "sleep") as sleep:
+        main.add_count("a", "page_view", 1)
+    assert update.call_count == 2
+    sleep.assert_called_once()
+
+    failure = main.UpdateError("Failed", cause=client_error("ValidationException"))
+    with mock.patch.object(main.EventCounter, "update", side_effect=failure) as update:
+        with pytest.raises(main.UpdateError):
+            main.add_count("a", "page_view", 1)
+    assert update.call_count == 1
+
+
+@mock_dynamodb2
+def test_update_top_keys():
+    main.update_top_keys(
+        {
+            ("a", "page_view", "2021-02-01"): Counter({"x.com": 3, "y.com": 1}),
+            ("a", "page_view", "2021-02-02"): Counter({"y.com": 5}),
+        }
+    )
+    main.update_top_keys({("a", "page_view", "2021-02-02"): Counter({"x.com": 1})})
+
+    def top(period):
+        summary = main.TopKeys.get("a", period)
+        return main.SpaceSaving.from_json(summary.summary, 10).top(10)
+
+    assert top("page_view") == [("y.com", 6, 0), ("x.com", 4, 0)]
+    assert top("page_view#2021-02-01") == [("x.com", 3, 0), ("y.com", 1, 0)]
+    assert top("page_view#2021-02-02") == [("y.com", 5, 0), ("x.com", 1, 0)]
+    assert main.TopKeys.get("a", "page_view").expires_at is None
+    assert (
+        main.TopKeys.get("a", "page_view#2021-02-01").expires_at
+        == dt.datetime(2021, 2, 2, tzinfo=dt.timezone.utc)
+        + main.TOP_KEYS_DAILY_RETENTION
+    )
+
+
+@mock_dynamodb2
+def test_update_top_keys_truncates_long_keys():
+    long_url = "x.com/?q=" + "a" * 2 * main.TOP_KEYS_MAX_KEY_LENGTH
+    main.update_top_keys(
+        {("a", "page_view", "2021-02-01"): Counter({long_url: 2, long_url + "b": 1})}
+    )
+    summary = main.TopKeys.get("a", "page_view").summary
+    assert main.SpaceSaving.from_json(summary, 10).top(10) == [
+        (long_url[: main.TOP_KEYS_MAX_KEY_LENGTH], 3, 0)
+    ]
+
+
+@mock_dynamodb2
+def test_update_top_keys_skips_failures():
+    merge = main._merge_top_keys
+
+    def merge_or_fail(username, *args):
+        if username == "a":
+            raise main.PutError("Failed")
+        merge(username, *args)
+
+    with mock.patch.object(main, "_merge_top_keys", side_effect=merge_or_fail):
+        main.update_top_keys(
+            {
+                ("a", "page_view", "2021-02-01"): Counter({"x.com": 1}),
+                ("b", "page_view", "2021-02-01"): Counter({"y.com": 1}),
+            }
+        )
+    with pytest.raises(main.DoesNotExist):
+        main.TopKeys.get("a", "page_view")
+    assert main.TopKeys.get("b", "page_view").summary
+    assert main.TopKeys.get("b", "page_view#2021-02-01").summary
+
+
+IMPORT_SCRIPT = """
+import sys
+import time
+
+start = time.perf_counter()
+import main
+print(time.perf_counter() - start, "boto3" in sys.modules)
+"""
+
+
+def test_import_time_budget():
+    # fan_out needs S3 and DynamoDB on every invocation, so pynamodb, and botocore
+    # with it, are imported at startup. boto3 is only imported once the first S3
+    # client is created.
+    budget_seconds = float(os.environ.get("STARTUP_BUDGET_SECONDS", 1.5))
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    import_seconds, boto3_imported = output.split()
+    assert float(import_seconds) < budget_seconds
+    assert boto3_imported == "False"
@@ -0,0 +1,59 @@
+from collections import Counter
+import random
+
+from topk import SpaceSaving
+
+
+def test_exact_under_capacity():
+    summary = SpaceSaving(10)
+    summary.update({"a": 3, "b": 1})
+    summary.update({"b": 4, "c": 1})
+    assert summary.top(2) == [("b", 5, 0), ("a", 3, 0)]
+
+
+def test_replaces_least_frequent_key():
+    summary = SpaceSaving(2)
+    summary.update({"a": 5, "b": 2})
+    summary.update({"c": 1})
+    # c takes over b's count, which it may overestimate by up to 2.
+    assert summary.top(2) == [("a", 5, 0), ("c", 3, 2)]
+
+
+def test_finds_heavy_hitters():
+    rng = random.Random(0)
+    keys = [f"page-{idx}" for idx in range(1_000)]
+    # A few pages get most of the views, and the rest a long tail.
+    stream = ["home"] * 3_000 + ["pricing"] * 2_000 + ["docs"] * 1_000
+    stream += rng.choices(keys, k=10_000)
+    rng.shuffle(stream)
+    exact = Counter(stream)
+
+    summary = SpaceSaving(50)
+    for start in range(0, len(stream), 500):
+        summary.update(Counter(stream[start : start + 500]))
+
+    top = summary.top(3)
+    assert [key for key, _, _ in top] == ["home", "pricing", "docs"]
+    for key, count, error in top:
+        # Counts are upper bounds, and error bounds how far off they are.
+        assert count - error <= exact[key] <= count
+
+
+def test_json_round_trip():
+    summary = SpaceSaving(3)
+    summary.update({"a": 3, "b": 2, "c": 1})
+    restored = SpaceSaving.from_json(summary.to_json(), 3)
+    assert restored.top(3) == summary.top(3)
+    # A lower capacity keeps the most frequent keys.
+    assert SpaceSaving.from_json(summary.to_json(), 2).top(3) == summary.top(2)
+
+
+def test_json_max_bytes():
+    summary = SpaceSaving(3)
+    summary.update({"a": 3, "b": 2, "c": 1})
+    full = summary.to_json()
+    assert summary.to_json(len(full)) == full
+    # Too small for the last entry, so the least frequent key is left out.
+    trimmed = summary.to_json(len(full) - 1)
+    assert SpaceSaving.from_json(trimmed, 3).top(3) == summary.top(2)
+    assert summary.to_json(1) == "[]"
@@ -0,0 +1,64 @@
+"""
+Space-Saving summaries of the most frequent keys in a stream.
+
+A summary holds at most `capacity` keys, each with a count and the most that the
+count may overestimate the key's true count by. Any key whose true count is more
+than 1/capacity of the total is guaranteed to be in the summary. The collector
+reads the summaries that fan_out writes, so the serialized format must not change
+without changing collector.dynamo.get_top_keys too.
+"""
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import codec
+
+
+class SpaceSaving:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        # key -> [count, error]
+        self.entries: Dict[str, List[int]] = {}
+
+    def update(self, counts: Mapping[str, int]) -> None:
+        """Add a batch of counts per key."""
+        # Adding the largest counts first keeps the overestimates small.
+        for key, count in sorted(counts.items(), key=lambda item: -item[1]):
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry[0] += count
+            elif len(self.entries) < self.capacity:
+                self.entries[key] = [count, 0]
+            else:
+                # Replace the least frequent key, which this one may have outnumbered.
+                min_key = min(self.entries, key=lambda k: self.entries[k][0])
+                min_count = self.entries.pop(min_key)[0]
+                self.entries[key] = [min_count + count, min_count]
+
+    def top(self, k: int) -> List[Tuple[str, int, int]]:
+        """The k most frequent keys as (key, count, error), most frequent first."""
+        ranked = sorted(self.entries.items(), key=lambda item: -item[1][0])
+        return [(key, count, error) for key, (count, error) in ranked[:k]]
+
+    def to_json(self, max_bytes: Optional[int] = None) -> str:
+        """
+        Serialize the summary. With max_bytes, the least frequent keys are left out
+        of it until it fits.
+        """
+        entries = self.top(self.capacity)
+        if max_bytes is not None:
+            size = 2  # The enclosing brackets
+            for idx, entry in enumerate(entries):
+                # Each entry after the first is preceded by a comma.
+                size += len(codec.dumps(entry)) + (idx > 0)
+                if size > max_bytes:
+                    entries = entries[:idx]
+                    break
+        return codec.dumps(entries).decode("utf-8")
+
+    @classmethod
+    def from_json(cls, data: str, capacity: int) -> "SpaceSaving":
+        summary = cls(capacity)
+        entries = codec.loads(data)
+        # The capacity may have been lowered since the summary was saved.
+        for key, count, error in entries[:capacity]:
+            summary.entries[key] = [count, error]
+        return summary